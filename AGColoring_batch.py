@@ -0,0 +1,112 @@
+import math
+import numpy as np
+import lib, vis
+
+
+# Whole-graph version of AGColoring_mps.Processor.
+# All nodes advance one synchronous round at a time: colors are kept as two int arrays
+# (a, b) and neighbors are gathered from the CSR adjacency (indptr, indices).
+# Returns (a, b, history). history is a list with one (a, b) pair of arrays per round,
+# in the same order as Processor.color_history, or None if record_history is False.
+def ag_coloring(indptr, indices, colors, delta, q, record_history=True):
+    n = len(indptr) - 1
+    colors = np.asarray(colors, dtype=np.int64)
+    a, b = colors // q, colors % q
+
+    # Directed edges (owner -> neighbor) of nodes that are not finalized yet.
+    # Finalized nodes never change their color again, so their edges are dropped.
+    edge_owner = np.repeat(np.arange(n), np.diff(indptr))
+    edge_nb = indices
+    finalized = np.zeros(n, dtype=bool)
+
+    history = [] if record_history else None
+
+    def record():
+        if history is not None:
+            history.append((a.astype(np.int32), b.astype(np.int32)))
+
+    record()
+
+    # Additive-group coloring
+    for _ in range(q):
+        conflict = np.zeros(n, dtype=bool)
+        conflict[edge_owner[b[edge_nb] == b[edge_owner]]] = True
+        step = conflict & ~finalized
+        done = ~conflict & ~finalized
+        b[step] = (a[step] + b[step]) % q
+        a[done] = 0
+        finalized |= done
+        record()
+
+        if done.any():
+            keep = ~finalized[edge_owner]
+            edge_owner, edge_nb = edge_owner[keep], edge_nb[keep]
+
+    assert finalized.all()
+
+    # Standard color reduction. Nodes sharing color j form an independent set,
+    # so they can all pick their new color in the same round. Picked colors are
+    # at most delta, so the groups of the remaining rounds do not change.
+    by_color = np.argsort(b, kind='mergesort')
+    bounds = np.searchsorted(b[by_color], np.arange(q + 2))
+    for j in range(q, delta, -1):
+        sel = by_color[bounds[j]:bounds[j + 1]]
+        if len(sel) > 0:
+            b[sel] = pick_free_colors(indptr, indices, b, sel, delta)
+            a[sel] = 0
+        record()
+
+    return a, b, history
+
+
+# For each node in sel, the smallest color in [0, delta] not used by its neighbors.
+def pick_free_colors(indptr, indices, b, sel, delta):
+    starts = indptr[sel]
+    lens = indptr[sel + 1] - starts
+    rows = np.repeat(np.arange(len(sel)), lens)
+    offsets = np.arange(lens.sum()) - np.repeat(np.cumsum(lens) - lens, lens)
+    nb_colors = b[indices[np.repeat(starts, lens) + offsets]]
+
+    in_palette = nb_colors <= delta
+    used = np.zeros((len(sel), delta + 1), dtype=bool)
+    used[rows[in_palette], nb_colors[in_palette]] = True
+    return np.argmin(used, axis=1)
+
+
+# Same layout as MessagePassingSystem.global_shared_memory after running AGColoring_mps
+def to_shared_memory(a, b, history=None):
+    colors = list(zip(a.tolist(), b.tolist()))
+    if history is None:
+        return {pid: {'color': color} for pid, color in enumerate(colors)}
+
+    ha = np.stack([h[0] for h in history], axis=1).tolist()
+    hb = np.stack([h[1] for h in history], axis=1).tolist()
+    return {pid: {'color_history': list(zip(ha[pid], hb[pid])), 'color': colors[pid]}
+            for pid in range(len(colors))}
+
+
+if __name__ == '__main__':
+    n = 10
+
+    G = lib.gen_random_graph(n)
+
+    delta = lib.calc_delta(G)
+    color_mapping = {pid: pid for pid in G.nodes()}
+    print('Maximum degree: ' + str(delta))
+
+    q = lib.choose_prime(math.sqrt(n))
+    if q <= 2 * delta:
+        q = lib.choose_prime(2 * delta)
+
+    indptr, indices = lib.to_csr(n, G.edges())
+    a, b, history = ag_coloring(indptr, indices, [color_mapping[pid] for pid in range(n)], delta, q)
+    global_shared_memory = to_shared_memory(a, b, history)
+
+    final_color_mapping = {i: x['color'][1] for i, x in global_shared_memory.items()}
+    text = "q=%d\n delta=%s\n #colors=%s\n AG rounds: %d\n FR rounds: %d" % \
+           (q, delta, len(set(final_color_mapping.values())),
+            max([lib.count_rounds(obj['color_history']) for obj in global_shared_memory.values()], default=0),
+            q - delta - 1)
+    node_text = {pid: 'PID: %s, original color %s, final color: %s'
+                      % (pid, color_mapping[pid], global_shared_memory[pid]['color'][1]) for pid in G.nodes()}
+    vis.plot(G, color_mapping=final_color_mapping, node_text=node_text, text=text)
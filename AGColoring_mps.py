@@ -1,10 +1,20 @@
 from MessagePassingSystem import *
+from array import array
 import math
-import lib, vis
+import lib, vis, tracing
+from congest import MsgSchema, bits_for
+from MessagePlane import field
 
 
 class Processor(AbstractProcessor):
-    def __init__(self, pid, is_async, delta, q, color):
+    __slots__ = ('delta', 'q', 'color', 'reduced_color', 'stage', 'round', 'first_stage_finalized',
+                 'color_history', 'j', 'color_palette', 'history', 'recorded')
+
+    # With record_history=False no color_history is kept, the round at which
+    # the AG coloring finalized is still saved as 'finalized_round'.
+    # history is a history.ColorHistory shared by all processors, which records only the color
+    # changes, at the indices of color_history.
+    def __init__(self, pid, is_async, delta, q, color, record_history=True, history=None):
         super().__init__(pid=pid, is_async=is_async)
         self.delta = delta
         self.q = q
@@ -17,9 +27,27 @@ class Processor(AbstractProcessor):
         self.stage = 0
         self.round = -1
         self.first_stage_finalized = False
-        self.color_history = [self.color]
+        self.color_history = [self.color] if record_history else None
         self.j = None
-        self.color_palette = set(range(self.delta + 1))
+        self.color_palette = range(self.delta + 1)
+        self.history = history
+        self.recorded = None
+        self.track(0)
+
+    # Records the current color at index of the history when it changed
+    def track(self, index):
+        if self.history is not None and self.color != self.recorded:
+            self.recorded = self.color
+            self.history.record(self.pid, index, self.recorded)
+
+    # Rounds and reduction counters of messages are at most q, both color components are below q
+    def msg_schema(self):
+        return MsgSchema((bits_for(self.q), (bits_for(self.q - 1), bits_for(self.q - 1)), 1))
+
+    # Messages are (round, color, stage), receivers know the round themselves
+    @staticmethod
+    def msg_state(msg):
+        return msg[1:]
 
     # Upon receiving PAYLOAD msg
     # If we run in sync environment, worker will receive messages
@@ -27,16 +55,19 @@ class Processor(AbstractProcessor):
     def worker(self, msgs, srcs):
         self.round += 1
         if self.round < self.q:
-            if any(map(lambda x: x[1][1] == self.color[1], msgs)):
+            if self.color[1] in field(msgs, 1, 1):
                 if not self.first_stage_finalized:
                     self.color = (self.color[0], (self.color[0] + self.color[1]) % self.q)
-                    self.log('Round %d: Conflict! New Color: %s' % (self.round, str(self.color)))
+                    self.log('Round %d: Conflict! New Color: %s', self.round, self.color)
             else:
                 self.color = (0, self.color[1])
                 if not self.first_stage_finalized:
-                    self.log('My Color: %s, finalized at round %d' % (str(self.color), self.round))
+                    self.log('My Color: %s, finalized at round %d', self.color, self.round)
                     self.first_stage_finalized = True
-            self.color_history.append(self.color)
+                    self.save_result_once('finalized_round', self.round)
+            if self.color_history is not None:
+                self.color_history.append(self.color)
+            self.track(self.round + 1)
             self.send_to_neighbors((self.round + 1, self.color, 0))
         else:
             assert self.first_stage_finalized
@@ -46,15 +77,18 @@ class Processor(AbstractProcessor):
             else:
                 if self.j > self.delta:
                     if self.color[1] == self.j:
-                        used_colors = set([msg[1][1] for msg in msgs])
-                        color_picked = min(self.color_palette - used_colors)
+                        used_colors = set(field(msgs, 1, 1))
+                        color_picked = next(c for c in self.color_palette if c not in used_colors)
                         self.color = (0, color_picked)
-                        self.log('Round %d: Final Color: %d' % (self.j, color_picked))
-                    self.color_history.append(self.color)
+                        self.log('Round %d: Final Color: %d', self.j, color_picked)
+                    if self.color_history is not None:
+                        self.color_history.append(self.color)
+                    self.track(1 + self.q + (self.q - self.j))
                     self.j -= 1
                     self.send_to_neighbors((self.j, self.color, 1))
                 else:
-                    self.save_result_once('color_history', self.color_history)
+                    if self.color_history is not None:
+                        self.save_result_once('color_history', self.color_history)
                     self.save_result_once('color', self.color)
                     self.go_inactive()
 
@@ -63,6 +97,205 @@ class Processor(AbstractProcessor):
         self.send_to_neighbors((0, self.color, 0))
 
 
+# Colors, rounds and reduction counters of all processors of a system in flat int arrays.
+# One table is shared by all CompactProcessors of a system.
+class StateTable:
+    def __init__(self, n):
+        self.a = array('q', bytes(8 * n))
+        self.b = array('q', bytes(8 * n))
+        self.round = array('q', bytes(8 * n))
+        # -1 stands for j = None
+        self.j = array('q', [-1]) * n
+        self.finalized = array('b', bytes(n))
+
+
+# Processor keeping its state in a StateTable instead of per-object tuples.
+# Pass the same table to every processor through proc_args.
+class CompactProcessor(Processor):
+    __slots__ = ('table',)
+
+    def __init__(self, pid, is_async, delta, q, color, table, record_history=False, history=None):
+        self.table = table
+        super().__init__(pid, is_async, delta, q, color, record_history=record_history, history=history)
+
+    @property
+    def color(self):
+        return self.table.a[self.pid], self.table.b[self.pid]
+
+    @color.setter
+    def color(self, color):
+        self.table.a[self.pid], self.table.b[self.pid] = color
+
+    @property
+    def round(self):
+        return self.table.round[self.pid]
+
+    @round.setter
+    def round(self, r):
+        self.table.round[self.pid] = r
+
+    @property
+    def j(self):
+        j = self.table.j[self.pid]
+        return None if j < 0 else j
+
+    @j.setter
+    def j(self, j):
+        self.table.j[self.pid] = -1 if j is None else j
+
+    @property
+    def first_stage_finalized(self):
+        return bool(self.table.finalized[self.pid])
+
+    @first_stage_finalized.setter
+    def first_stage_finalized(self, finalized):
+        self.table.finalized[self.pid] = finalized
+
+
+# Event driven variant with the same results, including color_history.
+# Colors are only sent when they change and neighbor colors are cached, so a node runs in
+# the AG stage only until it is finalized. Nodes finalizing with b > delta contribute b to the
+# 'occupied' aggregate; once it is known, a reduction round is only spent on the occupied
+# values j, in decreasing order, and only by the nodes holding b == j.
+class EventDrivenProcessor(Processor):
+    event_driven = True
+    __slots__ = ('neighbor_colors',)
+
+    def __init__(self, pid, is_async, delta, q, color, record_history=True, history=None):
+        super().__init__(pid, is_async, delta, q, color, record_history=record_history, history=history)
+        self.neighbor_colors = {}
+
+    # Repeats the last color of the history, which did not change, up to length
+    def pad_history(self, length):
+        last = self.color_history[-1]
+        while len(self.color_history) < length:
+            self.color_history.append(last)
+
+    # Sets the history entry of index to the current color
+    def record(self, index):
+        if self.color_history is not None:
+            self.pad_history(index)
+            self.color_history.append(self.color)
+        self.track(index)
+
+    def finish(self):
+        if self.color_history is not None:
+            self.pad_history(1 + self.q + (self.q - self.delta))
+            self.save_result_once('color_history', self.color_history)
+        self.save_result_once('color', self.color)
+        self.go_inactive()
+
+    def worker(self, msgs, srcs):
+        for msg, src in zip(msgs, srcs):
+            self.neighbor_colors[src] = msg[1]
+        # Same numbering as Processor.round, round 0 is the first worker call
+        self.round = self.current_round - 1
+
+        if self.round < self.q:
+            if self.first_stage_finalized:
+                return
+            color = self.color
+            if any(c[1] == color[1] for c in self.neighbor_colors.values()):
+                self.color = (color[0], (color[0] + color[1]) % self.q)
+                self.log('Round %d: Conflict! New Color: %s', self.round, self.color)
+                self.set_timer(1)
+            else:
+                self.color = (0, color[1])
+                self.log('My Color: %s, finalized at round %d', self.color, self.round)
+                self.first_stage_finalized = True
+                self.save_result_once('finalized_round', self.round)
+            self.record(self.round + 1)
+            if self.first_stage_finalized:
+                if self.color[1] > self.delta:
+                    self.contribute('occupied', self.color[1])
+                    # All nodes are finalized after round q - 1, the aggregate is known one round later
+                    self.set_timer(self.q - self.round + 1)
+                else:
+                    self.finish()
+            if self.color != color:
+                self.send_to_neighbors((self.round + 1, self.color, 0))
+            return
+
+        assert self.first_stage_finalized
+        if self.inactive:
+            return
+        occupied = sorted(self.aggregate('occupied'), reverse=True)
+        step = occupied.index(self.color[1])
+        # Reduction of occupied[k] runs k rounds after the aggregate is known, at round q + 1
+        if self.round < self.q + 1 + step:
+            self.set_timer(self.q + 1 + step - self.round)
+            return
+        self.j = self.color[1]
+        used_colors = set([c[1] for c in self.neighbor_colors.values()])
+        color_picked = next(c for c in self.color_palette if c not in used_colors)
+        self.color = (0, color_picked)
+        self.log('Round %d: Final Color: %d', self.j, color_picked)
+        self.record(1 + self.q + (self.q - self.j))
+        self.send_to_neighbors((self.j, self.color, 1))
+        self.finish()
+
+    def init_config(self):
+        self.send_to_neighbors((0, self.color, 0))
+        self.set_timer(1)
+
+
+# Smallest usable prime for AG coloring of n nodes with maximum degree delta
+def choose_q(n, delta):
+    q = lib.choose_prime(math.sqrt(n))
+    if q <= 2 * delta:
+        q = lib.choose_prime(2 * delta)
+    return q
+
+
+# Colors G starting from the trivial coloring, without tracing or drawing.
+# Returns the message passing system once it has finished, final colors are
+# global_shared_memory[pid]['color'] and its metrics are in stats.
+# resume continues the run saved in a checkpoint file, see MessagePassingSystem.restore.
+# With change_history the color changes are kept in a history.ColorHistory instead, streamed to
+# history_path if given, and returned indexed as mps.color_history (record_history is then ignored).
+def run_coloring(G, q=None, engine='inline', compact=False, record_history=True, event_driven=False, resume=None,
+                 change_history=False, history_path=None, **kwargs):
+    # A graphgen.CSRGraph, e.g. from graphio.load, goes to the system as arrays
+    if hasattr(G, 'indptr'):
+        n, nodes, edges = G.n, range(G.n), None
+        kwargs['csr'] = (G.indptr, G.indices)
+    else:
+        n, nodes, edges = G.number_of_nodes(), G.nodes(), G.edges()
+    delta = lib.calc_delta(G)
+    if q is None:
+        q = choose_q(n, delta)
+    color_history = None
+    if change_history:
+        if engine in ('sharded', 'socket') or resume is not None or kwargs.get('checkpoint_every') is not None:
+            raise ValueError('change_history is not supported by the sharded and socket engines or with checkpoints')
+        from history import ColorHistory
+        color_history = ColorHistory(n, 1 + q + (q - delta), path=history_path)
+        record_history = False
+    proc_class, extra = Processor, {'record_history': record_history, 'history': color_history}
+    if compact:
+        proc_class, extra = CompactProcessor, {'table': StateTable(n), 'record_history': record_history,
+                                               'history': color_history}
+    elif event_driven:
+        proc_class = EventDrivenProcessor
+    mps = MessagePassingSystem(proc_class=proc_class,
+                               proc_args={pid: dict(delta=delta, q=q, color=pid, **extra) for pid in nodes},
+                               n_proc=n,
+                               edges=edges,
+                               is_async=False,
+                               verbose=False,
+                               engine=engine,
+                               compact=compact,
+                               **kwargs)
+    if resume is not None:
+        mps.restore(resume)
+    mps.start()
+    mps.wait_for_all()
+    if color_history is not None:
+        color_history.close()
+        mps.color_history = color_history.index()
+    return mps
+
+
 if __name__ == '__main__':
     n = 10
 
@@ -86,9 +319,11 @@ if __name__ == '__main__':
                                n_proc=n,
                                edges=G.edges(),
                                is_async=False,
-                               max_channel_delay=0)
+                               max_channel_delay=0,
+                               tracer=tracing.Tracer(tracing.PrintSink()))
     mps.start()
     mps.wait_for_all()
+    mps.tracer.close()
     final_color_mapping = {i: x['color'][1] for i, x in mps.global_shared_memory.items()}
     text = "q=%d\n delta=%s\n #colors=%s\n AG rounds: %d\n FR rounds: %d" % \
            (q, delta, len(set(final_color_mapping.values())),
@@ -0,0 +1,173 @@
+from MessagePassingSystem import *
+import random
+import lib
+from AGColoring_mps import choose_q as ag_choose_q
+from congest import MsgSchema, bits_for
+
+
+# Self-stabilizing AG coloring. The whole state of a node is its color (a, b), it never stops and
+# recovers from any color, so transient faults and topology changes are repaired locally:
+#   a != 0: AG step, (a, b) -> (a, a + b mod q) on a conflict (a neighbor with the same b),
+#           otherwise the color is finalized as (0, b).
+#   a == 0: a finalized neighbor with the same color and a smaller pid makes the node start over
+#           from its initial color. A node with b > delta picks the smallest color of
+#           0..delta not used by a neighbor once no finalized neighbor has a larger b.
+# Initial colors have a != 0 and are distinct for n <= q * (q - 1), see choose_q.
+# Nodes only send their color when it changes (and to new neighbors), and only run on messages
+# or while they are not finalized, so after a fault only the affected neighborhood runs again.
+# delta is the largest degree the network may reach, nodes above it may keep a color > delta.
+# A fixed node never changes its color, it only sends it to its neighbors (see incremental.recolor).
+class Processor(AbstractProcessor):
+    event_driven = True
+    __slots__ = ('delta', 'q', 'color', 'sent', 'neighbor_colors', 'announce', 'fixed')
+
+    def __init__(self, pid, is_async, delta, q, color=None, fixed=False):
+        super().__init__(pid=pid, is_async=is_async)
+        self.delta = delta
+        self.q = q
+        self.fixed = fixed
+        self.color = color if color is not None else self.initial_color()
+        self.sent = None
+        self.neighbor_colors = {}
+        # New neighbors waiting for our color
+        self.announce = set()
+
+    def initial_color(self):
+        return 1 + (self.pid // self.q) % (self.q - 1), self.pid % self.q
+
+    def is_valid(self, color):
+        return isinstance(color, tuple) and len(color) == 2 and \
+            all([isinstance(x, int) and 0 <= x < self.q for x in color])
+
+    def msg_schema(self):
+        return MsgSchema((bits_for(self.q - 1), bits_for(self.q - 1)))
+
+    # Color of the next round
+    def step(self):
+        color = self.color
+        if self.fixed:
+            return color
+        if not self.is_valid(color):
+            return self.initial_color()
+        a, b = color
+        colors = self.neighbor_colors
+        if a != 0:
+            same = [src for src, c in colors.items() if c[1] == b]
+            if not same:
+                return 0, b
+            # Neighbors with the very same color would move together forever, the larger pid waits
+            if any([colors[src] == color and src < self.pid for src in same]):
+                return color
+            return a, (a + b) % self.q
+        if any([c == color and src < self.pid for src, c in colors.items()]):
+            return self.initial_color()
+        if b > self.delta and not any([c[0] == 0 and c[1] > b for c in colors.values()]):
+            used = set([c[1] for c in colors.values()])
+            free = next((c for c in range(self.delta + 1) if c not in used), None)
+            if free is not None:
+                return 0, free
+        return color
+
+    def worker(self, msgs, srcs):
+        for msg, src in zip(msgs, srcs):
+            # Messages still in flight from a removed neighbor are dropped
+            if src in self.neighbors:
+                self.neighbor_colors[src] = msg
+        color = self.step()
+        # Runs until its color is stable, e.g. a node just finalized with b > delta reduces next
+        if not self.fixed and (color != self.color or color[0] != 0):
+            self.set_timer(1)
+        if color != self.color:
+            self.log('Round %d: %s -> %s', self.current_round, self.color, color)
+            self.color = color
+        # Also after a corruption the step kept
+        self.save_result('color', color)
+        if color != self.sent:
+            self.sent = color
+            self.send_to_neighbors(color)
+        else:
+            for pid in self.announce:
+                if pid in self.neighbors:
+                    self.send(color, pid)
+        self.announce.clear()
+
+    def init_config(self):
+        self.save_result('color', self.color)
+        self.sent = self.color
+        self.send_to_neighbors(self.color)
+        if not self.fixed:
+            self.set_timer(1)
+
+    def on_corrupt(self, value):
+        self.color = value
+
+    def on_neighbor_added(self, pid):
+        self.announce.add(pid)
+
+    def on_neighbor_removed(self, pid):
+        self.neighbor_colors.pop(pid, None)
+        self.announce.discard(pid)
+
+
+# AG prime that also leaves distinct initial colors to n nodes
+def choose_q(n, delta):
+    q = ag_choose_q(n, delta)
+    while q * (q - 1) < n:
+        q = lib.choose_prime(q + 1)
+    return q
+
+
+# Whether the alive nodes of a finished system are properly colored with 0..delta
+# on the topology the system ended with
+def is_stable(mps, delta):
+    colors = {pid: x['color'] for pid, x in mps.global_shared_memory.items() if pid not in mps.crashed}
+    return all([c[0] == 0 and 0 <= c[1] <= delta for c in colors.values()]) and \
+        all([colors[u] != colors[v] for u in colors for v in mps.edge_dict[u]])
+
+
+# count faults corrupting random nodes to random colors, including invalid ones
+def random_corruptions(n, q, count, rnd=random):
+    faults = []
+    for pid in rnd.sample(range(n), count):
+        faults.append(('corrupt', pid, (rnd.randrange(q), rnd.randrange(q + 2))))
+    return faults
+
+
+# Runs the self-stabilizing coloring on G, with faults as in MessagePassingSystem. delta defaults
+# to the maximum degree of G and must bound the degrees reached through added edges.
+# Returns the finished system, stabilization metrics are in mps.stabilization.
+def run_coloring(G, faults=None, delta=None, q=None, **kwargs):
+    n = G.number_of_nodes()
+    if delta is None:
+        delta = lib.calc_delta(G)
+    if q is None:
+        q = choose_q(n, delta)
+    mps = MessagePassingSystem(proc_class=Processor,
+                               proc_args={pid: dict(delta=delta, q=q) for pid in G.nodes()},
+                               n_proc=n,
+                               edges=G.edges(),
+                               is_async=False,
+                               verbose=False,
+                               engine='inline',
+                               faults=faults,
+                               **kwargs)
+    mps.start()
+    mps.wait_for_all()
+    return mps
+
+
+if __name__ == '__main__':
+    n = 1000
+    G = lib.gen_random_graph(n)
+    delta = lib.calc_delta(G) + 2
+    q = choose_q(n, delta)
+    u, v = next(iter(G.edges()))
+    faults = {
+        50: random_corruptions(n, q, 10),
+        100: [('remove_edge', u, v), ('add_edge', 0, n - 1)],
+        150: [('crash', 1)],
+    }
+    mps = run_coloring(G, faults=faults, delta=delta, q=q)
+    print('q=%d delta=%d stable: %s' % (q, delta, is_stable(mps, delta)))
+    for episode in mps.stabilization:
+        print(episode)
@@ -1,6 +1,19 @@
 import threading, time
 import queue
 import random
+import multiprocessing
+import os
+import asyncio
+import selectors
+import heapq
+import pickle
+import zlib
+from array import array
+from bisect import bisect_left
+from collections import deque
+from tracing import DEBUG, INFO, WARNING
+from stats import SystemStats
+import delays
 from enum import Enum, auto
 from collections import defaultdict as dd
 
@@ -28,6 +41,8 @@ class MsgType(Enum):
 # A simple replace for non-blocking queue
 # Order does not matter
 class SimpleQueue:
+    __slots__ = ('q',)
+
     def __init__(self):
         self.q = []
 
@@ -47,8 +62,75 @@ class SimpleQueue:
         return len(self.q) == 0
 
 
+# Round barrier for synchronous systems.
+# Every alive processor arrives once per round, terminated processors leave,
+# so the number of parties shrinks as the system runs.
+class RoundBarrier:
+    def __init__(self, parties):
+        self.cond = threading.Condition()
+        self.parties = parties
+        self.arrived = 0
+
+    def arrive(self):
+        with self.cond:
+            self.arrived += 1
+            if self.arrived >= self.parties:
+                self.cond.notify_all()
+
+    def leave(self):
+        with self.cond:
+            self.parties -= 1
+            if self.arrived >= self.parties:
+                self.cond.notify_all()
+
+    # Block until all remaining parties have arrived, then start a new round.
+    def wait_all(self):
+        with self.cond:
+            while self.arrived < self.parties:
+                self.cond.wait()
+            self.arrived = 0
+
+
+# Neighbors of one node as a slice of a shared CSR indices array.
+# Used instead of a set per node by compact systems.
+class NeighborView:
+    __slots__ = ('indices', 'lo', 'hi')
+
+    def __init__(self, indices, lo, hi):
+        self.indices = indices
+        self.lo = lo
+        self.hi = hi
+
+    def __iter__(self):
+        return iter(self.indices[self.lo:self.hi])
+
+    def __len__(self):
+        return self.hi - self.lo
+
+    # CSR neighbor lists are sorted
+    def __contains__(self, pid):
+        i = bisect_left(self.indices, pid, self.lo, self.hi)
+        return i < self.hi and self.indices[i] == pid
+
+    def __repr__(self):
+        return str(set(self))
+
+
+# Subclasses that declare __slots__ too get no per-instance __dict__,
+# which matters when simulating hundreds of thousands of processors.
 class AbstractProcessor:
-    def __init__(self, pid=None, is_async=True, verbose=True):
+    __slots__ = ('in_buf', 'out_buf', 'pid', 'thread', 'verbose', 'tracer', 'status', 'neighbors', 'is_async',
+                 'inactive', 'result_buffer', 'barrier', 'delivered', 'worker_time', 'current_round', 'wake_round',
+                 'aggregates', 'root', 'parent', '_children', 'sent_state', 'skipped')
+
+    # Event driven processors only run in rounds where they receive messages or a timer set with
+    # set_timer is due, instead of every round (inline engine). current_round is then the round
+    # number of the system.
+    event_driven = False
+
+    # Logging goes to the tracer installed by the message passing system,
+    # without a tracer messages are printed if verbose is set.
+    def __init__(self, pid=None, is_async=True, verbose=False):
         # One in_buf/out_buf for all incoming/outgoing channels.
         # We will label the message with sender/receiver.
 
@@ -60,18 +142,81 @@ class AbstractProcessor:
             self.in_buf = SimpleQueue()
             self.out_buf = SimpleQueue()
         self.pid = pid
-        self.thread = threading.Thread(target=self.core)
+        # The thread is created on wake up, processors driven by the inline engine never get one.
+        self.thread = None
         self.verbose = verbose
+        self.tracer = None
         self.status = Status.EMBRYO
-        self.neighbors = set()
+        # Installed by the message passing system on start
+        self.neighbors = frozenset()
         self.is_async = is_async
         self.inactive = False
         self.result_buffer = {}
 
+        # Used in threaded sync systems: the barrier is installed by the message passing system,
+        # delivered is set once the messages of this round are in in_buf.
+        self.barrier = None
+        self.delivered = None
+        # Time spent in worker, read and reset by the threaded engine for its statistics
+        self.worker_time = 0.0
+        # Set by the inline engine: the current round, the round of the pending timer,
+        # and the RoundAggregate shared by all processors
+        self.current_round = 0
+        self.wake_round = None
+        self.aggregates = None
+        # With suppress_unchanged: (msg_state,) of the last broadcast, and the broadcasts skipped
+        # since the system last counted them (skipped is None when suppression is off)
+        self.sent_state = None
+        self.skipped = None
+
         # Tree related
         self.root = None
         self.parent = None
-        self.children = set()
+        self._children = None
+
+    # Slots left out of checkpoints: queues and threads, and what the system installs on start
+    TRANSIENT = ('in_buf', 'out_buf', 'thread', 'tracer', 'barrier', 'delivered', 'aggregates', 'neighbors')
+
+    # Processors are pickled through their slot descriptors, which bypasses properties of
+    # subclasses shadowing a slot (e.g. CompactProcessor). Attributes of subclasses without
+    # __slots__ are kept too.
+    def __getstate__(self):
+        slots = {}
+        for cls in type(self).__mro__:
+            for name in cls.__dict__.get('__slots__', ()):
+                if name in self.TRANSIENT or name in slots:
+                    continue
+                try:
+                    slots[name] = cls.__dict__[name].__get__(self)
+                except AttributeError:
+                    pass
+        return slots, getattr(self, '__dict__', None)
+
+    def __setstate__(self, state):
+        slots, attrs = state
+        for cls in type(self).__mro__:
+            for name in cls.__dict__.get('__slots__', ()):
+                if name in slots:
+                    cls.__dict__[name].__set__(self, slots[name])
+        if attrs:
+            self.__dict__.update(attrs)
+        if self.is_async:
+            self.in_buf, self.out_buf = queue.Queue(), queue.Queue()
+        else:
+            self.in_buf, self.out_buf = SimpleQueue(), SimpleQueue()
+        self.thread = self.tracer = self.barrier = self.delivered = self.aggregates = None
+        self.neighbors = frozenset()
+
+    # Created on first use, most algorithms never build a tree
+    @property
+    def children(self):
+        if self._children is None:
+            self._children = set()
+        return self._children
+
+    @children.setter
+    def children(self, children):
+        self._children = children
 
     def core(self):
         self.log('Core started')
@@ -88,15 +233,18 @@ class AbstractProcessor:
                 # TODO: Tests required
                 msg, src = self.in_buf.get(block=True)
                 self.status = Status.TASK_DONE
+                start = time.perf_counter()
                 self.worker(msg, src)
+                self.worker_time += time.perf_counter() - start
         else:
             while self.status != Status.TERMINATED:
                 # Signal message passing core that we're awaiting messages
                 self.status = Status.AWAITING_MSG
+                self.barrier.arrive()
 
-                # Wait for the sync core to deliver our messages
-                while self.status != Status.MSG_DELIVERED and self.is_alive():
-                    pass
+                # Block until the sync core delivers our messages
+                self.delivered.wait()
+                self.delivered.clear()
 
                 # This is for inactive shutdown.
                 if not self.is_alive():
@@ -110,10 +258,15 @@ class AbstractProcessor:
                         msgs.append(msg)
                         srcs.append(src)
                 self.status = Status.TASK_DONE
+                start = time.perf_counter()
                 self.worker(msgs, srcs)
+                self.worker_time += time.perf_counter() - start
+            self.barrier.leave()
         self.log('Terminated')
 
     def wake_up(self):
+        self.delivered = threading.Event()
+        self.thread = threading.Thread(target=self.core)
         self.thread.start()
 
     def worker(self, msg, src):
@@ -123,11 +276,29 @@ class AbstractProcessor:
         raise NotImplementedError
 
     def send(self, msg, target):
+        # The edges no longer all carry the last broadcast
+        self.sent_state = None
         self.out_buf.put((msg, target), True)
 
+    # With suppress_unchanged (see MessagePassingSystem) a broadcast whose msg_state equals the one
+    # of the previous broadcast is skipped, no message is queued: the neighbors keep receiving
+    # the last one.
     def send_to_neighbors(self, msg):
+        if self.skipped is None:
+            # A message plane (see MessagePlane) queues the whole broadcast at once
+            if hasattr(self.out_buf, 'put_all'):
+                self.out_buf.put_all(msg, self.neighbors)
+                return
+            for nb in self.neighbors:
+                self.send(msg, nb)
+            return
+        state = self.msg_state(msg)
+        if self.sent_state is not None and self.sent_state[0] == state:
+            self.skipped.append(msg)
+            return
         for nb in self.neighbors:
             self.send(msg, nb)
+        self.sent_state = (state,)
 
     def send_to_all_except(self, msg, src):
         for nb in self.neighbors:
@@ -136,6 +307,34 @@ class AbstractProcessor:
 
     def terminate(self):
         self.status = Status.TERMINATED
+        # Wake up the core if it is blocked waiting for delivery
+        if self.delivered is not None:
+            self.delivered.set()
+
+    # Fault hooks, called by the system between rounds when faults are injected (see
+    # MessagePassingSystem faults). The processor runs in the following round.
+    # value is the corrupted state. By default it maps attribute names to the values they are
+    # overwritten with, e.g. {'color': (3, 7)}; processors with a single state value override this.
+    def on_corrupt(self, value):
+        for name, attr in value.items():
+            setattr(self, name, attr)
+
+    def on_neighbor_added(self, pid):
+        pass
+
+    def on_neighbor_removed(self, pid):
+        pass
+
+    # Field widths of the messages for the CONGEST mode, a congest.MsgSchema or None when
+    # the processor does not declare any. All processors of a system share the schema.
+    def msg_schema(self):
+        return None
+
+    # Part of a message compared by suppress_unchanged, see EdgeCache. Fields the receiver can
+    # tell by itself, e.g. a round number, should be left out.
+    @staticmethod
+    def msg_state(msg):
+        return msg
 
     # Inactive is useful when you only forward messages.
     # If all processors are in INACTIVE mode, system will shutdown.
@@ -145,12 +344,32 @@ class AbstractProcessor:
     def set_status(self, status):
         self.status = status
 
+    def deliver(self):
+        self.status = Status.MSG_DELIVERED
+        self.delivered.set()
+
     def is_alive(self):
         return self.status != Status.TERMINATED
 
-    def log(self, msg):
-        if self.verbose:
-            print('PID %s: %s' % (self.pid, msg))
+    # msg is only formatted with args if the message is going to be emitted
+    def log(self, msg, *args, level=INFO):
+        if self.tracer is not None:
+            self.tracer.log(self.pid, level, msg, args)
+        elif self.verbose:
+            print('PID %s: %s' % (self.pid, msg % args if args else msg))
+
+    # Run again rounds rounds from now even if no message arrives (event driven processors).
+    # Only the last timer set during a round is kept.
+    def set_timer(self, rounds=1):
+        self.wake_round = self.current_round + rounds
+
+    # Contributions of all processors are readable by everyone from the next round on,
+    # see RoundAggregate
+    def contribute(self, key, value):
+        self.aggregates.contribute(key, value)
+
+    def aggregate(self, key):
+        return self.aggregates.get(key)
 
     def save_result(self, key, val):
         self.result_buffer[key] = val
@@ -160,35 +379,441 @@ class AbstractProcessor:
             self.result_buffer[key] = val
 
 
+# Last message per directed edge, for suppress_unchanged. Every round, a receiver gets the last
+# message of each neighbor that ever sent it one, transmitted in the previous round or not
+# (round numbers in it are then stale). Only messages changing the state of their edge (given by
+# msg_state of the processor class) are transmitted, so senders may skip unchanged updates.
+class EdgeCache:
+    def __init__(self, msg_state):
+        self.msg_state = msg_state
+        # Per receiver: sender -> state, and sender -> last message
+        self.states = dd(dict)
+        self.items = dd(dict)
+
+    # Stores a message sent on src -> target, returns whether it changed the state of the edge
+    def update(self, src, target, item):
+        states = self.states[target]
+        state = self.msg_state(item)
+        if src in states and states[src] == state:
+            return False
+        states[src] = state
+        self.items[target][src] = item
+        return True
+
+    # Messages and senders of a receiver for the round
+    def inbox(self, target):
+        items = self.items.get(target)
+        if not items:
+            return [], []
+        return list(items.values()), list(items)
+
+
+# Global knowledge agreed on by all processors: values contributed during a round are merged
+# into one set per key, visible to every processor from the next round on. This models a
+# convergecast and broadcast over a spanning tree as an oracle, the rounds such an agreement
+# takes in a real network are not simulated.
+class RoundAggregate:
+    def __init__(self):
+        self.pending = dd(set)
+        self.values = {}
+
+    def contribute(self, key, value):
+        self.pending[key].add(value)
+
+    def get(self, key):
+        return self.values.get(key, frozenset())
+
+    # Called by the engine at the round boundary
+    def commit(self):
+        if self.pending:
+            for key, values in self.pending.items():
+                self.values[key] = self.values.get(key, frozenset()) | values
+            self.pending.clear()
+
+
+# Assign every node to a shard, returns a list mapping pid -> shard.
+#   'contiguous': split the pid range into equally sized blocks.
+#   'bfs': split the nodes in breadth first order, which keeps neighborhoods
+#          together and reduces the number of cross-shard edges.
+def partition_nodes(n_proc, edge_dict, n_shards, method='contiguous'):
+    if method == 'contiguous':
+        order = range(n_proc)
+    elif method == 'bfs':
+        order, seen = [], [False] * n_proc
+        for root in range(n_proc):
+            if seen[root]:
+                continue
+            seen[root] = True
+            frontier = [root]
+            while frontier:
+                order.extend(frontier)
+                next_frontier = []
+                for v in frontier:
+                    for nb in sorted(edge_dict[v]):
+                        if not seen[nb]:
+                            seen[nb] = True
+                            next_frontier.append(nb)
+                frontier = next_frontier
+    else:
+        raise ValueError('Unknown partition method %s' % (method,))
+
+    owner = [0] * n_proc
+    block = -(-n_proc // n_shards)
+    for i, pid in enumerate(order):
+        owner[pid] = i // block
+    return owner
+
+
+# Body of one shard process of the sharded engine.
+# Runs synchronous rounds for its own processors like the inline engine. Messages between
+# local processors never leave the shard, cross-shard messages are exchanged with the
+# coordinator through conn once per round.
+def shard_core(conn, shard, proc_class, proc_args, neighbors, owner, collect_stats, edge_stats):
+    processors = {pid: proc_class(pid=pid, is_async=False, **args) for pid, args in proc_args.items()}
+    msgs = {pid: [] for pid in processors}
+    srcs = {pid: [] for pid in processors}
+    next_msgs = {pid: [] for pid in processors}
+    next_srcs = {pid: [] for pid in processors}
+    stats = SystemStats(per_edge=edge_stats) if collect_stats else None
+
+    ran = list(processors.values())
+    start = time.perf_counter()
+    for p in ran:
+        p.neighbors = neighbors[p.pid]
+        p.status = Status.AWAKENED
+        p.init_config()
+    worker_time = time.perf_counter() - start
+
+    while True:
+        if stats is not None:
+            stats.begin_round(0)
+        start = time.perf_counter()
+        remote = dd(list)
+        for p in ran:
+            out = p.out_buf.q
+            if out:
+                for item, target in out:
+                    if stats is not None:
+                        stats.record_message(p.pid, target, item)
+                    if owner[target] != shard:
+                        remote[owner[target]].append((item, p.pid, target))
+                    elif processors[target].is_alive():
+                        next_msgs[target].append(item)
+                        next_srcs[target].append(p.pid)
+                del out[:]
+        delivery_time = time.perf_counter() - start
+
+        alive = [p for p in ran if p.is_alive()]
+        report = None
+        if stats is not None:
+            inactive = sum([1 for p in alive if p.inactive])
+            cur = stats.current
+            report = (cur.messages, cur.bits, cur.bytes, worker_time, delivery_time,
+                      len(alive) - inactive, inactive, len(processors) - len(alive))
+        conn.send((dict(remote), len(alive), all([p.inactive for p in processors.values()]), report))
+        incoming = conn.recv()
+        if incoming is None:
+            # Stop signal from the coordinator
+            for p in alive:
+                p.terminate()
+            break
+
+        start = time.perf_counter()
+        for item, src, target in incoming:
+            if processors[target].is_alive():
+                next_msgs[target].append(item)
+                next_srcs[target].append(src)
+
+        msgs, next_msgs = next_msgs, msgs
+        srcs, next_srcs = next_srcs, srcs
+        for p in alive:
+            p.status = Status.TASK_DONE
+            p.worker(msgs[p.pid], srcs[p.pid])
+            del msgs[p.pid][:]
+            del srcs[p.pid][:]
+        worker_time = time.perf_counter() - start
+        ran = alive
+
+    for p in processors.values():
+        p.status = Status.TERMINATED
+        p.log('Terminated')
+    edges = (stats.edge_messages, stats.edge_bits) if stats is not None else None
+    conn.send(({pid: p.result_buffer for pid, p in processors.items()}, edges))
+    conn.close()
+
+
+# Selector of the virtual clock event loop: instead of blocking until the next timer is due,
+# select jumps the clock forward to it. Only the loop's own wakeup pipe is ever registered.
+class VirtualClockSelector(selectors.DefaultSelector):
+    def __init__(self):
+        super().__init__()
+        self.now = 0.0
+
+    def select(self, timeout=None):
+        if timeout is None:
+            raise RuntimeError('Deadlock: no message in flight can wake up a waiting processor')
+        if timeout > 0:
+            self.now += timeout
+        return super().select(0)
+
+
+# asyncio event loop running on virtual time, call_at/call_later schedule in virtual time units
+# and the loop never sleeps.
+class VirtualClockLoop(asyncio.SelectorEventLoop):
+    def __init__(self):
+        super().__init__(VirtualClockSelector())
+
+    def time(self):
+        return self._selector.now
+
+
+# Stands in for AbstractProcessor.out_buf in the asyncio engine: sent messages go straight
+# to their channel.
+class ChannelWriter:
+    def __init__(self, system, pid):
+        self.system = system
+        self.pid = pid
+
+    def put(self, item, block=True):
+        msg, target = item
+        self.system.send_on_channel(self.pid, msg, target)
+
+    def put_nowait(self, item):
+        self.put(item)
+
+    def empty(self):
+        return True
+
+
 class MessagePassingSystem:
-    # TODO: Using Thread pool to improve performance
+    ENGINES = ('threaded', 'inline', 'sharded', 'asyncio', 'des', 'socket')
+    ASYNC_ENGINES = ('threaded', 'asyncio', 'des')
+    CHECKPOINT_VERSION = 2
+
     # proc_args is a dict with mapping {pid: {'property1': value1, 'property2': value2, ...}}
-    def __init__(self, proc_class, proc_args, n_proc, edges, is_async, max_channel_delay=0, verbose=True):
+    # engine selects how processors are run:
+    #   'threaded': one thread per processor, works for both sync and async systems.
+    #   'inline': sync systems only, all workers are called from a single loop per round.
+    #             Processors with event_driven set only run when they have messages or a timer.
+    #   'sharded': sync systems only, nodes are split by partition_nodes into n_shards
+    #              (default: number of CPUs) processes, each running its shard inline.
+    #              proc_class and proc_args must be picklable.
+    #   'asyncio': async systems only, every processor is a coroutine on an event loop running
+    #              in virtual time, messages travel on FIFO channels (one per directed edge)
+    #              with delays drawn from delay, a delays policy or a constant (default:
+    #              uniform up to max_channel_delay, or 1). seed makes delays reproducible.
+    #              The run stops once no message is in flight, the virtual time it took is
+    #              self.virtual_time.
+    #   'des': discrete event simulation with the same channels and delays as 'asyncio', without
+    #          the event loop overhead. Synchronous processors run on top of an alpha synchronizer
+    #          (see des_core).
+    #   'socket': sync systems only, shards as in 'sharded' but connected by sockets, transport
+    #             'tcp' or 'unix' (see transport.py and socket_core). The system listens on
+    #             transport_address (default: localhost or a temporary path) and with spawn_shards
+    #             starts the shard processes itself, otherwise it waits for n_shards shards
+    #             started with python transport.py, e.g. on other machines. Every connection is
+    #             authenticated with transport_authkey (bytes or str, random for spawned shards,
+    #             required otherwise), nothing is unpickled from a peer before.
+    # csr is the adjacency as (indptr, indices) arrays, e.g. of a graph loaded by graphio, used
+    # instead of edges (which may then be None) without building python objects per edge: processors
+    # get NeighborViews into the arrays, memory mapped ones are not read into memory. Implies compact.
+    # compact stores the adjacency as one CSR array and gives every processor a NeighborView
+    # into it instead of a set (threaded and inline engines).
+    # suppress_unchanged (threaded and inline engines, sync systems, processors not event driven)
+    # delivers every round the last message of each edge from an EdgeCache: broadcasts whose
+    # msg_state is unchanged are skipped by the senders, and a message leaving the state of its
+    # edge unchanged is not transmitted. Suppressed messages are counted apart in the statistics.
+    # congest (threaded and inline engines, sync systems) packs every message into an int following
+    # the msg_schema of the processors and checks that no directed edge carries more than
+    # congest_bandwidth bits per round (default: congest.default_bandwidth(n_proc)). Overflowing
+    # edges are recorded in self.congest (a congest.CongestMonitor), with congest_strict the first
+    # one raises a congest.CongestViolation in the system thread, aborting the run: wait_for_all
+    # raises it.
+    # faults (inline engine, event driven processors, adjacency not compact) maps a round to the faults
+    # injected right before it, see apply_fault. The run continues until the system is quiescent
+    # after the last fault, each fault round starts a stabilization episode in self.stabilization.
+    # checkpoint_every (inline engine without message plane, processors not event driven) saves
+    # the run to checkpoint_path every checkpoint_every rounds, see save_checkpoint and restore.
+    # collect_stats keeps per round metrics in self.stats (a stats.SystemStats, None otherwise),
+    # edge_stats additionally counts messages and bits per directed edge and implies collect_stats.
+    # Statistics cost about 15% of the run time of AG coloring, they are off by default.
+    # tracer is a tracing.Tracer receiving the log events of the system and of all processors,
+    # processors in the shards of the sharded engine are not traced.
+    # msg_template (inline engine only) switches message delivery to a MessagePlane, messages must
+    # then have the nested structure of the template, e.g. (0, (0, 0), 0), and only go to neighbors.
+    def __init__(self, proc_class, proc_args, n_proc, edges, is_async, max_channel_delay=0, verbose=True,
+                 engine='threaded', n_shards=None, partition='contiguous', msg_template=None,
+                 compact=False, tracer=None, collect_stats=False, edge_stats=False,
+                 delay=None, seed=None, suppress_unchanged=False, congest=False, congest_bandwidth=None,
+                 congest_strict=False, checkpoint_every=None, checkpoint_path=None, faults=None, transport='tcp',
+                 transport_address=None, spawn_shards=True, transport_authkey=None, csr=None):
         self.max_channel_delay = max_channel_delay
+        if csr is not None:
+            if len(csr[0]) != n_proc + 1:
+                raise ValueError('csr has %d nodes, expected %d' % (len(csr[0]) - 1, n_proc))
+            compact = True
 
         if not issubclass(proc_class, AbstractProcessor):
             ValueError('proc_class must inherit AbstractProcessor')
-
-        self.processors = [proc_class(pid=pid, is_async=is_async, **proc_args[pid]) for pid in range(n_proc)]
+        if engine not in self.ENGINES:
+            raise ValueError('engine must be one of %s' % (', '.join(self.ENGINES),))
+        if engine not in self.ASYNC_ENGINES and is_async:
+            raise ValueError('%s engine only supports synchronous systems' % (engine,))
+        if engine == 'asyncio' and not is_async:
+            raise ValueError('asyncio engine only supports asynchronous systems')
+        if msg_template is not None and engine != 'inline':
+            raise ValueError('msg_template is only supported by the inline engine')
+        if compact and engine in ('sharded', 'socket'):
+            raise ValueError('compact is not supported by the %s engine' % (engine,))
+        if engine == 'socket' and transport not in ('tcp', 'unix'):
+            raise ValueError("transport must be 'tcp' or 'unix'")
+        if engine == 'socket' and not spawn_shards and not transport_authkey:
+            raise ValueError('Shards started apart need the transport_authkey given to them in MPS_AUTHKEY')
+        if suppress_unchanged and (is_async or engine not in ('threaded', 'inline') or msg_template is not None):
+            raise ValueError('suppress_unchanged requires a synchronous threaded or inline engine without message plane')
+        if proc_class.event_driven and (engine != 'inline' or msg_template is not None):
+            raise ValueError('Event driven processors require the inline engine without message plane')
+        if suppress_unchanged and proc_class.event_driven:
+            raise ValueError('suppress_unchanged does not apply to event driven processors, which only run on new messages')
+        if congest and (is_async or engine not in ('threaded', 'inline') or msg_template is not None):
+            raise ValueError('congest requires a synchronous threaded or inline engine without message plane')
+        if checkpoint_every is not None:
+            if engine != 'inline' or msg_template is not None or proc_class.event_driven:
+                raise ValueError('Checkpoints require the inline engine without message plane or event driven processors')
+            if checkpoint_path is None:
+                raise ValueError('checkpoint_every requires a checkpoint_path')
+        if faults and (not proc_class.event_driven or engine != 'inline' or compact):
+            raise ValueError('Faults require event driven processors on the inline engine without compact adjacency')
+        if faults and proc_class.on_corrupt is AbstractProcessor.on_corrupt:
+            for fault in [f for r in faults.values() for f in r if f[0] == 'corrupt']:
+                if not isinstance(fault[2], dict):
+                    raise ValueError('%s takes corruptions as dicts of attributes, got %s'
+                                     % (proc_class.__name__, str(fault[2])))
+        self.engine = engine
+
+        self.n_proc = n_proc
+        if engine in ('sharded', 'socket'):
+            # Processors are constructed inside the shard processes
+            self.proc_class, self.proc_args = proc_class, proc_args
+            self.n_shards = n_shards or os.cpu_count() or 1
+            self.partition = partition
+            self.processors = []
+        else:
+            self.processors = [proc_class(pid=pid, is_async=is_async, **proc_args[pid]) for pid in range(n_proc)]
         self.verbose = verbose
         self.msg_buf = dd(queue.Queue)
 
+        self.edge_cache = None
+        if suppress_unchanged:
+            self.edge_cache = EdgeCache(proc_class.msg_state)
+            for p in self.processors:
+                p.skipped = []
+        self.congest = None
+        if congest:
+            import congest as congest_mod
+            schema = self.processors[0].msg_schema() if self.processors else None
+            if schema is None:
+                raise ValueError('congest requires processors declaring a msg_schema')
+            bandwidth = congest_bandwidth or congest_mod.default_bandwidth(n_proc)
+            self.congest = congest_mod.CongestMonitor(schema, bandwidth, n_proc, strict=congest_strict)
+        # Messages go through transmit instead of being counted directly
+        self.relay = self.edge_cache is not None or self.congest is not None
+
+        self.checkpoint_every = checkpoint_every
+        self.checkpoint_path = checkpoint_path
+        # (alive pids, pending messages) loaded by restore, consumed by the inline engine
+        self.resume_state = None
+
+        self.faults = {r: list(f) for r, f in faults.items()} if faults else {}
+        # One dict per stabilization episode: the start round, the number of faults injected
+        # (0 for the initial run), the rounds until quiescence, and the messages, worker calls and
+        # distinct processors that ran in between. stabilized is False when the next faults came first.
+        self.stabilization = []
+        self.crashed = set()
+
         # Synchronous rounds, used in is_async=false
-        self.round = 1
+        self.round = 0
+        self.aggregates = RoundAggregate()
+        self.tracer = tracer
+        self.stats = SystemStats(per_edge=edge_stats) if collect_stats or edge_stats else None
 
         # Used for processes to write their final results
         self.global_shared_memory = {}
+        # Exception that aborted the run in the system thread, raised again by wait_for_all
+        self.error = None
 
         self.edges = edges
         self.edge_dict = dd(set)
-        for edge in edges:
-            self.edge_dict[edge[0]].add(edge[1])
-            self.edge_dict[edge[1]].add(edge[0])
-
-        if is_async:
-            self.thread = threading.Thread(target=self.async_core)
+        self.csr = None
+        if csr is not None:
+            import numpy as np
+            self.csr = (memoryview(np.ascontiguousarray(csr[0])), memoryview(np.ascontiguousarray(csr[1])))
+            if msg_template is not None:
+                # Edges u < v for the message plane
+                owner = np.repeat(np.arange(n_proc, dtype=np.int64), np.diff(csr[0]))
+                keep = owner < csr[1]
+                edges = np.column_stack([owner[keep], np.asarray(csr[1])[keep]])
+        elif compact:
+            import lib
+            indptr, indices = lib.to_csr(n_proc, edges)
+            self.csr = (array('q', indptr.tolist()), array('q', indices.tolist()))
         else:
-            self.thread = threading.Thread(target=self.sync_core)
+            for edge in edges:
+                self.edge_dict[edge[0]].add(edge[1])
+                self.edge_dict[edge[1]].add(edge[0])
+
+        self.msg_plane = None
+        if msg_template is not None:
+            from MessagePlane import MessagePlane
+            self.msg_plane = MessagePlane(n_proc, edges, msg_template)
+
+        # Channels of the asyncio engine
+        self.delay_policy = delays.make_policy(delay, max_channel_delay)
+        self.rng = random.Random(seed)
+        self.loop = None
+        self.channels = {}
+        self.in_flight = 0
+        self.quiescent = None
+        self.virtual_time = None
+
+        self.barrier = None
+        if engine == 'asyncio':
+            self.thread = threading.Thread(target=self.run_core, args=(self.asyncio_core,))
+        elif engine == 'des':
+            self.thread = threading.Thread(target=self.run_core, args=(self.des_core,))
+        elif is_async:
+            self.thread = threading.Thread(target=self.run_core, args=(self.async_core,))
+        elif engine == 'inline' and proc_class.event_driven:
+            self.thread = threading.Thread(target=self.run_core, args=(self.event_core,))
+        elif engine == 'inline':
+            self.thread = threading.Thread(target=self.run_core, args=(self.inline_core,))
+        elif engine == 'sharded':
+            self.thread = threading.Thread(target=self.run_core, args=(self.sharded_core,))
+        elif engine == 'socket':
+            self.transport = transport
+            self.transport_address = transport_address
+            self.spawn_shards = spawn_shards
+            if isinstance(transport_authkey, str):
+                transport_authkey = transport_authkey.encode()
+            self.transport_authkey = transport_authkey or os.urandom(32)
+            # Frames and bytes the shards sent each other, set by socket_core
+            self.transport_stats = None
+            self.thread = threading.Thread(target=self.run_core, args=(self.socket_core,))
+        else:
+            self.barrier = RoundBarrier(n_proc)
+            self.thread = threading.Thread(target=self.run_core, args=(self.sync_core,))
+
+    # Runs an engine core in the system thread. If it raises, e.g. a congest.CongestViolation with
+    # congest_strict, every processor is terminated, which also releases the threads of the threaded
+    # engine blocked waiting for delivery, and wait_for_all raises the exception.
+    def run_core(self, core):
+        try:
+            core()
+        except Exception as e:
+            self.error = e
+            for p in self.processors:
+                p.terminate()
+            self.log('Aborted: %s', e, level=WARNING)
 
     def all_inactive(self):
         return all([p.inactive for p in self.processors])
@@ -202,89 +827,434 @@ class MessagePassingSystem:
     def clear_out_buf(self, p):
         while not p.out_buf.empty():
             self.send_to_medium_buf(p)
+        if p.skipped:
+            self.count_skipped(p)
 
     # Direct delivery: Will trigger target's computation event immediately.
     # Used in async systems.
     def send_one_msg(self, p):
         try:
             item, target = p.out_buf.get_nowait()
+            if self.stats is not None:
+                self.stats.record_message(p.pid, target, item)
             if self.processors[target].is_alive():
                 self.processors[target].in_buf.put((item, p.pid))
-                p.log('msg sent %s -> %s : %s' % (p.pid, target, ' '.join([str(k) for k in item])))
+                p.log('msg sent %s -> %s : %s', p.pid, target, item, level=DEBUG)
         except queue.Empty:
             pass
 
     def send_to_medium_buf(self, p):
         try:
             item, target = p.out_buf.get_nowait()
+            if self.relay:
+                item = self.transmit(p.pid, target, item)
+                if self.edge_cache is not None:
+                    # Delivered from the edge cache
+                    return
+            elif self.stats is not None:
+                self.stats.record_message(p.pid, target, item)
             # Here we don't need to check if the sender is alive.
             # If a sender sends a message and terminates, that message should be delivered.
             if self.processors[target].is_alive():
                 self.msg_buf[target].put((item, p.pid))
-                # p.log('msg sent %s -> %s : %s' % (p.pid, target, ' '.join([str(k) for k in item])))
         except queue.Empty:
             pass
 
+    # Runs a message through the edge cache and the CONGEST monitor and counts it. Returns what
+    # the receiver gets: in CONGEST mode the message packed into an int, otherwise the message.
+    # With the edge cache, the message is only stored there, a message leaving the state of its
+    # edge unchanged is counted as suppressed and does not use bandwidth.
+    def transmit(self, src, target, item):
+        congest = self.congest
+        bits = congest.schema.width if congest is not None else None
+        if self.edge_cache is not None and not self.edge_cache.update(src, target, item):
+            if self.stats is not None:
+                self.stats.record_suppressed(src, (target,), item, bits=bits)
+            return item
+        if self.stats is not None:
+            self.stats.record_message(src, target, item, bits=bits)
+        if congest is None:
+            return item
+        return congest.pack(src, target, item, self.round)
+
+    # Counts the broadcasts p skipped with suppress_unchanged as suppressed messages to its neighbors
+    def count_skipped(self, p):
+        if self.stats is not None:
+            bits = self.congest.schema.width if self.congest is not None else None
+            for item in p.skipped:
+                self.stats.record_suppressed(p.pid, p.neighbors, item, bits=bits)
+        del p.skipped[:]
+
     def clear_msg_buf(self):
         for p in self.processors:
-            if p.pid in self.msg_buf:
+            if not p.is_alive():
+                continue
+            if self.edge_cache is not None:
+                msgs, srcs = self.edge_cache.inbox(p.pid)
+                p.in_buf.q.extend(zip(msgs, srcs))
+            elif p.pid in self.msg_buf:
                 # Someone have sent a message to p
-                target = p.pid
+                buf = self.msg_buf[p.pid]
+                unpack = self.congest.schema.unpack if self.congest is not None else None
                 try:
-                    delivered = False
-                    while not self.msg_buf[target].empty():
-                        pkg = self.msg_buf[target].get()
-                        self.processors[target].in_buf.put(pkg)
-                        delivered = True
-
-                    if delivered:
-                        self.processors[target].set_status(Status.MSG_DELIVERED)
+                    while not buf.empty():
+                        item, src = buf.get_nowait()
+                        p.in_buf.put((unpack(item) if unpack is not None else item, src))
                 except queue.Empty:
                     pass
-            else:
-                # Nobody sent messages to p, but we have to trigger the event
-                self.processors[p.pid].in_buf.put((MsgType.EMPTY, -1))
-                self.processors[p.pid].set_status(Status.MSG_DELIVERED)
-
-        # for target in self.msg_buf:
-        #     try:
-        #         delivered = False
-        #         while not self.msg_buf[target].empty():
-        #             pkg = self.msg_buf[target].get()
-        #             self.processors[target].in_buf.put(pkg)
-        #             delivered = True
-        #
-        #         if delivered:
-        #             self.processors[target].set_status(Status.MSG_DELIVERED)
-        #     except queue.Empty:
-        #         pass
 
-    def sync_core(self):
-        while not self.all_status(Status.TERMINATED):
-            # Wait for all alive processors to finish their computing task
-            while not self.all_alive_status(Status.AWAITING_MSG):
-                pass
+            # Processors without messages are woken up by the event alone, no EMPTY message needed
+            p.deliver()
 
-            # Simulate the latency of channel
-            if self.max_channel_delay > 0:
-                time.sleep(random.uniform(0, self.max_channel_delay))
-
-            # self.log('round %s' % (self.round,))
-            # self.round += 1
+    def sync_core(self):
+        if self.stats is not None:
+            self.stats.begin_round(self.round)
+        while True:
+            # Block until all alive processors have finished their computing task
+            self.barrier.wait_all()
 
             # Push all messages ready to be sent to msg_buf
             # If we push directly to target's in_buf, then some messages that should
             # be send next round would be inserted to in_buf and be send this round.
+            start = time.perf_counter()
             for p in self.processors:
                 self.clear_out_buf(p)
+            if self.congest is not None:
+                self.congest.end_round(self.round)
+            delivery_time = time.perf_counter() - start
 
-            # Deliver pending messages.
-            self.clear_msg_buf()
-
-            # All processors is in inactive mode, system shutdown
+            alive = [p for p in self.processors if p.is_alive()]
+            if self.stats is not None:
+                worker_time = 0.0
+                for p in self.processors:
+                    worker_time += p.worker_time
+                    p.worker_time = 0.0
+                self.end_round_stats(alive, worker_time, delivery_time)
+            if not alive:
+                break
+
+            # All processors is in inactive mode, system shutdown.
+            # Checked before delivery so no processor gets woken up for another round.
             if self.all_inactive():
                 for p in self.processors:
                     p.terminate()
+                break
+
+            # Simulate the latency of channel
+            if self.max_channel_delay > 0:
+                time.sleep(random.uniform(0, self.max_channel_delay))
+
+            self.next_round()
+            if self.stats is not None:
+                self.stats.begin_round(self.round)
+
+            # Deliver pending messages.
+            start = time.perf_counter()
+            self.clear_msg_buf()
+            if self.stats is not None:
+                self.stats.current.delivery_time += time.perf_counter() - start
+
+        # Collect all processor's final result
+        for i in range(len(self.processors)):
+            self.global_shared_memory[i] = self.processors[i].result_buffer
+
+        self.log('All processors have terminated or are in inactive state, message passing system shutdown')
+
+    # Inline engine for event driven processors: a round only runs the processors that received
+    # messages or whose timer is due, in pid order. As in the other engines, the system stops when
+    # no processor is alive or when all processors, terminated ones included, are inactive. It also
+    # stops once no message is in flight and no timer is pending (quiescence).
+    # Quiescent rounds before the next scheduled faults are skipped.
+    # The work per round is proportional to the processors that run, not to n.
+    def event_core(self):
+        stats = self.stats
+        relay = self.relay
+        unpack = self.congest.schema.unpack if self.congest is not None else None
+        processors = self.processors
+        inbox = {}
+        timers = dd(list)
+        # inactive: the alive inactive processors, n_gone_inactive: the terminated inactive ones
+        n_alive, inactive, n_gone_inactive = len(processors), set(), 0
+        episode = self.begin_episode(0)
+
+        # Moves messages of the processors that ran to next round's inbox, registers their timers
+        def collect(ran):
+            nonlocal n_alive, n_gone_inactive
+            for p in ran:
+                out = p.out_buf.q
+                if out:
+                    episode['messages'] += len(out)
+                    for item, target in out:
+                        if relay:
+                            item = self.transmit(p.pid, target, item)
+                        elif stats is not None:
+                            stats.record_message(p.pid, target, item)
+                        if processors[target].is_alive():
+                            if target not in inbox:
+                                inbox[target] = ([], [])
+                            box = inbox[target]
+                            box[0].append(item)
+                            box[1].append(p.pid)
+                    del out[:]
+                if not p.is_alive():
+                    n_alive -= 1
+                    inactive.discard(p.pid)
+                    if p.inactive:
+                        n_gone_inactive += 1
+                    continue
+                if p.inactive:
+                    inactive.add(p.pid)
+                if p.wake_round is not None:
+                    if p.wake_round > self.round:
+                        timers[p.wake_round].append(p.pid)
+                    p.wake_round = None
+
+        if stats is not None:
+            stats.begin_round(self.round)
+        ran = processors
+        start = time.perf_counter()
+        for p in ran:
+            p.status = Status.AWAKENED
+            p.current_round = self.round
+            p.init_config()
+        worker_time = time.perf_counter() - start
+
+        while True:
+            start = time.perf_counter()
+            collect(ran)
+            if self.congest is not None:
+                self.congest.end_round(self.round)
+            delivery_time = time.perf_counter() - start
+            if stats is not None:
+                self.stats.current.delivery_time += delivery_time
+                self.stats.end_round(n_alive - len(inactive), len(inactive), len(processors) - n_alive,
+                                     worker_time=worker_time)
+
+            quiescent = not inbox and not timers
+            if quiescent and episode['rounds'] is None:
+                self.end_episode(episode, True)
+            if n_alive == 0 or len(inactive) + n_gone_inactive == len(processors) or quiescent:
+                pending = [r for r in self.faults if r > self.round]
+                if n_alive == 0 or not pending:
+                    for p in processors:
+                        if p.is_alive():
+                            p.terminate()
+                    break
+                if quiescent:
+                    self.round = min(pending) - 1
+
+            # Simulate the latency of channel
+            if self.max_channel_delay > 0:
+                time.sleep(random.uniform(0, self.max_channel_delay))
+
+            self.next_round()
+            if stats is not None:
+                stats.begin_round(self.round)
+            start = time.perf_counter()
+            woken = set(inbox)
+            woken.update(timers.pop(self.round, ()))
+            if self.round in self.faults:
+                if episode['rounds'] is None:
+                    self.end_episode(episode, False)
+                episode = self.begin_episode(len(self.faults[self.round]))
+                for fault in self.faults[self.round]:
+                    woken.update(self.apply_fault(fault))
+                n_alive = sum([1 for p in processors if p.is_alive()])
+                inactive = set([p.pid for p in processors if p.is_alive() and p.inactive])
+                n_gone_inactive = sum([1 for p in processors if not p.is_alive() and p.inactive])
+            current, inbox = inbox, {}
+            ran = []
+            for pid in sorted(woken):
+                p = processors[pid]
+                if not p.is_alive():
+                    continue
+                msgs, srcs = current.get(pid, ((), ()))
+                if unpack is not None:
+                    msgs = [unpack(x) for x in msgs]
+                p.status = Status.TASK_DONE
+                p.current_round = self.round
+                p.worker(msgs, srcs)
+                ran.append(p)
+            episode['activations'] += len(ran)
+            episode['nodes'].update([p.pid for p in ran])
+            worker_time = time.perf_counter() - start
+
+        if episode['rounds'] is None:
+            self.end_episode(episode, False)
+        for p in processors:
+            p.status = Status.TERMINATED
+            p.log('Terminated')
+            self.global_shared_memory[p.pid] = p.result_buffer
+
+        self.log('All processors are inactive or idle, message passing system shutdown')
+
+    def begin_episode(self, n_faults):
+        episode = {'round': self.round, 'faults': n_faults, 'rounds': None, 'stabilized': False,
+                   'messages': 0, 'activations': 0, 'nodes': set()}
+        self.stabilization.append(episode)
+        return episode
+
+    def end_episode(self, episode, stabilized):
+        episode['rounds'] = self.round - episode['round']
+        episode['stabilized'] = stabilized
+        episode['nodes'] = len(episode['nodes'])
+
+    # Applies one fault between two rounds, returns the pids that must run in the next round:
+    #   ('corrupt', pid, value): transient fault, passed to the processor's on_corrupt (by default
+    #                            a dict of attributes to overwrite).
+    #   ('add_edge', u, v), ('remove_edge', u, v): topology changes, both ends are notified.
+    #   ('crash', pid): the processor stops for good, its neighbors see its edges removed.
+    def apply_fault(self, fault):
+        kind, args = fault[0], fault[1:]
+        self.log('Round %d: fault %s %s', self.round, kind, args)
+        if kind == 'corrupt':
+            pid, value = args
+            self.processors[pid].on_corrupt(value)
+            return {pid}
+        if kind == 'add_edge':
+            u, v = args
+            if u == v or v in self.edge_dict[u]:
+                return set()
+            self.edge_dict[u].add(v)
+            self.edge_dict[v].add(u)
+            self.processors[u].on_neighbor_added(v)
+            self.processors[v].on_neighbor_added(u)
+            return {u, v}
+        if kind == 'remove_edge':
+            u, v = args
+            if v not in self.edge_dict[u]:
+                return set()
+            self.edge_dict[u].discard(v)
+            self.edge_dict[v].discard(u)
+            self.processors[u].on_neighbor_removed(v)
+            self.processors[v].on_neighbor_removed(u)
+            return {u, v}
+        if kind == 'crash':
+            pid, = args
+            self.processors[pid].terminate()
+            self.crashed.add(pid)
+            neighbors = set(self.edge_dict[pid])
+            for v in neighbors:
+                self.edge_dict[v].discard(pid)
+                self.processors[v].on_neighbor_removed(pid)
+            self.edge_dict[pid].clear()
+            return neighbors
+        raise ValueError('Unknown fault %s' % (kind,))
+
+    # Single threaded synchronous rounds.
+    # Inboxes are preallocated lists reused every round, so a worker
+    # must copy msgs/srcs if it wants to keep them beyond the call.
+    # With a message plane, processors write their messages straight into the plane
+    # and workers get an Inbox reading the previous round's buffer in place.
+    def inline_core(self):
+        n = len(self.processors)
+        msgs, srcs = [[] for _ in range(n)], [[] for _ in range(n)]
+        next_msgs, next_srcs = [[] for _ in range(n)], [[] for _ in range(n)]
+        stats = self.stats
+        relay = self.relay
+        cache = self.edge_cache
+        unpack = self.congest.schema.unpack if self.congest is not None else None
+
+        plane = self.msg_plane
+        if plane is not None:
+            for p in self.processors:
+                p.out_buf = plane.writer(p.pid)
+
+        resume, self.resume_state = self.resume_state, None
+        if resume is None:
+            if stats is not None:
+                stats.begin_round(self.round)
+            ran = self.processors
+            start = time.perf_counter()
+            for p in ran:
+                p.status = Status.AWAKENED
+                p.init_config()
+            worker_time = time.perf_counter() - start
+        else:
+            alive = [self.processors[pid] for pid in resume[0]]
+            for pid, (pending_msgs, pending_srcs) in resume[1].items():
+                next_msgs[pid].extend(pending_msgs)
+                next_srcs[pid].extend(pending_srcs)
+
+        while True:
+            # A restored run continues right after the round boundary it was saved at
+            if resume is None:
+                # Move messages sent in the last round to next round's inboxes.
+                # Messages from processors that terminated in this round are still delivered.
+                start = time.perf_counter()
+                if plane is None:
+                    for p in ran:
+                        out = p.out_buf.q
+                        if out:
+                            for item, target in out:
+                                if relay:
+                                    item = self.transmit(p.pid, target, item)
+                                    if cache is not None:
+                                        # Delivered from the edge cache
+                                        continue
+                                elif stats is not None:
+                                    stats.record_message(p.pid, target, item)
+                                if self.processors[target].is_alive():
+                                    next_msgs[target].append(item)
+                                    next_srcs[target].append(p.pid)
+                            del out[:]
+                        if p.skipped:
+                            self.count_skipped(p)
+                    if self.congest is not None:
+                        self.congest.end_round(self.round)
+                elif stats is not None:
+                    stats.add_messages(*plane.traffic())
+                delivery_time = time.perf_counter() - start
+
+                alive = [p for p in ran if p.is_alive()]
+                if stats is not None:
+                    self.end_round_stats(alive, worker_time, delivery_time)
+                if not alive:
+                    break
+
+                # All processors is in inactive mode, system shutdown
+                if self.all_inactive():
+                    for p in alive:
+                        p.terminate()
+                    break
+
+                # Simulate the latency of channel
+                if self.max_channel_delay > 0:
+                    time.sleep(random.uniform(0, self.max_channel_delay))
+
+                if self.checkpoint_every and self.round % self.checkpoint_every == 0:
+                    self.save_checkpoint(alive, next_msgs, next_srcs)
+            resume = None
+
+            self.next_round()
+            if stats is not None:
+                stats.begin_round(self.round)
+            start = time.perf_counter()
+            if plane is not None:
+                plane.swap()
+                for p in alive:
+                    p.status = Status.TASK_DONE
+                    inbox = plane.inbox(p.pid)
+                    p.worker(inbox, inbox.sources())
+            else:
+                msgs, next_msgs = next_msgs, msgs
+                srcs, next_srcs = next_srcs, srcs
+                for p in alive:
+                    p.status = Status.TASK_DONE
+                    if cache is not None:
+                        p.worker(*cache.inbox(p.pid))
+                    elif unpack is not None:
+                        p.worker([unpack(x) for x in msgs[p.pid]], srcs[p.pid])
+                    else:
+                        p.worker(msgs[p.pid], srcs[p.pid])
+                    del msgs[p.pid][:]
+                    del srcs[p.pid][:]
+            worker_time = time.perf_counter() - start
+            ran = alive
+
+        for p in self.processors:
+            p.status = Status.TERMINATED
+            p.log('Terminated')
 
         # Collect all processor's final result
         for i in range(len(self.processors)):
@@ -292,7 +1262,294 @@ class MessagePassingSystem:
 
         self.log('All processors have terminated or are in inactive state, message passing system shutdown')
 
+    # Coordinator of the sharded engine, routes cross-shard messages at every round boundary.
+    def sharded_core(self):
+        owner = partition_nodes(self.n_proc, self.edge_dict, self.n_shards, self.partition)
+        n_shards = max(owner, default=-1) + 1
+        members = [[] for _ in range(n_shards)]
+        for pid, shard in enumerate(owner):
+            members[shard].append(pid)
+
+        conns, workers = [], []
+        for shard in range(n_shards):
+            conn, child_conn = multiprocessing.Pipe()
+            worker = multiprocessing.Process(target=shard_core, args=(
+                child_conn, shard, self.proc_class,
+                {pid: self.proc_args[pid] for pid in members[shard]},
+                {pid: self.edge_dict[pid] for pid in members[shard]},
+                owner, self.stats is not None, self.stats is not None and self.stats.per_edge))
+            worker.start()
+            child_conn.close()
+            conns.append(conn)
+            workers.append(worker)
+        self.log('Started %d shards', n_shards)
+
+        stats = self.stats
+        if stats is not None:
+            stats.begin_round(self.round)
+        while True:
+            reports = [conn.recv() for conn in conns]
+            self.end_shard_round([r[3] for r in reports])
+
+            # No processor alive or all processors in inactive mode, system shutdown
+            if sum([r[1] for r in reports]) == 0 or all([r[2] for r in reports]):
+                for conn in conns:
+                    conn.send(None)
+                break
+
+            # Simulate the latency of channel
+            if self.max_channel_delay > 0:
+                time.sleep(random.uniform(0, self.max_channel_delay))
+
+            incoming = [[] for _ in range(n_shards)]
+            for remote, _, _, _ in reports:
+                for shard, pkgs in remote.items():
+                    incoming[shard].extend(pkgs)
+            for conn, pkgs in zip(conns, incoming):
+                conn.send(pkgs)
+            self.next_round()
+            if stats is not None:
+                stats.begin_round(self.round)
+
+        # Collect all processor's final result
+        results = {}
+        for conn, worker in zip(conns, workers):
+            shard_results, edges = conn.recv()
+            results.update(shard_results)
+            if edges is not None:
+                stats.edge_messages.update(edges[0])
+                stats.edge_bits.update(edges[1])
+            worker.join()
+        for pid in range(self.n_proc):
+            self.global_shared_memory[pid] = results[pid]
+
+        self.log('All processors have terminated or are in inactive state, message passing system shutdown')
+
+    # Adds the statistics reports of all shards for the round
+    def end_shard_round(self, reports):
+        if self.stats is not None:
+            # Shard counters: messages, bits, bytes, worker time, delivery time, active, inactive, terminated
+            totals = [sum(col) for col in zip(*reports)]
+            self.stats.add_messages(*totals[:3])
+            self.stats.current.delivery_time = totals[4]
+            self.stats.end_round(totals[5], totals[6], totals[7], worker_time=totals[3])
+
+    # Coordinator of the socket engine. Shards connect to the listening socket and send their own
+    # address, then get their processors and the addresses of all shards, and connect to each other
+    # (transport.shard_main). The coordinator only takes part in the round synchronization: every
+    # round, each shard sends its messages to the others (one frame per shard) and its report here,
+    # and waits for the answer, STOP once all processors are inactive or terminated, CONTINUE
+    # otherwise, before reading the frames of the round. Messages never pass through here.
+    def socket_core(self):
+        import transport
+        owner = partition_nodes(self.n_proc, self.edge_dict, self.n_shards, self.partition)
+        n_shards = max(owner, default=-1) + 1
+        members = [[] for _ in range(n_shards)]
+        for pid, shard in enumerate(owner):
+            members[shard].append(pid)
+
+        listener, address = transport.listen(self.transport, self.transport_address)
+        workers = []
+        if self.spawn_shards:
+            for _ in range(n_shards):
+                worker = multiprocessing.Process(target=transport.shard_main,
+                                                 args=(self.transport, address, self.transport_authkey))
+                worker.start()
+                workers.append(worker)
+        self.log('Waiting for %d shards on %s', n_shards, address)
+        conns, addresses = [], []
+        for _ in range(n_shards):
+            conn = transport.accept(listener, self.transport, self.transport_authkey)
+            conns.append(conn)
+            addresses.append(transport.recv_object(conn))
+        listener.close()
+        transport.cleanup(self.transport, address)
+        per_edge = self.stats is not None and self.stats.per_edge
+        for shard, conn in enumerate(conns):
+            transport.send_object(conn, (shard, self.proc_class, {pid: self.proc_args[pid] for pid in members[shard]},
+                                         {pid: self.edge_dict[pid] for pid in members[shard]}, owner, addresses,
+                                         self.stats is not None, per_edge))
+        self.log('Started %d shards', n_shards)
+
+        stats = self.stats
+        if stats is not None:
+            stats.begin_round(self.round)
+        while True:
+            reports = [transport.recv_object(conn) for conn in conns]
+            self.end_shard_round([r[2] for r in reports])
+            stop = sum([r[0] for r in reports]) == 0 or all([r[1] for r in reports])
+            for conn in conns:
+                transport.send_frame(conn, transport.STOP if stop else transport.CONTINUE)
+            if stop:
+                break
+            self.next_round()
+            if stats is not None:
+                stats.begin_round(self.round)
+
+        results = {}
+        frames = sent = 0
+        for conn in conns:
+            (shard_results, edges), (shard_frames, shard_bytes) = transport.recv_object(conn)
+            results.update(shard_results)
+            if edges is not None:
+                stats.edge_messages.update(edges[0])
+                stats.edge_bits.update(edges[1])
+            frames += shard_frames
+            sent += shard_bytes
+            conn.close()
+        for worker in workers:
+            worker.join()
+        for pid in range(self.n_proc):
+            self.global_shared_memory[pid] = results[pid]
+        self.transport_stats = {'frames': frames, 'bytes': sent}
+        self.log('All processors have terminated or are in inactive state, message passing system shutdown')
+
+    # Discrete event simulation in virtual time. Deliveries are kept in a heap ordered by arrival
+    # time, a sequence number breaks ties so runs are deterministic under a seed. Arrival on an
+    # edge is never earlier than the previous arrival on it, so channels are FIFO.
+    # Asynchronous processors get worker(msg, src) per delivery, the run ends when no message
+    # is in flight.
+    # Synchronous processors run on an alpha synchronizer: at every pulse a node sends each
+    # neighbor one bundle (round, messages, last) holding its messages of that round, possibly
+    # none, and it runs the next pulse once the bundles of the round from all its neighbors
+    # arrived. FIFO channels make the synchronizer's acks unnecessary, the bundle itself tells
+    # the neighbor it is safe. last is set by a terminated node, so its neighbors stop waiting
+    # for it. As in the other engines, the run ends when no processor is alive or when all
+    # processors, terminated ones included, are inactive.
+    def des_core(self):
+        heap, self.virtual_time = [], 0.0
+        last_arrival = {}
+        seq = 0
+        stats = self.stats
+        if stats is not None:
+            stats.begin_round(self.round)
+
+        def push(src, target, payload):
+            nonlocal seq
+            arrival = max(self.virtual_time + self.delay_policy.sample(self.rng, src, target),
+                          last_arrival.get((src, target), 0.0))
+            last_arrival[(src, target)] = arrival
+            heapq.heappush(heap, (arrival, seq, src, target, payload))
+            seq += 1
+
+        for p in self.processors:
+            p.out_buf = SimpleQueue()
+        if self.processors and not self.processors[0].is_async:
+            self.run_synchronizer(heap, push)
+        else:
+            def send_out(p):
+                out = p.out_buf.q
+                for msg, target in out:
+                    if stats is not None:
+                        stats.record_message(p.pid, target, msg)
+                    push(p.pid, target, msg)
+                del out[:]
+
+            for p in self.processors:
+                p.status = Status.AWAKENED
+                p.init_config()
+                send_out(p)
+            while heap:
+                self.virtual_time, _, src, target, msg = heapq.heappop(heap)
+                p = self.processors[target]
+                if p.is_alive():
+                    p.status = Status.TASK_DONE
+                    p.worker(msg, src)
+                    send_out(p)
+
+        if stats is not None:
+            alive = [p for p in self.processors if p.is_alive()]
+            self.end_round_stats(alive, 0.0, 0.0)
+        for p in self.processors:
+            p.status = Status.TERMINATED
+            p.log('Terminated')
+            self.global_shared_memory[p.pid] = p.result_buffer
+
+        self.log('Finished after %.3f time units, message passing system shutdown', self.virtual_time)
+
+    def run_synchronizer(self, heap, push):
+        stats = self.stats
+        n = len(self.processors)
+        pulse = [0] * n
+        # bundles[v][r]: [messages, sources, number of bundles] of round r received by v
+        bundles = [{} for _ in range(n)]
+        # gone[v]: {neighbor: last round} of the terminated neighbors of v
+        gone = [{} for _ in range(n)]
+        # inactive: the inactive processors, terminated ones included
+        n_alive, inactive = n, set()
+
+        def send_bundles(p):
+            by_target = {nb: [] for nb in p.neighbors if nb not in gone[p.pid]}
+            for msg, target in p.out_buf.q:
+                if target not in p.neighbors:
+                    raise ValueError('The synchronizer only carries messages to neighbors, %s -> %s' % (p.pid, target))
+                if stats is not None:
+                    stats.record_message(p.pid, target, msg)
+                if target in by_target:
+                    by_target[target].append(msg)
+            del p.out_buf.q[:]
+            last = not p.is_alive()
+            for target, msgs in by_target.items():
+                push(p.pid, target, (pulse[p.pid], msgs, last))
+
+        def ready(v):
+            r = pulse[v]
+            received = bundles[v][r][2] if r in bundles[v] else 0
+            expected = len(self.processors[v].neighbors) - sum([1 for last in gone[v].values() if last < r])
+            return received >= expected
+
+        # Runs the pulses v can run with what it received, returns False once the system is done
+        def advance(v):
+            nonlocal n_alive
+            p = self.processors[v]
+            while p.is_alive() and ready(v):
+                msgs, srcs, _ = bundles[v].pop(pulse[v], ([], [], 0))
+                pulse[v] += 1
+                if pulse[v] > self.round:
+                    self.next_round()
+                p.status = Status.TASK_DONE
+                p.worker(msgs, srcs)
+                send_bundles(p)
+                if not p.is_alive():
+                    n_alive -= 1
+                if p.inactive:
+                    inactive.add(v)
+                else:
+                    inactive.discard(v)
+                if n_alive == 0 or len(inactive) == n:
+                    return False
+                # Nothing depends on an isolated node, it only needs to run until it stops
+                if not p.neighbors and p.inactive:
+                    break
+            return True
+
+        for p in self.processors:
+            p.status = Status.AWAKENED
+            p.init_config()
+            send_bundles(p)
+            if not p.is_alive():
+                n_alive -= 1
+            if p.inactive:
+                inactive.add(p.pid)
+        running = n_alive > 0 and len(inactive) < n
+        for v in range(n):
+            running = running and advance(v)
+
+        while running and heap:
+            self.virtual_time, _, src, v, (r, msgs, last) = heapq.heappop(heap)
+            if not self.processors[v].is_alive():
+                continue
+            if last:
+                gone[v][src] = r
+            entry = bundles[v].setdefault(r, [[], [], 0])
+            entry[0].extend(msgs)
+            entry[1].extend([src] * len(msgs))
+            entry[2] += 1
+            running = advance(v)
+
     def async_core(self):
+        if self.stats is not None:
+            self.stats.begin_round(self.round)
         while not self.all_status(Status.TERMINATED):
             indexes = [i for i in range(len(self.processors))]
             random.shuffle(indexes)
@@ -307,25 +1564,200 @@ class MessagePassingSystem:
                     if random.choice([True, False]):
                         self.send_one_msg(p)
 
+        if self.stats is not None:
+            worker_time = sum([p.worker_time for p in self.processors])
+            self.end_round_stats([], worker_time, 0.0)
+
         self.log('All processors have terminated, message passing system shutdown')
 
+    # Channel of the directed edge src -> target: the messages in transit and the virtual time
+    # the last of them arrives. Arrivals are never earlier than the previous one, keeping FIFO order.
+    def send_on_channel(self, src, msg, target):
+        if self.stats is not None:
+            self.stats.record_message(src, target, msg)
+        loop = self.loop
+        key = (src, target)
+        if key not in self.channels:
+            self.channels[key] = [deque(), 0.0]
+        channel = self.channels[key]
+        arrival = max(loop.time() + self.delay_policy.sample(self.rng, src, target), channel[1])
+        channel[0].append(msg)
+        channel[1] = arrival
+        self.in_flight += 1
+        loop.call_at(arrival, self.arrive, key)
+
+    def arrive(self, key):
+        msg = self.channels[key][0].popleft()
+        src, target = key
+        p = self.processors[target]
+        if p.is_alive():
+            p.in_buf.put_nowait((msg, src))
+        else:
+            self.message_done()
+
+    def message_done(self):
+        self.in_flight -= 1
+        if self.in_flight == 0 and not self.quiescent.done():
+            self.quiescent.set_result(None)
+
+    async def run_processor(self, p):
+        try:
+            p.status = Status.AWAKENED
+            p.init_config()
+            while p.is_alive():
+                p.status = Status.AWAITING_MSG
+                msg, src = await p.in_buf.get()
+                p.status = Status.TASK_DONE
+                start = time.perf_counter()
+                p.worker(msg, src)
+                p.worker_time += time.perf_counter() - start
+                self.message_done()
+            # Messages left in the inbox of a terminated processor are dropped
+            while not p.in_buf.empty():
+                p.in_buf.get_nowait()
+                self.message_done()
+        except Exception as e:
+            if not self.quiescent.done():
+                self.quiescent.set_exception(e)
+
+    async def asyncio_main(self):
+        self.quiescent = self.loop.create_future()
+        for p in self.processors:
+            p.in_buf = asyncio.Queue()
+            p.out_buf = ChannelWriter(self, p.pid)
+        tasks = [self.loop.create_task(self.run_processor(p)) for p in self.processors]
+        # Let every processor run init_config before looking for quiescence
+        await asyncio.sleep(0)
+        if self.in_flight == 0 and not self.quiescent.done():
+            self.quiescent.set_result(None)
+        try:
+            await self.quiescent
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    # Single threaded asynchronous system on a virtual clock: no processor thread, no sleeping,
+    # the clock jumps from one message arrival to the next.
+    def asyncio_core(self):
+        self.loop = VirtualClockLoop()
+        if self.stats is not None:
+            self.stats.begin_round(self.round)
+        try:
+            self.loop.run_until_complete(self.asyncio_main())
+            self.virtual_time = self.loop.time()
+        finally:
+            self.loop.close()
+
+        if self.stats is not None:
+            alive = [p for p in self.processors if p.is_alive()]
+            self.end_round_stats(alive, sum([p.worker_time for p in self.processors]), 0.0)
+        for p in self.processors:
+            p.status = Status.TERMINATED
+            p.log('Terminated')
+            self.global_shared_memory[p.pid] = p.result_buffer
+
+        self.log('No message in flight after %.3f time units, message passing system shutdown', self.virtual_time)
+
     def start(self):
         self.log('Constructing edges')
         for p in self.processors:
-            p.neighbors = self.edge_dict[p.pid]
-            self.log('Neighbors of %s: %s' % (p.pid, str(p.neighbors)))
+            p.barrier = self.barrier
+            p.tracer = self.tracer
+            p.aggregates = self.aggregates
+            if self.csr is not None:
+                indptr, indices = self.csr
+                p.neighbors = NeighborView(indices, indptr[p.pid], indptr[p.pid + 1])
+            else:
+                p.neighbors = self.edge_dict[p.pid]
+            self.log('Neighbors of %s: %s', p.pid, p.neighbors, level=DEBUG)
 
         self.log('System start')
-        for p in self.processors:
-            p.wake_up()
+        if self.engine == 'threaded':
+            for p in self.processors:
+                p.wake_up()
         self.thread.start()
 
+    def end_round_stats(self, alive, worker_time, delivery_time):
+        inactive = sum([1 for p in alive if p.inactive])
+        self.stats.current.delivery_time += delivery_time
+        self.stats.end_round(len(alive) - inactive, inactive, self.n_proc - len(alive), worker_time=worker_time)
+
+    # Saves the run at the round boundary after self.round to checkpoint_path, as a zlib compressed
+    # pickle: processor states, the messages pending for the next round, aggregates, the edge cache,
+    # the CONGEST monitor, statistics, and the states of the system's generator and of the random
+    # module. The file is replaced atomically, so an interrupted save keeps the previous checkpoint.
+    def save_checkpoint(self, alive, msgs, srcs):
+        state = {
+            'version': self.CHECKPOINT_VERSION,
+            'n_proc': self.n_proc,
+            'round': self.round,
+            'processors': self.processors,
+            'alive': [p.pid for p in alive],
+            'pending': {pid: (msgs[pid], srcs[pid]) for pid in range(len(msgs)) if msgs[pid]},
+            'aggregates': self.aggregates,
+            'edge_cache': (self.edge_cache.states, self.edge_cache.items) if self.edge_cache is not None else None,
+            'congest': self.congest,
+            'stats': self.stats,
+            'random': random.getstate(),
+            'rng': self.rng.getstate(),
+        }
+        tmp = self.checkpoint_path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(zlib.compress(pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)))
+        os.replace(tmp, self.checkpoint_path)
+        self.log('Round %d: checkpoint saved to %s', self.round, self.checkpoint_path)
+
+    # Loads a checkpoint before start(), the run then continues from its round boundary exactly as
+    # the saved run would have, including the random module. The system must be constructed with
+    # the same arguments as the one that saved it (checkpoint options may differ).
+    def restore(self, path):
+        with open(path, 'rb') as f:
+            state = pickle.loads(zlib.decompress(f.read()))
+        if state.get('version') != self.CHECKPOINT_VERSION:
+            raise ValueError('Unsupported checkpoint version %s' % (state.get('version'),))
+        if self.engine != 'inline' or self.msg_plane is not None or (self.processors and self.processors[0].event_driven):
+            raise ValueError('Checkpoints require the inline engine without message plane or event driven processors')
+        if state['n_proc'] != self.n_proc or \
+                any(type(p) is not type(q) for p, q in zip(state['processors'], self.processors)):
+            raise ValueError('Checkpoint %s was saved by a different system' % (path,))
+
+        self.processors = state['processors']
+        self.round = state['round']
+        self.aggregates = state['aggregates']
+        if self.edge_cache is not None and state['edge_cache'] is not None:
+            self.edge_cache.states, self.edge_cache.items = state['edge_cache']
+        if self.congest is not None and state['congest'] is not None:
+            self.congest = state['congest']
+        if self.stats is not None and state['stats'] is not None:
+            self.stats = state['stats']
+        random.setstate(state['random'])
+        self.rng.setstate(state['rng'])
+        if self.tracer is not None:
+            self.tracer.round = self.round
+        self.resume_state = (state['alive'], state['pending'])
+        self.log('Restored round %d from %s', self.round, path)
+
+    def next_round(self):
+        self.round += 1
+        self.aggregates.commit()
+        if self.tracer is not None:
+            self.tracer.round = self.round
+
     def wait_for_all(self):
         for p in self.processors:
-            p.thread.join()
-
-    def log(self, msg):
-        if self.verbose:
+            if p.thread is not None:
+                p.thread.join()
+        # Results are collected by the system thread after all processors stop
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def log(self, msg, *args, level=INFO):
+        if self.tracer is not None:
+            self.tracer.log(None, level, msg, args)
+        elif self.verbose:
+            msg = msg % args if args else msg
             print('[Message Passing System]: ' + msg)
 
     @staticmethod
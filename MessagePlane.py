@@ -0,0 +1,295 @@
+from operator import itemgetter
+import numpy as np
+import lib
+
+
+# Positions of the leaves of a message template, e.g. (0, (0, 0), 0) -> (0, (1, 2), 3)
+def template_shape(template, start=0):
+    shape = []
+    for field in template:
+        if isinstance(field, tuple):
+            sub, start = template_shape(field, start)
+            shape.append(sub)
+        else:
+            shape.append(start)
+            start += 1
+    return tuple(shape), start
+
+
+# Encoder msg -> flat list of ints of a template shape. A message with missing or extra fields
+# raises a TypeError, as does writing a tuple found in place of an int field.
+def make_encoder(shape):
+    n = len(shape)
+    if not any([isinstance(s, tuple) for s in shape]):
+        def encode(msg):
+            if len(msg) != n:
+                raise TypeError('%d fields instead of %d' % (len(msg), n))
+            return list(msg)
+        return encode
+    parts = [(i, make_encoder(s) if isinstance(s, tuple) else None) for i, s in enumerate(shape)]
+
+    def encode(msg):
+        if len(msg) != n:
+            raise TypeError('%d fields instead of %d' % (len(msg), n))
+        values = []
+        for i, part in parts:
+            if part is None:
+                values.append(msg[i])
+            else:
+                values += part(msg[i])
+        return values
+    return encode
+
+
+# Decoder (values, offset) -> msg of a template shape
+def make_decoder(shape):
+    if not any([isinstance(s, tuple) for s in shape]):
+        # Leaves of a flat tuple are consecutive
+        lo, hi = (shape[0], shape[-1] + 1) if shape else (0, 0)
+        return lambda values, offset: tuple(values[offset + lo:offset + hi])
+    n = len(shape)
+    leaves = [(i, s) for i, s in enumerate(shape) if not isinstance(s, tuple)]
+    subs = [(i, make_decoder(s)) for i, s in enumerate(shape) if isinstance(s, tuple)]
+
+    def decode(values, offset):
+        msg = [None] * n
+        for i, pos in leaves:
+            msg[i] = values[offset + pos]
+        for i, sub in subs:
+            msg[i] = sub(values, offset)
+        return tuple(msg)
+    return decode
+
+
+# Encoder msg -> flat list of ints, and decoder (values, offset) -> msg of a template
+def make_codec(template):
+    shape, _ = template_shape(template)
+    return make_encoder(shape), make_decoder(shape)
+
+
+# Leaf paths of a template shape in leaf order, e.g. (0, (1, 2), 3) -> [(0,), (1, 0), (1, 1), (2,)]
+def leaf_paths(shape, prefix=()):
+    paths = []
+    for i, field in enumerate(shape):
+        if isinstance(field, tuple):
+            paths.extend(leaf_paths(field, prefix + (i,)))
+        else:
+            paths.append(prefix + (i,))
+    return paths
+
+
+# Paths and lengths of the tuples of a template shape, the message itself first
+def subtuples(shape, prefix=()):
+    found = [(prefix, len(shape))]
+    for i, field in enumerate(shape):
+        if isinstance(field, tuple):
+            found.extend(subtuples(field, prefix + (i,)))
+    return found
+
+
+# Iterator over the item at path of every message of msgs
+def pluck(msgs, path):
+    for i in path:
+        msgs = map(itemgetter(i), msgs)
+    return msgs
+
+
+# Values of the field at path (e.g. 1, 1 for b in (round, (a, b), stage)) of every message of
+# msgs, read from the plane's columns for an Inbox without decoding the messages
+def field(msgs, *path):
+    if isinstance(msgs, Inbox):
+        return msgs.field(*path)
+    return list(pluck(msgs, path))
+
+
+# Fixed-layout message buffers for synchronous rounds.
+# Every directed edge u -> v owns one slot per round, located in v's CSR range, so a
+# receiver reads all its messages from one contiguous block. Slots hold the message
+# flattened to ints following template. There are two buffers: senders write the current
+# round while receivers read the previous one, and swap() flips them at the round boundary.
+# Sending only queues the message and its slot; the messages of a round are written to the
+# buffer at once by flush(), one column per field (checking the nested structure of all of them
+# with C level maps), and are read back as per field columns through Inbox.field.
+# At most one message per edge per round can be carried.
+class MessagePlane:
+    def __init__(self, n, edges, template):
+        self.indptr, self.indices = lib.to_csr(n, edges)
+        self.starts = self.indptr.tolist()
+        self.sources = self.indices.tolist()
+        self.shape, self.width = template_shape(template)
+        self.encode, self.decode = make_codec(template)
+        m = len(self.indices)
+
+        # rev[k]: slot in the receiver's range for the directed edge stored at k in the sender's range
+        owner = np.repeat(np.arange(n, dtype=np.int64), np.diff(self.indptr))
+        self.rev = np.searchsorted(owner * n + self.indices, self.indices * n + owner)
+
+        self.data = np.zeros((2, m, self.width), dtype=np.int64)
+        self.valid = np.zeros((2, m), dtype=bool)
+        self.m = m
+        self.write_buf = 0
+
+        # Messages sent in the current round, not flushed yet, with the number of slots each goes
+        # to (a broadcast is queued once) and the slots
+        self.pending = []
+        self.pending_counts = []
+        self.pending_slots = []
+        # Paths of the leaves and of the tuples (with their lengths) of a message
+        self.leaf_paths = leaf_paths(self.shape)
+        self.tuple_paths = subtuples(self.shape)
+
+        # Columns of the read buffer as lists, built on first use in a round
+        self.columns = None
+        self.all_valid = False
+        self.valid_list = None
+
+    @property
+    def read_buf(self):
+        return 1 - self.write_buf
+
+    # Slot lookup {target: slot} of one sender
+    def slots_of(self, pid):
+        lo, hi = self.indptr[pid], self.indptr[pid + 1]
+        return dict(zip(self.indices[lo:hi].tolist(), self.rev[lo:hi].tolist()))
+
+    def writer(self, pid):
+        return PlaneWriter(self, pid)
+
+    # Writes the messages sent in the current round to the write buffer
+    def flush(self):
+        msgs, counts, slots = self.pending, self.pending_counts, self.pending_slots
+        if not msgs:
+            return
+        self.pending, self.pending_counts, self.pending_slots = [], [], []
+        try:
+            for path, length in self.tuple_paths:
+                if len(msgs) != sum(map(length.__eq__, map(len, pluck(msgs, path)))):
+                    raise TypeError
+            columns = np.array([list(pluck(msgs, path)) for path in self.leaf_paths], dtype=np.int64)
+        except (IndexError, TypeError, ValueError):
+            bad = next((m for m in msgs if not self.matches(m)), msgs[0])
+            raise ValueError('Message %s does not match the message template' % (str(bad),))
+        columns = np.repeat(columns, counts, axis=1)
+        slots = np.array(slots, dtype=np.int64)
+        if len(slots) > 1 and np.bincount(slots, minlength=self.m).max() > 1:
+            raise ValueError('Message plane carries at most one message per edge per round')
+        self.data[self.write_buf, slots] = columns.T
+        self.valid[self.write_buf, slots] = True
+
+    def matches(self, msg):
+        try:
+            values = self.encode(msg)
+            np.array(values, dtype=np.int64)
+            return not any([isinstance(v, tuple) for v in values])
+        except (IndexError, TypeError, ValueError):
+            return False
+
+    # Messages, bits and bytes written in the current round
+    def traffic(self):
+        self.flush()
+        messages = int(np.count_nonzero(self.valid[self.write_buf]))
+        return messages, messages * self.width * 64, messages * self.width * 8
+
+    # Start a new round: what was written becomes readable
+    def swap(self):
+        self.flush()
+        self.write_buf = self.read_buf
+        self.valid[self.write_buf] = False
+        self.columns = None
+
+    # Read buffer as one list per leaf, and whether every slot holds a message
+    def read_columns(self):
+        if self.columns is None:
+            self.columns = self.data[self.read_buf].T.tolist()
+            valid = self.valid[self.read_buf]
+            self.all_valid = bool(valid.all())
+            self.valid_list = None if self.all_valid else valid.tolist()
+        return self.columns
+
+    def inbox(self, pid):
+        return Inbox(self, pid)
+
+
+# Stands in for AbstractProcessor.out_buf: messages are queued on the plane when sent.
+class PlaneWriter:
+    def __init__(self, plane, pid):
+        self.plane = plane
+        self.pid = pid
+        self.slots = plane.slots_of(pid)
+        # Slots of the last targets of put_all
+        self.targets = None
+        self.target_slots = []
+
+    def put(self, item, block=True):
+        msg, target = item
+        try:
+            slot = self.slots[target]
+        except KeyError:
+            raise ValueError('Message plane only carries messages to neighbors, %s -> %s' % (self.pid, target))
+        self.plane.pending.append(msg)
+        self.plane.pending_counts.append(1)
+        self.plane.pending_slots.append(slot)
+
+    def put_all(self, msg, targets):
+        # Processors broadcast to the same neighbors round after round. Neighbor sets are
+        # frozensets, replaced rather than modified, so their identity is enough
+        if targets is not self.targets or not isinstance(targets, frozenset):
+            try:
+                self.target_slots = list(map(self.slots.__getitem__, targets))
+            except KeyError as e:
+                raise ValueError('Message plane only carries messages to neighbors, %s -> %s' % (self.pid, e.args[0]))
+            self.targets = targets
+        self.plane.pending.append(msg)
+        self.plane.pending_counts.append(len(self.target_slots))
+        self.plane.pending_slots.extend(self.target_slots)
+
+    def put_nowait(self, item):
+        self.put(item)
+
+    def empty(self):
+        return True
+
+
+# Messages delivered to one processor in the current round, read from the plane in place.
+# field(*path) gives one field of all messages without decoding them, iterating decodes them
+# back to tuples, array/mask give the raw block of the receiver.
+class Inbox:
+    def __init__(self, plane, pid):
+        self.plane = plane
+        self.buf = plane.read_buf
+        self.lo, self.hi = plane.starts[pid], plane.starts[pid + 1]
+
+    @property
+    def array(self):
+        return self.plane.data[self.buf, self.lo:self.hi]
+
+    @property
+    def mask(self):
+        return self.plane.valid[self.buf, self.lo:self.hi]
+
+    def select(self, values):
+        plane = self.plane
+        if plane.all_valid:
+            return values[self.lo:self.hi]
+        return [v for v, ok in zip(values[self.lo:self.hi], plane.valid_list[self.lo:self.hi]) if ok]
+
+    def field(self, *path):
+        plane = self.plane
+        leaf = plane.shape
+        for i in path:
+            leaf = leaf[i]
+        return self.select(plane.read_columns()[leaf])
+
+    def sources(self):
+        self.plane.read_columns()
+        return self.select(self.plane.sources)
+
+    def __len__(self):
+        return len(self.sources())
+
+    def __iter__(self):
+        plane = self.plane
+        columns = [self.select(column) for column in plane.read_columns()]
+        decode = plane.decode
+        for values in zip(*columns):
+            yield decode(values, 0)
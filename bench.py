@@ -0,0 +1,221 @@
+import argparse
+import csv
+import json
+import math
+import multiprocessing
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+import networkx as nx
+import numpy as np
+import lib
+import graphgen
+from AGColoring_mps import run_coloring, choose_q
+import AGColoring_batch
+import validate
+
+ENGINES = ('threaded', 'inline', 'sharded', 'des', 'socket', 'event_driven', 'plane', 'batch')
+# run_coloring arguments of the modes that are not engines of MessagePassingSystem
+MODES = {'event_driven': {'engine': 'inline', 'event_driven': True},
+         'plane': {'engine': 'inline', 'msg_template': (0, (0, 0), 0)}}
+FAMILIES = ('random', 'ring', 'low_delta', 'regular', 'grid', 'geometric', 'bounded', 'powerlaw')
+# Families taking a degree: the degree of regular and bounded graphs, the average degree of
+# geometric graphs and the maximum degree of power law graphs
+DEGREE_FAMILIES = ('regular', 'geometric', 'bounded', 'powerlaw')
+FIELDS = ('family', 'n', 'degree', 'engine', 'delta', 'q', 'status', 'correct', 'rounds', 'messages',
+          'gen_time', 'wall_time', 'msgs_per_sec', 'peak_rss_mb', 'commit', 'timestamp')
+
+
+# degree is only used by the families that take one
+def make_graph(family, n, degree, seed):
+    random.seed(seed)
+    np.random.seed(seed)
+    if family == 'random':
+        return lib.gen_random_graph(n)
+    if family == 'ring':
+        return lib.gen_ring(n)
+    if family == 'low_delta':
+        return lib.gen_low_delta_graph(n)
+    if family == 'regular':
+        return nx.random_regular_graph(degree, n, seed=seed)
+    if family == 'grid':
+        k = int(math.sqrt(n))
+        return graphgen.grid(k, k).to_networkx()
+    if family == 'geometric':
+        return graphgen.geometric(n, avg_degree=degree, seed=seed).to_networkx()
+    if family == 'bounded':
+        return graphgen.bounded_degree(n, degree, seed=seed).to_networkx()
+    if family == 'powerlaw':
+        return graphgen.power_law(n, max_degree=degree, seed=seed).to_networkx()
+    raise ValueError('Unknown graph family %s' % (family,))
+
+
+# Proper coloring using colors 0..delta only
+def check_coloring(G, colors, delta):
+    n = G.number_of_nodes()
+    indptr, indices = lib.to_csr(n, G.edges())
+    return not validate.validate(indptr, indices, np.array([colors[pid] for pid in range(n)]), delta)
+
+
+def run_case(case, seed, n_shards):
+    start = time.perf_counter()
+    G = make_graph(case['family'], case['n'], case['degree'], seed)
+    gen_time = time.perf_counter() - start
+    n, delta = G.number_of_nodes(), lib.calc_delta(G)
+    q = choose_q(n, delta)
+
+    start = time.perf_counter()
+    if case['engine'] == 'batch':
+        indptr, indices = lib.to_csr(n, G.edges())
+        _, b, _ = AGColoring_batch.ag_coloring(indptr, indices, list(range(n)), delta, q, record_history=False)
+        wall_time = time.perf_counter() - start
+        colors = dict(enumerate(b.tolist()))
+        # AG and reduction rounds only, the engines also count init_config and the final empty round
+        rounds, messages = q + (q - delta), None
+    else:
+        kwargs = dict(MODES.get(case['engine'], {'engine': case['engine']}))
+        if case['engine'] in ('sharded', 'socket'):
+            kwargs['n_shards'] = n_shards
+        mps = run_coloring(G, q=q, record_history=False, collect_stats=True, **kwargs)
+        wall_time = time.perf_counter() - start
+        colors = {pid: x['color'][1] for pid, x in mps.global_shared_memory.items()}
+        rounds, messages = mps.round, mps.stats.messages
+
+    # Peak of this process plus the largest shard process, in MB
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss + resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return dict(case, n=n, delta=delta, q=q, status='ok', correct=check_coloring(G, colors, delta),
+                rounds=rounds, messages=messages, gen_time=gen_time, wall_time=wall_time,
+                msgs_per_sec=messages / wall_time if messages is not None and wall_time > 0 else None,
+                peak_rss_mb=peak / 1024)
+
+
+def case_process(conn, case, seed, n_shards):
+    try:
+        conn.send(run_case(case, seed, n_shards))
+    except Exception as e:
+        conn.send(dict(case, status='error: %s' % (e,)))
+    conn.close()
+
+
+# Every case runs in a fresh process so peak RSS is not polluted by earlier cases
+def run_isolated(case, seed, n_shards, timeout):
+    parent, child = multiprocessing.Pipe(duplex=False)
+    proc = multiprocessing.Process(target=case_process, args=(child, case, seed, n_shards))
+    proc.start()
+    child.close()
+    if parent.poll(timeout):
+        result = parent.recv()
+    else:
+        proc.terminate()
+        result = dict(case, status='timeout')
+    proc.join()
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_results(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def case_key(r):
+    return r['family'], r['n'], r['degree'], r['engine']
+
+
+# Regressions of results against a baseline: wrong colorings, changed round counts,
+# and wall times more than threshold (a fraction) above the baseline. Runs shorter than
+# min_time are too noisy to time and are only checked for correctness.
+def compare(results, baseline, threshold, min_time):
+    latest = {case_key(r): r for r in baseline if r.get('status') == 'ok'}
+    regressions = []
+    print('%-10s %8s %6s %-12s %10s %10s %7s' % ('family', 'n', 'degree', 'engine', 'base (s)', 'now (s)', 'ratio'))
+    for r in results:
+        base = latest.get(case_key(r))
+        if base is None or r.get('status') != 'ok':
+            continue
+        ratio = r['wall_time'] / base['wall_time'] if base['wall_time'] > 0 else float('inf')
+        problems = []
+        if not r['correct']:
+            problems.append('incorrect coloring')
+        if r['rounds'] != base['rounds']:
+            problems.append('rounds %s -> %s' % (base['rounds'], r['rounds']))
+        if ratio > 1 + threshold and r['wall_time'] >= min_time:
+            problems.append('slower')
+        print('%-10s %8d %6s %-12s %10.3f %10.3f %7.2f %s' % (r['family'], r['n'], r['degree'], r['engine'],
+                                                          base['wall_time'], r['wall_time'], ratio,
+                                                          ', '.join(problems)))
+        if problems:
+            regressions.append((r, problems))
+    return regressions
+
+
+def print_row(r):
+    if r.get('status') != 'ok':
+        print('%-10s %8d %6s %-12s %s' % (r['family'], r['n'], r['degree'], r['engine'], r['status']))
+        return
+    print('%-10s %8d %6s %-12s %5d %5d %6d %8.3f %8.3f %12s %9.1f %s' %
+          (r['family'], r['n'], r['degree'], r['engine'], r['delta'], r['q'], r['rounds'], r['gen_time'],
+           r['wall_time'], '%.0f' % (r['msgs_per_sec'],) if r['msgs_per_sec'] is not None else '-',
+           r['peak_rss_mb'], 'ok' if r['correct'] else 'WRONG'))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark AG coloring over graph families and engines')
+    parser.add_argument('-n', type=int, nargs='+', default=[100, 1000])
+    parser.add_argument('--families', nargs='+', default=['random', 'ring', 'low_delta', 'regular'], choices=FAMILIES)
+    parser.add_argument('--degrees', type=int, nargs='+', default=[3, 8],
+                        help='degrees swept for the families taking one')
+    parser.add_argument('--engines', nargs='+', default=['inline', 'batch'], choices=ENGINES)
+    parser.add_argument('--shards', type=int, default=None, help='shards of the sharded and socket engines')
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--timeout', type=float, default=600, help='seconds allowed per case')
+    parser.add_argument('--out', default='bench_results.jsonl', help='results are appended to this file')
+    parser.add_argument('--csv', default=None, help='also write this run as CSV')
+    parser.add_argument('--compare', default=None, help='baseline JSONL to check for regressions')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed slowdown against the baseline')
+    parser.add_argument('--min-time', type=float, default=0.05, help='runs faster than this are not timed against the baseline')
+    args = parser.parse_args()
+
+    cases = []
+    for family in args.families:
+        for n in args.n:
+            for degree in (args.degrees if family in DEGREE_FAMILIES else [None]):
+                for engine in args.engines:
+                    cases.append({'family': family, 'n': n, 'degree': degree, 'engine': engine})
+
+    commit, timestamp = git_commit(), time.time()
+    print('%-10s %8s %6s %-12s %5s %5s %6s %8s %8s %12s %9s %s' %
+          ('family', 'n', 'degree', 'engine', 'delta', 'q', 'rounds', 'gen (s)', 'run (s)', 'msgs/sec',
+           'peak (MB)', 'check'))
+    results = []
+    for case in cases:
+        for i in range(args.repeat):
+            r = run_isolated(case, args.seed + i, args.shards, args.timeout)
+            r.update(commit=commit, timestamp=timestamp)
+            print_row(r)
+            results.append(r)
+
+    with open(args.out, 'a') as f:
+        for r in results:
+            f.write(json.dumps(r) + '\n')
+    if args.csv:
+        with open(args.csv, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=FIELDS, extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(results)
+
+    failed = [r for r in results if r.get('status') != 'ok' or not r['correct']]
+    if args.compare:
+        failed += compare(results, load_results(args.compare), args.threshold, args.min_time)
+    sys.exit(1 if failed else 0)
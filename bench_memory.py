@@ -0,0 +1,61 @@
+import argparse
+import math
+import time
+import tracemalloc
+import lib
+from MessagePassingSystem import MessagePassingSystem
+from AGColoring_mps import Processor, CompactProcessor, StateTable
+
+
+# Ring with a chord from every third node, degree stays small and generation is cheap.
+def synthetic_edges(n):
+    edges = set()
+    for i in range(n):
+        edges.add((min(i, (i + 1) % n), max(i, (i + 1) % n)))
+        if i % 3 == 0 and (i * 7 + 3) % n != i:
+            j = (i * 7 + 3) % n
+            edges.add((min(i, j), max(i, j)))
+    return sorted(e for e in edges if e[0] != e[1])
+
+
+def proc_config(mode, n, delta, q):
+    if mode == 'default':
+        return Processor, {pid: {'delta': delta, 'q': q, 'color': pid} for pid in range(n)}, False
+    table = StateTable(n)
+    return CompactProcessor, {pid: {'delta': delta, 'q': q, 'color': pid, 'table': table}
+                              for pid in range(n)}, True
+
+
+# Bytes per node retained after a full inline run, and peak bytes per node during it
+def measure(mode, n, edges, delta, q):
+    tracemalloc.start()
+    start = time.time()
+    proc_class, proc_args, compact = proc_config(mode, n, delta, q)
+    mps = MessagePassingSystem(proc_class=proc_class, proc_args=proc_args, n_proc=n, edges=edges,
+                               is_async=False, verbose=False, engine='inline', compact=compact)
+    for p in mps.processors:
+        p.verbose = False
+    mps.start()
+    mps.wait_for_all()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return current / n, peak / n, time.time() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Per node memory footprint of AGColoring_mps processors')
+    parser.add_argument('-n', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--modes', nargs='+', default=['default', 'compact'], choices=['default', 'compact'])
+    args = parser.parse_args()
+
+    print('%-8s %8s %4s %5s %14s %14s %8s' % ('mode', 'n', 'delta', 'q', 'bytes/node', 'peak/node', 'time'))
+    for n in args.n:
+        edges = synthetic_edges(n)
+        indptr, _ = lib.to_csr(n, edges)
+        delta = int(max(indptr[1:] - indptr[:-1]))
+        q = lib.choose_prime(math.sqrt(n))
+        if q <= 2 * delta:
+            q = lib.choose_prime(2 * delta)
+        for mode in args.modes:
+            current, peak, elapsed = measure(mode, n, edges, delta, q)
+            print('%-8s %8d %4d %5d %14.0f %14.0f %8.2f' % (mode, n, delta, q, current, peak, elapsed))
@@ -0,0 +1,142 @@
+import csv
+from MessagePlane import make_codec
+
+
+class CongestViolation(ValueError):
+    pass
+
+
+# Bits needed to write the integers 0..max_value
+def bits_for(max_value):
+    return max(int(max_value).bit_length(), 1)
+
+
+# O(log n) bits per edge per round, the bandwidth of the CONGEST model
+def default_bandwidth(n):
+    return 4 * bits_for(max(n - 1, 1))
+
+
+# Layout of the messages of an algorithm: a nested tuple of field widths in bits with the
+# structure of the messages, e.g. (5, (4, 4), 1) for (round, (a, b), stage).
+# Fields hold non negative integers, a message packs into a single int of width bits.
+class MsgSchema:
+    def __init__(self, widths):
+        self.widths = widths
+        self.encode, self.decode = make_codec(widths)
+        self.field_widths = list(self.encode(widths))
+        self.shifts = []
+        shift = 0
+        for w in self.field_widths:
+            self.shifts.append(shift)
+            shift += w
+        self.width = shift
+        self.n_bytes = (self.width + 7) // 8
+
+    # The codec is rebuilt from the widths, e.g. when restoring a checkpoint
+    def __getstate__(self):
+        return self.widths
+
+    def __setstate__(self, widths):
+        self.__init__(widths)
+
+    def pack(self, msg):
+        try:
+            values = self.encode(msg)
+            packed = 0
+            for value, w, shift in zip(values, self.field_widths, self.shifts):
+                if value < 0 or value >> w:
+                    raise CongestViolation('Field value %s of message %s does not fit in %d bits' % (value, str(msg), w))
+                packed |= value << shift
+        except (IndexError, TypeError):
+            raise CongestViolation('Message %s does not match the schema %s' % (str(msg), str(self.widths)))
+        return packed
+
+    def unpack(self, packed):
+        return self.decode([(packed >> shift) & ((1 << w) - 1) for w, shift in zip(self.field_widths, self.shifts)], 0)
+
+    def to_bytes(self, msg):
+        return self.pack(msg).to_bytes(self.n_bytes, 'little')
+
+    def from_bytes(self, data):
+        return self.unpack(int.from_bytes(data, 'little'))
+
+
+class CongestRound:
+    FIELDS = ('round', 'messages', 'bits', 'edges', 'max_edge_bits', 'utilization', 'violations')
+
+    def __init__(self, r, messages, bits, edges, max_edge_bits, utilization, violations):
+        self.round = r
+        self.messages = messages
+        self.bits = bits
+        self.edges = edges
+        self.max_edge_bits = max_edge_bits
+        self.utilization = utilization
+        self.violations = violations
+
+    def as_row(self):
+        return [getattr(self, f) for f in self.FIELDS]
+
+
+# Packs messages for transport and enforces bandwidth bits per directed edge per round.
+# Violations are recorded as (round, src, dst, bits) (the first max_recorded of them),
+# with strict a CongestViolation is raised instead. Utilization of a round is the fraction
+# of the bandwidth used on the edges that carried messages.
+class CongestMonitor:
+    def __init__(self, schema, bandwidth, n, strict=False, max_recorded=1000):
+        self.schema = schema
+        self.bandwidth = bandwidth
+        self.n = n
+        self.strict = strict
+        self.max_recorded = max_recorded
+        self.rounds = []
+        self.violations = []
+        self.n_violations = 0
+        self.edge_bits = {}
+        self.messages = 0
+
+    def pack(self, src, dst, msg, r):
+        packed = self.schema.pack(msg)
+        key = src * self.n + dst
+        bits = self.edge_bits.get(key, 0) + self.schema.width
+        self.edge_bits[key] = bits
+        self.messages += 1
+        if bits > self.bandwidth and bits - self.schema.width <= self.bandwidth:
+            # First message over the cap on this edge in this round
+            if self.strict:
+                raise CongestViolation('Round %d: %d bits sent on edge %s -> %s, bandwidth is %d bits'
+                                       % (r, bits, src, dst, self.bandwidth))
+            self.n_violations += 1
+            if len(self.violations) < self.max_recorded:
+                self.violations.append((r, src, dst, bits))
+        return packed
+
+    def end_round(self, r):
+        edge_bits = self.edge_bits
+        total = sum(edge_bits.values())
+        over = sum([1 for bits in edge_bits.values() if bits > self.bandwidth])
+        utilization = total / (self.bandwidth * len(edge_bits)) if edge_bits else 0.0
+        self.rounds.append(CongestRound(r, self.messages, total, len(edge_bits), max(edge_bits.values(), default=0),
+                                        utilization, over))
+        self.edge_bits = {}
+        self.messages = 0
+
+    @property
+    def utilization(self):
+        used = sum([r.edges for r in self.rounds])
+        return sum([r.bits for r in self.rounds]) / (self.bandwidth * used) if used else 0.0
+
+    @property
+    def max_edge_bits(self):
+        return max([r.max_edge_bits for r in self.rounds], default=0)
+
+    def to_csv(self, path):
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(CongestRound.FIELDS)
+            for r in self.rounds:
+                writer.writerow(r.as_row())
+
+    def summary(self):
+        return 'message width: %d bits, bandwidth: %d bits, max per edge: %d bits, utilization: %.1f%%, ' \
+               'violations: %d' % (self.schema.width, self.bandwidth, self.max_edge_bits,
+                                   100 * self.utilization, self.n_violations)
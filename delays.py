@@ -0,0 +1,108 @@
+import math
+
+
+# Channel delay policies of the asynchronous engines (asyncio and des). A policy returns the
+# delay of one message sent on the directed edge src -> dst, drawing from the engine's seeded
+# random.Random, so a run is reproducible under a seed. Delays are in virtual time units.
+class Constant:
+    def __init__(self, delay=1.0):
+        self.delay = delay
+
+    def sample(self, rng, src, dst):
+        return self.delay
+
+
+class Uniform:
+    def __init__(self, low=0.0, high=1.0):
+        self.low = low
+        self.high = high
+
+    def sample(self, rng, src, dst):
+        return rng.uniform(self.low, self.high)
+
+
+class Exponential:
+    def __init__(self, mean=1.0):
+        self.mean = mean
+
+    def sample(self, rng, src, dst):
+        return rng.expovariate(1 / self.mean)
+
+
+# Heavy tailed delays, occasionally some messages are very late
+class LogNormal:
+    def __init__(self, mu=0.0, sigma=1.0):
+        self.mu = mu
+        self.sigma = sigma
+
+    def sample(self, rng, src, dst):
+        return rng.lognormvariate(self.mu, self.sigma)
+
+
+# Different policies per directed edge, edges not listed use default.
+# With symmetric, (u, v) also sets the policy of (v, u).
+class PerEdge:
+    def __init__(self, policies, default=None, symmetric=True):
+        self.policies = dict(policies)
+        if symmetric:
+            for (u, v), policy in list(self.policies.items()):
+                self.policies.setdefault((v, u), policy)
+        self.default = default if default is not None else Constant()
+
+    def sample(self, rng, src, dst):
+        return self.policies.get((src, dst), self.default).sample(rng, src, dst)
+
+
+# Every edge gets a fixed delay drawn once from base, then jittered by up to jitter per message.
+# Models links of different but stable latency.
+class FixedPerEdge:
+    def __init__(self, base=None, jitter=0.0):
+        self.base = base if base is not None else Uniform()
+        self.jitter = jitter
+        self.latency = {}
+
+    def sample(self, rng, src, dst):
+        if (src, dst) not in self.latency:
+            self.latency[(src, dst)] = self.base.sample(rng, src, dst)
+        return self.latency[(src, dst)] + (rng.uniform(0, self.jitter) if self.jitter else 0.0)
+
+
+# Adversary slowing down every message sent or received by some nodes, e.g. to delay a
+# leader candidate or a high degree hub. Other messages use default.
+class SlowNodes:
+    def __init__(self, nodes, slow=None, default=None):
+        self.nodes = set(nodes)
+        self.slow = slow if slow is not None else Constant(10.0)
+        self.default = default if default is not None else Uniform()
+
+    def sample(self, rng, src, dst):
+        policy = self.slow if src in self.nodes or dst in self.nodes else self.default
+        return policy.sample(rng, src, dst)
+
+
+# Adversary picking a fraction of the directed edges, the first time they are used, to be slow.
+# The choice comes from the engine's generator, so it is reproducible under the seed.
+class SlowEdges:
+    def __init__(self, fraction=0.1, slow=None, default=None):
+        self.fraction = fraction
+        self.slow = slow if slow is not None else Constant(10.0)
+        self.default = default if default is not None else Uniform()
+        self.is_slow = {}
+
+    def sample(self, rng, src, dst):
+        if (src, dst) not in self.is_slow:
+            self.is_slow[(src, dst)] = rng.random() < self.fraction
+        policy = self.slow if self.is_slow[(src, dst)] else self.default
+        return policy.sample(rng, src, dst)
+
+
+# Policy used when the system is not given one: a number means a constant delay,
+# otherwise uniform delays up to max_channel_delay (1 if it is 0).
+def make_policy(delay, max_channel_delay=0):
+    if delay is None:
+        return Uniform(0.0, max_channel_delay or 1.0)
+    if isinstance(delay, (int, float)):
+        if delay < 0 or math.isnan(delay):
+            raise ValueError('Channel delay must be non negative')
+        return Constant(delay)
+    return delay
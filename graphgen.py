@@ -0,0 +1,215 @@
+import math
+import numpy as np
+import networkx as nx
+
+
+# Undirected graph with nodes 0..n-1 in compressed sparse row form, see lib.to_csr.
+# pos is an optional (n, 2) array of node positions in the unit square.
+class CSRGraph:
+    def __init__(self, indptr, indices, pos=None):
+        self.indptr = indptr
+        self.indices = indices
+        self.pos = pos
+
+    @classmethod
+    def from_edges(cls, n, src, dst, pos=None):
+        indptr, indices = csr_from_arrays(n, src, dst)
+        return cls(indptr, indices, pos)
+
+    @property
+    def n(self):
+        return len(self.indptr) - 1
+
+    @property
+    def m(self):
+        return len(self.indices) // 2
+
+    def degrees(self):
+        return np.diff(self.indptr)
+
+    @property
+    def delta(self):
+        return int(self.degrees().max()) if self.n > 0 else 0
+
+    def neighbors(self, v):
+        return self.indices[self.indptr[v]:self.indptr[v + 1]]
+
+    # Edges (u, v) with u < v, yielded as (src, dst) arrays of at most chunk_size edges,
+    # so they can be consumed without materializing a python edge list.
+    def edge_chunks(self, chunk_size=1 << 20):
+        start, total = 0, len(self.indices)
+        while start < total:
+            end = min(start + 2 * chunk_size, total)
+            src = np.searchsorted(self.indptr, np.arange(start, end), side='right') - 1
+            dst = self.indices[start:end]
+            keep = src < dst
+            yield src[keep], dst[keep]
+            start = end
+
+    def edges(self):
+        for src, dst in self.edge_chunks():
+            yield from zip(src.tolist(), dst.tolist())
+
+    # Writes "u v" lines chunk by chunk
+    def save_edgelist(self, path, chunk_size=1 << 20):
+        with open(path, 'w') as f:
+            for src, dst in self.edge_chunks(chunk_size):
+                np.savetxt(f, np.column_stack((src, dst)), fmt='%d')
+
+    # For existing callers of lib, positions are stored in the 'pos' node attribute like
+    # nx.random_geometric_graph does.
+    def to_networkx(self):
+        G = nx.empty_graph(self.n)
+        for src, dst in self.edge_chunks():
+            G.add_edges_from(zip(src.tolist(), dst.tolist()))
+        if self.pos is not None:
+            nx.set_node_attributes(G, dict(enumerate(self.pos.tolist())), 'pos')
+        return G
+
+
+# Symmetric CSR arrays from undirected edges given as two int arrays.
+# Self loops and duplicates are dropped, neighbor lists are sorted.
+def csr_from_arrays(n, src, dst):
+    src, dst = np.asarray(src, dtype=np.int64), np.asarray(dst, dtype=np.int64)
+    keep = src != dst
+    src, dst = src[keep], dst[keep]
+    # Both directions encoded as src * n + dst, sorting them orders rows and neighbors at once
+    key = np.concatenate([src * n + dst, dst * n + src])
+    key.sort()
+    if len(key):
+        key = key[np.concatenate([[True], key[1:] != key[:-1]])]
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(key // n, minlength=n), out=indptr[1:])
+    return indptr, key % n
+
+
+# Drops edges so no node has more than max_degree neighbors. An edge is kept only when it is
+# among the max_degree lightest edges of both endpoints (weights are per directed entry of the
+# CSR arrays and must be symmetric), so the result stays undirected.
+def cap_degree(indptr, indices, weights, max_degree):
+    n = len(indptr) - 1
+    m = len(indices)
+    owner = np.repeat(np.arange(n, dtype=np.int64), np.diff(indptr))
+    # Sort by owner then weight, with weights replaced by their global rank to sort a single int key
+    weight_rank = np.empty(m, dtype=np.int64)
+    weight_rank[np.argsort(weights, kind='stable')] = np.arange(m)
+    order = np.argsort(owner * m + weight_rank)
+    rank = np.empty(m, dtype=np.int64)
+    rank[order] = np.arange(m) - indptr[owner[order]]
+
+    # rev[k]: position of the same edge seen from the other endpoint. Entries are sorted by
+    # owner * n + neighbor, so it is the sorted position of neighbor * n + owner.
+    rev = np.empty(m, dtype=np.int64)
+    rev[np.argsort(indices * n + owner)] = np.arange(m)
+    keep = (rank < max_degree) & (rank[rev] < max_degree) & (owner < indices)
+    return csr_from_arrays(n, owner[keep], indices[keep])
+
+
+# Concatenation of arange(starts[i], starts[i] + counts[i]) for all i
+def ragged_arange(starts, counts):
+    total = int(counts.sum())
+    if total == 0:
+        return np.zeros(0, dtype=np.int64)
+    offsets = np.repeat(np.cumsum(counts) - counts, counts)
+    return np.repeat(starts, counts) + np.arange(total) - offsets
+
+
+# Random geometric graph in the unit square: nodes closer than radius are connected.
+# Points are bucketed into a grid of radius sized cells so only neighboring cells are compared,
+# which takes O(n + m) instead of comparing all pairs. Without radius, it is chosen so the
+# expected degree is avg_degree. max_degree keeps only the nearest neighbors.
+def geometric(n, radius=None, avg_degree=6, max_degree=None, seed=None):
+    rng = np.random.RandomState(seed)
+    pos = rng.random_sample((n, 2))
+    if radius is None:
+        radius = math.sqrt(avg_degree / (math.pi * max(n, 1)))
+    k = max(1, int(1 / radius))
+    cell_xy = np.minimum((pos * k).astype(np.int64), k - 1)
+    cell = cell_xy[:, 0] * k + cell_xy[:, 1]
+
+    order = np.argsort(cell, kind='stable')
+    cell_start = np.searchsorted(cell[order], np.arange(k * k + 1))
+
+    src, dst = [], []
+    # Half of the 8-neighborhood plus the cell itself, every pair of cells is visited once
+    for dx, dy in ((0, 0), (1, -1), (1, 0), (1, 1), (0, 1)):
+        tx, ty = cell_xy[:, 0] + dx, cell_xy[:, 1] + dy
+        valid = (tx >= 0) & (tx < k) & (ty >= 0) & (ty < k)
+        points = np.nonzero(valid)[0]
+        target = tx[valid] * k + ty[valid]
+        counts = cell_start[target + 1] - cell_start[target]
+        i = np.repeat(points, counts)
+        j = order[ragged_arange(cell_start[target], counts)]
+        d = pos[i] - pos[j]
+        close = (d * d).sum(axis=1) < radius * radius
+        if dx == 0 and dy == 0:
+            close &= i < j
+        src.append(i[close])
+        dst.append(j[close])
+
+    indptr, indices = csr_from_arrays(n, np.concatenate(src), np.concatenate(dst))
+    if max_degree is not None:
+        owner = np.repeat(np.arange(n), np.diff(indptr))
+        d = pos[owner] - pos[indices]
+        indptr, indices = cap_degree(indptr, indices, (d * d).sum(axis=1), max_degree)
+    return CSRGraph(indptr, indices, pos)
+
+
+# Configuration model with d stubs per node. Self loops and parallel edges are dropped instead
+# of resampled, so the graph is nearly d-regular and every degree is at most d.
+def bounded_degree(n, d, seed=None):
+    rng = np.random.RandomState(seed)
+    stubs = np.repeat(np.arange(n, dtype=np.int64), d)
+    if len(stubs) % 2:
+        stubs = stubs[:-1]
+    rng.shuffle(stubs)
+    return CSRGraph.from_edges(n, stubs[0::2], stubs[1::2])
+
+
+def ring(n):
+    v = np.arange(n, dtype=np.int64)
+    return CSRGraph.from_edges(n, v, (v + 1) % n)
+
+
+# rows x cols lattice, node r * cols + c is at row r and column c
+def grid(rows, cols):
+    v = np.arange(rows * cols, dtype=np.int64).reshape(rows, cols)
+    src = np.concatenate([v[:, :-1].ravel(), v[:-1, :].ravel()])
+    dst = np.concatenate([v[:, 1:].ravel(), v[1:, :].ravel()])
+    pos = np.column_stack([(v % cols).ravel() / max(cols - 1, 1), (v // cols).ravel() / max(rows - 1, 1)])
+    return CSRGraph.from_edges(rows * cols, src, dst, pos)
+
+
+# Chung-Lu graph with expected degrees following a power law of the given exponent.
+# max_degree caps the hubs by dropping their edges to the other highest degree nodes first.
+def power_law(n, exponent=2.5, avg_degree=4, max_degree=None, seed=None):
+    rng = np.random.RandomState(seed)
+    w = np.arange(1, n + 1, dtype=np.float64) ** (-1 / (exponent - 1))
+    p = w / w.sum()
+    m = int(n * avg_degree / 2)
+    src, dst = rng.choice(n, m, p=p), rng.choice(n, m, p=p)
+    indptr, indices = csr_from_arrays(n, src, dst)
+    if max_degree is not None:
+        owner = np.repeat(np.arange(n), np.diff(indptr))
+        degrees = np.diff(indptr)
+        indptr, indices = cap_degree(indptr, indices, degrees[owner] + degrees[indices], max_degree)
+    return CSRGraph(indptr, indices)
+
+
+# Streams undirected edges of a bounded degree graph in chunks without ever holding the whole
+# graph, for graphs too large to build. Same model as bounded_degree but stubs are only paired
+# within blocks of block_size nodes, and duplicates are only removed within a block.
+def stream_bounded_degree(n, d, block_size=1 << 20, seed=None):
+    rng = np.random.RandomState(seed)
+    for lo in range(0, n, block_size):
+        hi = min(lo + block_size, n)
+        stubs = np.repeat(np.arange(lo, hi, dtype=np.int64), d)
+        if len(stubs) % 2:
+            stubs = stubs[:-1]
+        rng.shuffle(stubs)
+        src, dst = stubs[0::2], stubs[1::2]
+        keep = src != dst
+        key = np.minimum(src[keep], dst[keep]) * n + np.maximum(src[keep], dst[keep])
+        key.sort()
+        key = key[np.concatenate([[True], key[1:] != key[:-1]])]
+        yield key // n, key % n
@@ -0,0 +1,218 @@
+import json
+import os
+import numpy as np
+from graphgen import CSRGraph
+
+FORMAT_VERSION = 1
+# Bytes of text parsed at once, and edges handled at once by the conversion passes
+CHUNK_BYTES = 1 << 26
+CHUNK_EDGES = 1 << 23
+COMMENTS = (b'#', b'%')
+
+
+# Sorted distinct values of a, with a plain sort (np.unique may hash instead, much slower here)
+def sorted_unique(a):
+    a = np.sort(a, axis=None)
+    return a[np.concatenate([[True], a[1:] != a[:-1]])] if len(a) else a
+
+
+# Edges of a block of whitespace separated text, comment lines dropped. Extra columns may hold
+# floats (weights), the block is then parsed as floats, exact for ids below 2**53.
+def parse_block(block, columns):
+    if any([c in block for c in COMMENTS]):
+        block = b'\n'.join([line for line in block.split(b'\n') if line.lstrip()[:1] not in COMMENTS])
+    values = np.fromstring(block, dtype=np.int64 if columns == 2 else np.float64, sep=' ')
+    if len(values) % columns:
+        raise ValueError('Malformed edge list: %d values in a block of %d columns' % (len(values), columns))
+    return values.reshape(-1, columns)[:, :2].astype(np.int64)
+
+
+# Edges of a text edge list ("u v" per line, extra columns such as weights are ignored) as (k, 2)
+# int64 arrays, reading chunk_bytes (default CHUNK_BYTES) of the file at a time
+def text_chunks(path, columns=2, chunk_bytes=None):
+    chunk_bytes = chunk_bytes or CHUNK_BYTES
+    with open(path, 'rb') as f:
+        rest = b''
+        while True:
+            block = f.read(chunk_bytes)
+            if not block:
+                break
+            block = rest + block
+            cut = block.rfind(b'\n') + 1
+            block, rest = block[:cut], block[cut:]
+            if block:
+                yield parse_block(block, columns)
+        if rest.strip():
+            yield parse_block(rest, columns)
+
+
+# Edges of a binary edge list, an (m, 2) integer .npy array, memory mapped
+def npy_chunks(path, chunk_edges=None):
+    chunk_edges = chunk_edges or CHUNK_EDGES
+    edges = np.load(path, mmap_mode='r')
+    if edges.ndim != 2 or edges.shape[1] != 2:
+        raise ValueError('%s is not an (m, 2) edge array' % (path,))
+    for lo in range(0, len(edges), chunk_edges):
+        yield np.asarray(edges[lo:lo + chunk_edges], dtype=np.int64)
+
+
+def edge_chunks(path, columns=2):
+    return npy_chunks(path) if path.endswith('.npy') else text_chunks(path, columns)
+
+
+def cache_path(path):
+    return path + '.csr'
+
+
+def read_meta(out):
+    with open(os.path.join(out, 'meta.json')) as f:
+        return json.load(f)
+
+
+# Whether the CSR directory out was converted from the current version of path with these options
+def is_current(out, path, columns=2, relabel=False):
+    try:
+        meta = read_meta(out)
+    except (OSError, ValueError):
+        return False
+    st = os.stat(path)
+    return meta.get('version') == FORMAT_VERSION and meta.get('source_size') == st.st_size and \
+        meta.get('source_mtime') == st.st_mtime_ns and meta.get('columns') == columns and \
+        meta.get('relabel') == relabel
+
+
+# Converts an edge list (text, or an (m, 2) .npy array) once into the CSR format read by open_csr:
+# a directory out (default path + '.csr') with indptr.npy (int64), indices.npy (int32 below 2**31
+# nodes, neighbor lists sorted, without self loops or duplicates), and meta.json, the index
+# holding n, m, delta and the size and mtime of the source it was converted from.
+# Nodes are the integers 0..max id, with relabel the ids found in the file, mapped in increasing
+# order to 0..n-1 (labels.npy holds the original ids).
+# All passes work on chunks of edges and memory mapped temporary files, so the memory used is
+# about the size of indptr plus one chunk, whatever the number of edges.
+def convert(path, out=None, columns=2, relabel=False):
+    out = out or cache_path(path)
+    os.makedirs(out, exist_ok=True)
+    raw_path, adj_path = os.path.join(out, 'edges.tmp'), os.path.join(out, 'adj.tmp')
+
+    # Pass 1: the edge list as binary pairs, without self loops
+    m_raw, max_id, labels = 0, -1, np.zeros(0, dtype=np.int64)
+    with open(raw_path, 'wb') as f:
+        for e in edge_chunks(path, columns):
+            if len(e) == 0:
+                continue
+            if e.min() < 0:
+                raise ValueError('Negative node id in %s' % (path,))
+            max_id = max(max_id, int(e.max()))
+            if relabel:
+                labels = sorted_unique(np.concatenate([labels, sorted_unique(e)]))
+            e = e[e[:, 0] != e[:, 1]]
+            e.tofile(f)
+            m_raw += len(e)
+    n = len(labels) if relabel else max_id + 1
+    dtype = np.int32 if n < 2 ** 31 else np.int64
+    if relabel and m_raw:
+        edges = np.memmap(raw_path, dtype=np.int64, mode='r+', shape=(m_raw, 2))
+        for lo in range(0, m_raw, CHUNK_EDGES):
+            edges[lo:lo + CHUNK_EDGES] = np.searchsorted(labels, edges[lo:lo + CHUNK_EDGES])
+        edges.flush()
+        del edges
+
+    def raw_chunks():
+        if m_raw == 0:
+            return
+        edges = np.memmap(raw_path, dtype=np.int64, mode='r', shape=(m_raw, 2))
+        for lo in range(0, m_raw, CHUNK_EDGES):
+            yield np.array(edges[lo:lo + CHUNK_EDGES])
+
+    # Pass 2: degrees, counting duplicates
+    deg = np.zeros(n, dtype=np.int64)
+    for e in raw_chunks():
+        deg += np.bincount(e.ravel(), minlength=n)
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(deg, out=indptr[1:])
+    total = int(indptr[-1])
+
+    # Pass 3: both directions of every edge scattered into the rows of adj
+    adj = np.memmap(adj_path, dtype=dtype, mode='w+', shape=(max(total, 1),))
+    cursor = indptr[:-1].copy()
+    for e in raw_chunks():
+        src = np.concatenate([e[:, 0], e[:, 1]])
+        dst = np.concatenate([e[:, 1], e[:, 0]])
+        order = np.argsort(src, kind='stable')
+        src, dst = src[order], dst[order]
+        first = np.flatnonzero(np.concatenate([[True], src[1:] != src[:-1]]))
+        counts = np.diff(np.append(first, len(src)))
+        adj[cursor[src] + np.arange(len(src)) - np.repeat(first, counts)] = dst
+        cursor[src[first]] += counts
+
+    # Pass 4: rows sorted and deduplicated block by block, compacted in place (a block is read
+    # before it is written back, never further than where it was)
+    new_deg = np.zeros(n, dtype=np.int64)
+    row = written = 0
+    while row < n:
+        end = int(np.searchsorted(indptr, indptr[row] + 2 * CHUNK_EDGES, side='right')) - 1
+        end = min(max(end, row + 1), n)
+        block = np.array(adj[indptr[row]:indptr[end]], dtype=np.int64)
+        owner = np.repeat(np.arange(end - row, dtype=np.int64), deg[row:end])
+        key = sorted_unique(owner * n + block)
+        new_deg[row:end] = np.bincount(key // n, minlength=end - row)
+        adj[written:written + len(key)] = key % n
+        written += len(key)
+        row = end
+
+    np.cumsum(new_deg, out=indptr[1:])
+    np.save(os.path.join(out, 'indptr.npy'), indptr)
+    indices = np.lib.format.open_memmap(os.path.join(out, 'indices.npy'), mode='w+', dtype=dtype, shape=(written,))
+    for lo in range(0, written, 2 * CHUNK_EDGES):
+        indices[lo:lo + 2 * CHUNK_EDGES] = adj[lo:min(lo + 2 * CHUNK_EDGES, written)]
+    indices.flush()
+    del adj, indices
+    os.remove(raw_path)
+    os.remove(adj_path)
+    if relabel:
+        np.save(os.path.join(out, 'labels.npy'), labels)
+
+    st = os.stat(path)
+    meta = {'version': FORMAT_VERSION, 'source': os.path.abspath(path), 'source_size': st.st_size,
+            'source_mtime': st.st_mtime_ns, 'columns': columns, 'relabel': relabel, 'n': n, 'm': written // 2,
+            'delta': int(new_deg.max()) if n else 0}
+    # Written last, an interrupted conversion is never taken as current
+    with open(os.path.join(out, 'meta.json.tmp'), 'w') as f:
+        json.dump(meta, f)
+    os.replace(os.path.join(out, 'meta.json.tmp'), os.path.join(out, 'meta.json'))
+    return out
+
+
+# CSRGraph over the memory mapped arrays of a CSR directory, nothing is read until used
+def open_csr(out):
+    indptr = np.load(os.path.join(out, 'indptr.npy'), mmap_mode='r')
+    indices = np.load(os.path.join(out, 'indices.npy'), mmap_mode='r')
+    return CSRGraph(indptr, indices)
+
+
+# Graph of an edge list (text or .npy) or of a CSR directory, converted on first use and taken
+# from the cache (path + '.csr', or out) afterwards, as long as the source is unchanged.
+# Pass graph.indptr, graph.indices as csr to MessagePassingSystem, or the graph to
+# AGColoring_mps.run_coloring.
+def load(path, out=None, columns=2, relabel=False):
+    if os.path.isdir(path) and os.path.exists(os.path.join(path, 'meta.json')):
+        return open_csr(path)
+    out = out or cache_path(path)
+    if not is_current(out, path, columns, relabel):
+        convert(path, out, columns, relabel)
+    return open_csr(out)
+
+
+# Original node ids of a CSR directory converted with relabel
+def labels(out):
+    return np.load(os.path.join(out, 'labels.npy'), mmap_mode='r')
+
+
+if __name__ == '__main__':
+    import sys
+    import time
+
+    for path in sys.argv[1:]:
+        start = time.perf_counter()
+        graph = load(path)
+        print('%s: n=%d m=%d delta=%d (%.2fs)' % (path, graph.n, graph.m, graph.delta, time.perf_counter() - start))
@@ -0,0 +1,131 @@
+import threading
+from array import array
+import numpy as np
+
+# Records are (node, round, a, b) rows of int32
+RECORD_WIDTH = 4
+
+
+# Color history storing only changes: a record (node, round, a, b) is kept when the color of a
+# node at round index round differs from its previous one (round 0 being the initial color, as
+# index 0 of Processor.color_history). Records are appended to one flat typed array, and with
+# path they are streamed to that file (raw int32 records) every chunk_records records, so the
+# memory used is bounded for large runs. Lookups need the index, built once by index() after the
+# run, which sorts the records by node then round; a node's color at round r is then a binary
+# search among its changes. n_rounds is the length of the full history, 1 + q + (q - delta) for
+# AG coloring; it defaults to one past the last change.
+# Processors of the threaded engine may record concurrently: recording and flushing hold the lock,
+# so no record is appended to a buffer being written out. Not usable with the sharded engine.
+class ColorHistory:
+    def __init__(self, n, n_rounds=0, path=None, chunk_records=1 << 20):
+        self.n = n
+        self.n_rounds = n_rounds
+        self.path = path
+        self.chunk_records = chunk_records
+        self.buf = array('i')
+        self.lock = threading.Lock()
+        self.file = open(path, 'wb') if path is not None else None
+        self.flushed = []
+        # Set by index()
+        self.node_ptr = None
+        self.rounds = None
+        self.a = None
+        self.b = None
+
+    def record(self, node, r, color):
+        with self.lock:
+            self.buf.extend((node, r, color[0], color[1]))
+            full = len(self.buf) >= self.chunk_records * RECORD_WIDTH
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            if not self.buf:
+                return
+            buf, self.buf = self.buf, array('i')
+            if self.file is not None:
+                buf.tofile(self.file)
+            else:
+                self.flushed.append(np.frombuffer(buf, dtype=np.int32))
+
+    def close(self):
+        self.flush()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def records(self):
+        self.flush()
+        if self.path is not None:
+            if self.file is not None:
+                self.file.flush()
+            data = np.fromfile(self.path, dtype=np.int32)
+        else:
+            data = np.concatenate(self.flushed) if self.flushed else np.zeros(0, dtype=np.int32)
+        return data.reshape(-1, RECORD_WIDTH)
+
+    # Records of a streamed history, e.g. of an earlier run
+    @classmethod
+    def load(cls, path, n, n_rounds=0):
+        history = cls(n, n_rounds)
+        history.flushed = [np.fromfile(path, dtype=np.int32)]
+        return history.index()
+
+    def index(self):
+        rec = self.records()
+        node, r = rec[:, 0].astype(np.int64), rec[:, 1].astype(np.int64)
+        self.n_rounds = max(self.n_rounds, int(r.max()) + 1 if len(r) else 0)
+        order = np.argsort(node * (self.n_rounds + 1) + r, kind='stable')
+        self.node_ptr = np.zeros(self.n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(node, minlength=self.n), out=self.node_ptr[1:])
+        self.rounds = rec[order, 1]
+        self.a = rec[order, 2]
+        self.b = rec[order, 3]
+        return self
+
+    @property
+    def n_changes(self):
+        return len(self.rounds)
+
+    # Color of node at round r, O(log k) for k changes of the node
+    def color_at(self, node, r):
+        lo, hi = self.node_ptr[node], self.node_ptr[node + 1]
+        i = lo + np.searchsorted(self.rounds[lo:hi], r, side='right') - 1
+        if i < lo:
+            return None
+        return int(self.a[i]), int(self.b[i])
+
+    # Rounds and colors of the changes of node
+    def changes(self, node):
+        lo, hi = self.node_ptr[node], self.node_ptr[node + 1]
+        return list(zip(self.rounds[lo:hi].tolist(), zip(self.a[lo:hi].tolist(), self.b[lo:hi].tolist())))
+
+    # (a, b) arrays of the colors of all nodes at round r
+    def snapshot(self, r):
+        key = np.arange(self.n, dtype=np.int64) * (self.n_rounds + 1)
+        sorted_key = np.repeat(key, np.diff(self.node_ptr)) + self.rounds
+        i = np.searchsorted(sorted_key, key + min(r, self.n_rounds), side='right') - 1
+        return self.a[i], self.b[i]
+
+    # (n, n_rounds, 2) array, the layout of color_history (see results.ResultStore)
+    def dense(self, n_rounds=None):
+        n_rounds = n_rounds or self.n_rounds
+        out = np.empty((self.n, n_rounds, 2), dtype=np.int32)
+        for r in range(n_rounds):
+            out[:, r, 0], out[:, r, 1] = self.snapshot(r)
+        return out
+
+    # First round at which every node has a == 0 (-1 if never), like lib.count_rounds per node
+    def count_rounds(self):
+        rounds = np.full(self.n, -1, dtype=np.int64)
+        zero = np.nonzero(self.a == 0)[0]
+        node = np.repeat(np.arange(self.n), np.diff(self.node_ptr))[zero]
+        # Records are sorted by round within a node, the first one of each node wins
+        first = np.unique(node, return_index=True)
+        rounds[first[0]] = self.rounds[zero[first[1]]]
+        return rounds
+
+    def memory(self):
+        return sum([x.nbytes for x in (self.node_ptr, self.rounds, self.a, self.b) if x is not None])
+
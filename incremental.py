@@ -0,0 +1,84 @@
+import lib
+import AGColoring_ss
+from MessagePassingSystem import MessagePassingSystem
+
+
+# Nodes whose color is no longer valid after the updates: nodes without a color or with a color
+# outside 0..delta, and one end (the larger) of every added edge joining two equal colors.
+def conflicting_nodes(G, colors, delta, added_edges=(), added_nodes=()):
+    affected = set()
+    candidates = set(added_nodes)
+    for u, v in added_edges:
+        candidates.update((u, v))
+        if u != v and colors.get(u) is not None and colors.get(u) == colors.get(v):
+            affected.add(max(u, v))
+    for v in candidates:
+        c = colors.get(v)
+        if c is None or not 0 <= c <= delta:
+            affected.add(v)
+    return affected
+
+
+# Applies a batch of updates to G and repairs colors (node -> final color, as in
+# global_shared_memory[pid]['color'][1]) so it is again a proper coloring with 0..delta.
+# Only the conflicting nodes are recolored: the self-stabilizing AG coloring runs on them and
+# their neighbors, the neighbors being fixed processors that only send their current color, so
+# the work is proportional to the size of the change.
+# Self loops are ignored and removals are applied after additions.
+# delta defaults to the maximum degree of the updated graph; when it is lower than the colors in
+# use, all nodes above it are recolored too. G and colors are updated in place, the recolored
+# nodes are returned.
+def recolor(G, colors, added_edges=(), removed_edges=(), added_nodes=(), removed_nodes=(), delta=None):
+    added_edges = [(u, v) for u, v in added_edges if u != v]
+    G.add_nodes_from(added_nodes)
+    G.add_edges_from(added_edges)
+    G.remove_edges_from(removed_edges)
+    for v in removed_nodes:
+        if v in G:
+            G.remove_node(v)
+        colors.pop(v, None)
+    if delta is None:
+        delta = lib.calc_delta(G)
+
+    affected = set([v for v in conflicting_nodes(G, colors, delta, added_edges, list(added_nodes)) if v in G])
+    if any([c > delta for c in colors.values()]):
+        affected.update([v for v, c in colors.items() if c > delta])
+    if not affected:
+        return affected
+    boundary = set([u for v in affected for u in G.neighbors(v)]) - affected
+
+    # Boundary nodes get the smaller pids, so an affected node finalized with the color of one
+    # of them starts over instead of waiting for it
+    nodes = sorted(boundary, key=str) + sorted(affected, key=str)
+    pid = {v: i for i, v in enumerate(nodes)}
+    edges = [(pid[v], pid[u]) for v in affected for u in G.neighbors(v) if u not in affected or pid[u] < pid[v]]
+    q = AGColoring_ss.choose_q(len(nodes), delta)
+    proc_args = {pid[v]: dict(delta=delta, q=q) for v in affected}
+    proc_args.update({pid[v]: dict(delta=delta, q=q, color=(0, colors[v]), fixed=True) for v in boundary})
+    mps = MessagePassingSystem(proc_class=AGColoring_ss.Processor,
+                               proc_args=proc_args,
+                               n_proc=len(nodes),
+                               edges=edges,
+                               is_async=False,
+                               verbose=False,
+                               engine='inline')
+    mps.start()
+    mps.wait_for_all()
+    for v in affected:
+        colors[v] = mps.global_shared_memory[pid[v]]['color'][1]
+    return affected
+
+
+if __name__ == '__main__':
+    import random
+    from AGColoring_mps import run_coloring
+
+    n = 2000
+    G = lib.gen_random_graph(n)
+    colors = {pid: x['color'][1] for pid, x in run_coloring(G, record_history=False).global_shared_memory.items()}
+    added = [(random.randrange(n), random.randrange(n)) for _ in range(20)]
+    removed = random.sample(list(G.edges()), 20)
+    recolored = recolor(G, colors, added_edges=added, removed_edges=removed, added_nodes=[n])
+    delta = lib.calc_delta(G)
+    print('recolored %d nodes, proper: %s, colors <= delta: %s' %
+          (len(recolored), all(colors[u] != colors[v] for u, v in G.edges()), max(colors.values()) <= delta))
@@ -1,5 +1,6 @@
 import math
 import networkx as nx
+import numpy as np
 import random
 
 
@@ -35,10 +36,35 @@ def trivial_coloring(G):
     return {i: i for i in range(len(G.nodes()))}
 
 
+# Maximum degree of a networkx graph, or of a graphgen.CSRGraph from its indptr array
 def calc_delta(G):
+    if hasattr(G, 'indptr'):
+        return G.delta
     return max([d for _, d in G.degree])
 
 
+# Compressed sparse row adjacency of an undirected graph with nodes 0..n-1.
+# Neighbors of v are indices[indptr[v]:indptr[v + 1]], sorted, without self loops or duplicates.
+def to_csr(n, edges):
+    if isinstance(edges, np.ndarray):
+        e = edges.astype(np.int64).reshape(-1, 2)
+    else:
+        e = np.array(list(edges), dtype=np.int64).reshape(-1, 2)
+    e = e[e[:, 0] != e[:, 1]]
+    src = np.concatenate([e[:, 0], e[:, 1]])
+    dst = np.concatenate([e[:, 1], e[:, 0]])
+    order = np.lexsort((dst, src))
+    src, dst = src[order], dst[order]
+
+    keep = np.ones(len(src), dtype=bool)
+    keep[1:] = (src[1:] != src[:-1]) | (dst[1:] != dst[:-1])
+    src, dst = src[keep], dst[keep]
+
+    indptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src, minlength=n), out=indptr[1:])
+    return indptr, dst
+
+
 def dist2(G, edge):
     pos1 = G.nodes[edge[0]]['pos']
     pos2 = G.nodes[edge[1]]['pos']
@@ -49,11 +75,19 @@ def dist(p1, p2):
     return (wp1[0] - wp2[0]) * (wp1[0] - wp2[0]) + (wp1[1] - wp2[1]) * (wp1[1] - wp2[1])
 
 
+# Nodes at random positions in the unit square, like nx.random_geometric_graph draws them,
+# without its pairwise distance checks.
+def gen_positioned_nodes(n):
+    G = nx.empty_graph(n)
+    nx.set_node_attributes(G, {v: [random.random(), random.random()] for v in G}, 'pos')
+    return G
+
+
+# Random positions plus n to 2n random edges. This used to build a geometric graph with a
+# vanishing radius and its spanning tree, which had no edges but cost O(n^2).
+# See graphgen for generators producing CSR arrays directly.
 def gen_random_graph(n=100):
-    g = nx.random_geometric_graph(n, .00000001)
-    attrs = {edge: {'weight': dist2(g, edge)} for edge in g.edges()}
-    G = nx.minimum_spanning_tree(g)
-    nx.set_edge_attributes(G, attrs)
+    G = gen_positioned_nodes(n)
     for _ in range(random.randint(n, n * 2)):
         v1 = random.randrange(0, n)
         v2 = random.randrange(0, n)
@@ -64,7 +98,7 @@ def gen_random_graph(n=100):
 
 
 def gen_ring(n=100):
-    G = nx.random_geometric_graph(n, 0)
+    G = gen_positioned_nodes(n)
     for i in range(n):
         G.add_edge(i, (i + 1) % n, weight=1)
     return G
@@ -0,0 +1,86 @@
+import json
+import numpy as np
+
+
+# Columnar results of an AG coloring run: one array per field instead of the dict per pid of
+# MessagePassingSystem.global_shared_memory. Colors are the (a, b) pairs, b being the final color,
+# finalized_round is the round the AG stage finalized (-1 when unknown) and history the
+# (n, rounds, 2) array of color_history, or None. meta holds json serializable run parameters.
+class ResultStore:
+    def __init__(self, a, b, finalized_round=None, history=None, meta=None):
+        self.a = np.asarray(a, dtype=np.int64)
+        self.b = np.asarray(b, dtype=np.int64)
+        n = len(self.b)
+        self.finalized_round = np.full(n, -1, dtype=np.int64) if finalized_round is None \
+            else np.asarray(finalized_round, dtype=np.int64)
+        self.history = None if history is None else np.asarray(history, dtype=np.int32)
+        self.meta = dict(meta or {})
+
+    @property
+    def n(self):
+        return len(self.b)
+
+    @property
+    def colors(self):
+        return self.b
+
+    # From global_shared_memory of a finished system, histories must all have the same length
+    @classmethod
+    def from_shared_memory(cls, global_shared_memory, meta=None):
+        n = len(global_shared_memory)
+        a = np.empty(n, dtype=np.int64)
+        b = np.empty(n, dtype=np.int64)
+        finalized_round = np.full(n, -1, dtype=np.int64)
+        histories = []
+        for pid in range(n):
+            result = global_shared_memory[pid]
+            a[pid], b[pid] = result['color']
+            finalized_round[pid] = result.get('finalized_round', -1)
+            histories.append(result.get('color_history'))
+        history = None
+        if histories and all([h is not None for h in histories]):
+            history = np.array(histories, dtype=np.int32)
+        return cls(a, b, finalized_round, history, meta)
+
+    # The history is expanded from mps.color_history when the run kept a history.ColorHistory
+    @classmethod
+    def from_mps(cls, mps, meta=None):
+        result = cls.from_shared_memory(mps.global_shared_memory, meta)
+        if result.history is None and getattr(mps, 'color_history', None) is not None:
+            result.history = mps.color_history.dense()
+        return result
+
+    # From AGColoring_batch.ag_coloring, history being its list of (a, b) arrays per round
+    @classmethod
+    def from_batch(cls, a, b, history=None, meta=None):
+        if history is not None:
+            history = np.stack([np.stack(h, axis=1) for h in history], axis=1)
+        return cls(a, b, history=history, meta=meta)
+
+    # Same layout as global_shared_memory, for existing callers
+    def to_shared_memory(self):
+        colors = list(zip(self.a.tolist(), self.b.tolist()))
+        results = {pid: {'color': color} for pid, color in enumerate(colors)}
+        for pid in np.nonzero(self.finalized_round >= 0)[0].tolist():
+            results[pid]['finalized_round'] = int(self.finalized_round[pid])
+        if self.history is not None:
+            for pid, h in enumerate(self.history.tolist()):
+                results[pid]['color_history'] = [tuple(c) for c in h]
+        return results
+
+    # pid -> final color, as passed to vis.plot
+    def color_mapping(self):
+        return dict(enumerate(self.b.tolist()))
+
+    def save(self, path):
+        arrays = {'a': self.a, 'b': self.b, 'finalized_round': self.finalized_round,
+                  'meta': np.array(json.dumps(self.meta))}
+        if self.history is not None:
+            arrays['history'] = self.history
+        np.savez_compressed(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            history = data['history'] if 'history' in data.files else None
+            return cls(data['a'], data['b'], data['finalized_round'], history, json.loads(str(data['meta'])))
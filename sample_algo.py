@@ -1,4 +1,5 @@
 from MessagePassingSystem import *
+import math
 
 
 class Processor(AbstractProcessor):
@@ -10,6 +11,7 @@ class Processor(AbstractProcessor):
                 j, k, d = msg[2], msg[3], msg[4]
                 if j == self.pid:
                     # TERMINATE
+                    self.save_result('leader', True)
                     self.send_to_all_except((MsgType.TERMINATION,), src)
                     self.terminate()
                 elif j > self.pid and d < math.pow(2, k):
@@ -24,6 +26,8 @@ class Processor(AbstractProcessor):
                 else:
                     self.received_replies.add(src)
                     if len(self.received_replies) == 2:
+                        # Both directions replied, start the next phase
+                        self.received_replies = set()
                         for nb in self.neighbors:
                             self.send((MsgType.PAYLOAD, 'Probe', self.pid, k + 1, 1), nb)
 
@@ -41,5 +45,9 @@ if __name__ == '__main__':
     n = 7
     edges = [(0, 1), (1, 2), (2, 3), (3, 4), (4, 5), (5, 6), (6, 0)]
 
-    mps = MessagePassingSystem(proc_class=Processor, n_proc=n, edges=edges, is_async=False, max_channel_delay=0)
+    mps = MessagePassingSystem(proc_class=Processor, proc_args={pid: {} for pid in range(n)}, n_proc=n, edges=edges,
+                               is_async=True, engine='des', seed=0)
     mps.start()
+    mps.wait_for_all()
+    leaders = [pid for pid, result in mps.global_shared_memory.items() if result.get('leader')]
+    print('Leader: %s, elected after %.3f time units' % (leaders, mps.virtual_time))
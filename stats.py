@@ -0,0 +1,188 @@
+import csv
+import pickle
+import time
+from collections import Counter
+from enum import Enum
+
+
+# Size of a message payload in bits: integers take their bit length (plus a sign bit if negative),
+# enums the bits needed to tell their members apart, tuples the sum of their fields.
+def payload_bits(item):
+    if item is None:
+        return 0
+    if isinstance(item, bool):
+        return 1
+    if isinstance(item, Enum):
+        return max((len(type(item)) - 1).bit_length(), 1)
+    if isinstance(item, int):
+        return max(item.bit_length(), 1) + (1 if item < 0 else 0)
+    if isinstance(item, float):
+        return 64
+    if isinstance(item, str):
+        return 8 * len(item.encode('utf-8'))
+    if isinstance(item, (bytes, bytearray)):
+        return 8 * len(item)
+    if isinstance(item, (tuple, list)):
+        return sum([payload_bits(x) for x in item])
+    return 8 * len(pickle.dumps(item))
+
+
+# Whether the size of item can be remembered by value: floats compare equal to ints of a
+# different size, and unhashable items cannot be dict keys.
+def cacheable(item):
+    if isinstance(item, float):
+        return False
+    if isinstance(item, (tuple, frozenset)):
+        return all([cacheable(x) for x in item])
+    return isinstance(item, (int, str, bytes, Enum)) or item is None
+
+
+BITS_CACHE_SIZE = 1 << 16
+
+
+class RoundStats:
+    FIELDS = ('round', 'wall_time', 'worker_time', 'delivery_time', 'messages', 'bits', 'bytes',
+              'active', 'inactive', 'terminated', 'suppressed', 'suppressed_bits')
+
+    def __init__(self, r):
+        self.round = r
+        self.wall_time = 0.0
+        self.worker_time = 0.0
+        self.delivery_time = 0.0
+        self.messages = 0
+        self.bits = 0
+        self.bytes = 0
+        self.active = 0
+        self.inactive = 0
+        self.terminated = 0
+        # Messages not transmitted because of suppress_unchanged
+        self.suppressed = 0
+        self.suppressed_bits = 0
+
+    def as_row(self):
+        return [getattr(self, f) for f in self.FIELDS]
+
+
+# Metrics collected by the message passing system, available as mps.stats after wait_for_all().
+# One RoundStats per synchronous round, round 0 being init_config. Messages are counted in the
+# round they are sent. Asynchronous systems get a single row for the whole run.
+# With per_edge, messages, bits and suppressed messages are also counted per directed edge (src, dst).
+class SystemStats:
+    def __init__(self, per_edge=False):
+        self.per_edge = per_edge
+        self.rounds = []
+        self.edge_messages = Counter()
+        self.edge_bits = Counter()
+        self.edge_suppressed = Counter()
+        self.current = None
+        self.round_start = None
+        # Messages of an algorithm tend to repeat, their sizes are remembered
+        self.bits_cache = {}
+
+    def begin_round(self, r):
+        self.current = RoundStats(r)
+        self.round_start = time.perf_counter()
+
+    # Payload bits of item. Only cacheable items are looked up: floats hash like the ints they
+    # equal and would get their sizes.
+    def size_of(self, item):
+        if not cacheable(item):
+            return payload_bits(item)
+        bits = self.bits_cache.get(item)
+        if bits is None:
+            bits = payload_bits(item)
+            if len(self.bits_cache) < BITS_CACHE_SIZE:
+                self.bits_cache[item] = bits
+        return bits
+
+    # bits overrides the payload size, e.g. the width of a packed message
+    def record_message(self, src, dst, item, bits=None):
+        if bits is None:
+            bits = self.size_of(item)
+        cur = self.current
+        cur.messages += 1
+        cur.bits += bits
+        cur.bytes += (bits + 7) // 8
+        if self.per_edge:
+            self.edge_messages[(src, dst)] += 1
+            self.edge_bits[(src, dst)] += bits
+
+    # item was suppressed on the edges from src to every target of targets
+    def record_suppressed(self, src, targets, item, bits=None):
+        if bits is None:
+            bits = self.size_of(item)
+        count = len(targets)
+        self.current.suppressed += count
+        self.current.suppressed_bits += count * bits
+        if self.per_edge:
+            for dst in targets:
+                self.edge_suppressed[(src, dst)] += 1
+
+    # Add counters of messages recorded elsewhere, e.g. in a shard process
+    def add_messages(self, messages, bits, n_bytes):
+        self.current.messages += messages
+        self.current.bits += bits
+        self.current.bytes += n_bytes
+
+    def end_round(self, active, inactive, terminated, worker_time=None):
+        cur = self.current
+        cur.wall_time = time.perf_counter() - self.round_start
+        if worker_time is not None:
+            cur.worker_time = worker_time
+        cur.active, cur.inactive, cur.terminated = active, inactive, terminated
+        self.rounds.append(cur)
+        self.current = None
+
+    @property
+    def n_rounds(self):
+        return len(self.rounds)
+
+    @property
+    def messages(self):
+        return sum([r.messages for r in self.rounds])
+
+    @property
+    def bits(self):
+        return sum([r.bits for r in self.rounds])
+
+    @property
+    def suppressed(self):
+        return sum([r.suppressed for r in self.rounds])
+
+    @property
+    def suppressed_bits(self):
+        return sum([r.suppressed_bits for r in self.rounds])
+
+    @property
+    def wall_time(self):
+        return sum([r.wall_time for r in self.rounds])
+
+    @property
+    def worker_time(self):
+        return sum([r.worker_time for r in self.rounds])
+
+    @property
+    def delivery_time(self):
+        return sum([r.delivery_time for r in self.rounds])
+
+    def to_csv(self, path):
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(RoundStats.FIELDS)
+            for r in self.rounds:
+                writer.writerow(r.as_row())
+
+    def edges_to_csv(self, path):
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(('src', 'dst', 'messages', 'bits', 'suppressed'))
+            for src, dst in sorted(set(self.edge_messages) | set(self.edge_suppressed)):
+                edge = (src, dst)
+                writer.writerow((src, dst, self.edge_messages[edge], self.edge_bits[edge], self.edge_suppressed[edge]))
+
+    def summary(self):
+        text = 'rounds: %d, messages: %d, bits: %d, wall time: %.3fs (worker %.3fs, delivery %.3fs)' % \
+               (self.n_rounds, self.messages, self.bits, self.wall_time, self.worker_time, self.delivery_time)
+        if self.suppressed:
+            text += ', suppressed: %d messages, %d bits' % (self.suppressed, self.suppressed_bits)
+        return text
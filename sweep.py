@@ -0,0 +1,193 @@
+import argparse
+import csv
+import functools
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import time
+import numpy as np
+import lib
+import graphgen
+import AGColoring_batch
+from AGColoring_mps import run_coloring, choose_q
+from bench import make_graph, check_coloring, DEGREE_FAMILIES, FAMILIES
+
+# 'event' is the inline engine with AGColoring_mps.EventDrivenProcessor
+ENGINES = ('threaded', 'inline', 'event', 'batch')
+FIELDS = ('family', 'n', 'degree', 'seed', 'engine', 'delta', 'q', 'status', 'correct', 'rounds', 'colors',
+          'messages', 'wall_time', 'key')
+SUMMARY_FIELDS = ('family', 'n', 'degree', 'engine', 'runs', 'correct', 'delta', 'rounds', 'colors', 'max_colors',
+                  'messages', 'wall_time')
+
+
+# Configurations of a grid {'family': [...], 'n': [...], 'degree': [...], 'seed': [...], 'engine': [...]},
+# degrees are only crossed with the families taking one
+def expand_grid(grid):
+    cells = []
+    for family, n, seed, engine in itertools.product(grid['family'], grid['n'], grid['seed'], grid['engine']):
+        for degree in (grid.get('degree', [None]) if family in DEGREE_FAMILIES else [None]):
+            cells.append({'family': family, 'n': n, 'degree': degree, 'seed': seed, 'engine': engine})
+    return cells
+
+
+def cell_key(config):
+    return hashlib.sha1(json.dumps(config, sort_keys=True).encode()).hexdigest()[:16]
+
+
+# Prime of AG coloring for (n, delta), kept in cache_dir like the graphs so that reruns and all
+# worker processes reuse it
+@functools.lru_cache(maxsize=None)
+def cached_q(n, delta, cache_dir):
+    path = os.path.join(cache_dir, 'primes', cell_key({'n': n, 'delta': delta}) + '.json')
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)['q']
+    q = choose_q(n, delta)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + '.%d.tmp' % (os.getpid(),)
+    with open(tmp, 'w') as f:
+        json.dump({'n': n, 'delta': delta, 'q': q}, f)
+    os.replace(tmp, path)
+    return q
+
+
+# Graphs are generated once per (family, n, degree, seed) and kept in cache_dir as CSR arrays,
+# so all engines and reruns of a configuration color the same graph
+def load_graph(config, cache_dir):
+    key = cell_key({k: config[k] for k in ('family', 'n', 'degree', 'seed')})
+    path = os.path.join(cache_dir, 'graphs', key + '.npz')
+    if os.path.exists(path):
+        with np.load(path) as data:
+            return graphgen.CSRGraph(data['indptr'], data['indices']).to_networkx()
+    G = make_graph(config['family'], config['n'], config['degree'], config['seed'])
+    indptr, indices = lib.to_csr(G.number_of_nodes(), G.edges())
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + '.%d.tmp.npz' % (os.getpid(),)
+    np.savez(tmp, indptr=indptr, indices=indices)
+    os.replace(tmp, path)
+    # Same graph as when loaded from the cache, edges in CSR order
+    return graphgen.CSRGraph(indptr, indices).to_networkx()
+
+
+def run_cell(config, cache_dir):
+    try:
+        G = load_graph(config, cache_dir)
+        n, delta = G.number_of_nodes(), lib.calc_delta(G)
+        q = cached_q(n, delta, cache_dir)
+        start = time.perf_counter()
+        if config['engine'] == 'batch':
+            indptr, indices = lib.to_csr(n, G.edges())
+            _, b, _ = AGColoring_batch.ag_coloring(indptr, indices, list(range(n)), delta, q, record_history=False)
+            wall_time = time.perf_counter() - start
+            colors = dict(enumerate(b.tolist()))
+            rounds, messages = q + (q - delta), None
+        else:
+            engine = 'inline' if config['engine'] == 'event' else config['engine']
+            mps = run_coloring(G, q=q, engine=engine, record_history=False, collect_stats=True,
+                               event_driven=config['engine'] == 'event')
+            wall_time = time.perf_counter() - start
+            colors = {pid: x['color'][1] for pid, x in mps.global_shared_memory.items()}
+            rounds, messages = mps.round, mps.stats.messages
+        return dict(config, delta=delta, q=q, status='ok', correct=check_coloring(G, colors, delta), rounds=rounds,
+                    colors=len(set(colors.values())), messages=messages, wall_time=wall_time)
+    except Exception as e:
+        return dict(config, status='error: %s' % (e,))
+
+
+def pool_run_cell(args):
+    return run_cell(*args)
+
+
+# Runs every cell of the grid not already finished in cache_dir, in processes worker processes.
+# Finished cells are written to cache_dir/results as they complete, so an interrupted sweep
+# resumes where it stopped; failed cells are run again. Returns the results of all cells.
+def sweep(grid, cache_dir='sweep_cache', processes=None, force=False, verbose=True):
+    results_dir = os.path.join(cache_dir, 'results')
+    os.makedirs(results_dir, exist_ok=True)
+    results, pending = [], []
+    for config in expand_grid(grid):
+        path = os.path.join(results_dir, cell_key(config) + '.json')
+        if not force and os.path.exists(path):
+            with open(path) as f:
+                results.append(json.load(f))
+        else:
+            pending.append(config)
+    if verbose:
+        print('%d cells, %d cached, %d to run' % (len(results) + len(pending), len(results), len(pending)))
+
+    if not pending:
+        return results
+    with multiprocessing.Pool(processes) as pool:
+        for r in pool.imap_unordered(pool_run_cell, [(config, cache_dir) for config in pending]):
+            r['key'] = cell_key({k: r[k] for k in ('family', 'n', 'degree', 'seed', 'engine')})
+            if r['status'] == 'ok':
+                path = os.path.join(results_dir, r['key'] + '.json')
+                with open(path + '.tmp', 'w') as f:
+                    json.dump(r, f)
+                os.replace(path + '.tmp', path)
+            if verbose:
+                print('%-10s %8d %6s %4d %-9s %s' % (r['family'], r['n'], r['degree'], r['seed'], r['engine'],
+                                                    '%.3fs' % (r['wall_time'],) if r['status'] == 'ok' else r['status']))
+            results.append(r)
+    return results
+
+
+def mean(values):
+    values = [v for v in values if v is not None]
+    return sum(values) / len(values) if values else None
+
+
+# One row per (family, n, degree, engine) with means over the seeds
+def aggregate(results):
+    groups = {}
+    for r in results:
+        if r.get('status') == 'ok':
+            groups.setdefault((r['family'], r['n'], r['degree'], r['engine']), []).append(r)
+    rows = []
+    for (family, n, degree, engine), rs in sorted(groups.items(), key=lambda x: str(x[0])):
+        rows.append({'family': family, 'n': n, 'degree': degree, 'engine': engine, 'runs': len(rs),
+                     'correct': all([r['correct'] for r in rs]), 'delta': mean([r['delta'] for r in rs]),
+                     'rounds': mean([r['rounds'] for r in rs]), 'colors': mean([r['colors'] for r in rs]),
+                     'max_colors': max([r['colors'] for r in rs]), 'messages': mean([r['messages'] for r in rs]),
+                     'wall_time': mean([r['wall_time'] for r in rs])})
+    return rows
+
+
+def write_csv(path, rows, fields):
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fields, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Sweep AG coloring over a grid of configurations')
+    parser.add_argument('-n', type=int, nargs='+', default=[100, 1000])
+    parser.add_argument('--families', nargs='+', default=['random', 'ring', 'regular'], choices=FAMILIES)
+    parser.add_argument('--degrees', type=int, nargs='+', default=[3, 8],
+                        help='degrees swept for the families taking one')
+    parser.add_argument('--seeds', type=int, default=3, help='seeds 0..seeds-1 are run for every configuration')
+    parser.add_argument('--engines', nargs='+', default=['inline'], choices=ENGINES)
+    parser.add_argument('--processes', type=int, default=None, help='worker processes (default: number of CPUs)')
+    parser.add_argument('--cache', default='sweep_cache', help='directory of cached graphs and results')
+    parser.add_argument('--force', action='store_true', help='run cached cells again')
+    parser.add_argument('--out', default='sweep.csv', help='one row per run')
+    parser.add_argument('--summary', default='sweep_summary.csv', help='one row per configuration, averaged over seeds')
+    args = parser.parse_args()
+
+    grid = {'family': args.families, 'n': args.n, 'degree': args.degrees, 'seed': list(range(args.seeds)),
+            'engine': args.engines}
+    results = sweep(grid, args.cache, args.processes, args.force)
+    results.sort(key=lambda r: (r['family'], r['n'], str(r['degree']), r['engine'], r['seed']))
+    write_csv(args.out, results, FIELDS)
+    summary = aggregate(results)
+    write_csv(args.summary, summary, SUMMARY_FIELDS)
+
+    print('%-10s %8s %6s %-9s %4s %7s %7s %7s %10s %s' % ('family', 'n', 'degree', 'engine', 'runs', 'delta',
+                                                         'rounds', 'colors', 'time (s)', 'check'))
+    for row in summary:
+        print('%-10s %8d %6s %-9s %4d %7.1f %7.1f %7.1f %10.3f %s' %
+              (row['family'], row['n'], row['degree'], row['engine'], row['runs'], row['delta'], row['rounds'],
+               row['colors'], row['wall_time'], 'ok' if row['correct'] else 'WRONG'))
@@ -0,0 +1,50 @@
+import os
+import sys
+import threading
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import lib
+from AGColoring_mps import run_coloring
+from congest import CongestViolation
+
+ENGINES = ('threaded', 'inline')
+
+
+# Runs the coloring in a thread so a hanging engine fails the test instead of blocking it
+def run(timeout=60, **kwargs):
+    outcome = {}
+
+    def target():
+        try:
+            outcome['mps'] = run_coloring(lib.gen_ring(8), record_history=False, congest=True, **kwargs)
+        except Exception as e:
+            outcome['error'] = e
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), 'engine %s did not stop' % (kwargs['engine'],)
+    return outcome
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_strict_violation_is_raised(engine):
+    outcome = run(engine=engine, congest_bandwidth=1, congest_strict=True)
+    assert isinstance(outcome.get('error'), CongestViolation)
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_violations_are_recorded(engine):
+    mps = run(engine=engine, congest_bandwidth=1)['mps']
+    assert mps.congest.n_violations > 0
+    assert len(mps.global_shared_memory) == 8
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_within_bandwidth(engine):
+    mps = run(engine=engine)['mps']
+    assert mps.congest.n_violations == 0
+    colors = [x['color'][1] for x in mps.global_shared_memory.values()]
+    assert all(colors[i] != colors[(i + 1) % 8] for i in range(8))
@@ -0,0 +1,136 @@
+import json
+import pickle
+import queue
+import struct
+import sys
+import threading
+import time
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+LEVEL_NAMES = {DEBUG: 'DEBUG', INFO: 'INFO', WARNING: 'WARNING'}
+
+
+# Prints events right away, same output as the old verbose mode.
+class PrintSink:
+    def __init__(self, stream=None):
+        self.stream = stream
+
+    def write(self, event):
+        if event['pid'] is None:
+            line = '[Message Passing System]: %s' % (event['msg'],)
+        else:
+            line = 'PID %s: %s' % (event['pid'], event['msg'])
+        print(line, file=self.stream or sys.stdout)
+
+    def close(self):
+        pass
+
+
+# Sink writing events from a background thread, so callers only pay for a queue put.
+# Subclasses define encode(event) -> bytes.
+class BufferedSink:
+    def __init__(self, path, batch_size=1024):
+        self.file = open(path, 'wb')
+        self.batch_size = batch_size
+        self.events = queue.Queue()
+        self.writer = threading.Thread(target=self.write_loop, daemon=True)
+        self.writer.start()
+
+    def encode(self, event):
+        raise NotImplementedError
+
+    def write(self, event):
+        self.events.put(event)
+
+    def write_loop(self):
+        done = False
+        while not done:
+            batch = [self.events.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.events.get_nowait())
+                except queue.Empty:
+                    break
+            if batch[-1] is None:
+                batch.pop()
+                done = True
+            self.file.write(b''.join([self.encode(e) for e in batch]))
+        self.file.flush()
+
+    # Write all pending events and close the file
+    def close(self):
+        if self.writer.is_alive():
+            self.events.put(None)
+            self.writer.join()
+            self.file.close()
+
+
+# One JSON object per line
+class JsonlSink(BufferedSink):
+    def encode(self, event):
+        return (json.dumps(event, default=str) + '\n').encode('utf-8')
+
+
+# Length prefixed pickle records, read back with read_binary
+class BinarySink(BufferedSink):
+    def encode(self, event):
+        data = pickle.dumps(event, protocol=pickle.HIGHEST_PROTOCOL)
+        return struct.pack('<I', len(data)) + data
+
+
+def read_binary(path):
+    with open(path, 'rb') as f:
+        while True:
+            header = f.read(4)
+            if len(header) < 4:
+                return
+            yield pickle.loads(f.read(struct.unpack('<I', header)[0]))
+
+
+# Filters events by level, node and round before anything is formatted.
+#   nodes: only trace these pids. node_rate: trace a fixed pseudo random fraction of the nodes.
+#   round_every: only trace rounds that are a multiple of it.
+# System events (pid None) are only filtered by level.
+class Tracer:
+    def __init__(self, sink, level=INFO, nodes=None, node_rate=None, round_every=None, seed=0):
+        self.sink = sink
+        self.level = level
+        self.nodes = set(nodes) if nodes is not None else None
+        self.node_rate = node_rate
+        self.round_every = round_every
+        self.seed = seed
+        # Updated by the message passing system at every round
+        self.round = 0
+
+    def node_sampled(self, pid):
+        if self.nodes is not None and pid not in self.nodes:
+            return False
+        if self.node_rate is not None:
+            h = (pid * 2654435761 + self.seed * 40503) % 4294967296
+            return h < self.node_rate * 4294967296
+        return True
+
+    def enabled(self, pid, level):
+        if level < self.level:
+            return False
+        if pid is None:
+            return True
+        if self.round_every is not None and self.round % self.round_every != 0:
+            return False
+        return self.node_sampled(pid)
+
+    def log(self, pid, level, msg, args=()):
+        if not self.enabled(pid, level):
+            return
+        self.sink.write({
+            't': time.time(),
+            'round': self.round,
+            'pid': pid,
+            'level': LEVEL_NAMES.get(level, level),
+            'msg': msg % args if args else msg,
+        })
+
+    def close(self):
+        self.sink.close()
@@ -0,0 +1,290 @@
+import hashlib
+import hmac
+import os
+import pickle
+import queue
+import shutil
+import socket
+import struct
+import sys
+import tempfile
+import threading
+from array import array
+from multiprocessing import AuthenticationError
+import numpy as np
+from MessagePassingSystem import shard_core
+from congest import CongestViolation
+
+# Every frame is its payload length (4 bytes, big endian) followed by the payload
+LENGTH = struct.Struct('>I')
+# Round number and message count of a binary round frame
+ROUND_HEADER = struct.Struct('<iI')
+FAMILIES = ('tcp', 'unix')
+STOP, CONTINUE = b'S', b'C'
+# Random challenge of the handshake, and seconds a new connection has to complete it
+CHALLENGE_BYTES = 32
+HANDSHAKE_TIMEOUT = 10.0
+# Environment variable holding the key of shards started from the command line
+AUTHKEY_ENV = 'MPS_AUTHKEY'
+
+
+# Listening socket of family 'tcp' (address (host, port), default an ephemeral port on localhost)
+# or 'unix' (address a path, default a new temporary directory). Returns the socket and its address.
+def listen(family, address=None, backlog=128):
+    if family == 'tcp':
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(tuple(address) if address is not None else ('127.0.0.1', 0))
+    elif family == 'unix':
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(address if address is not None else os.path.join(tempfile.mkdtemp(prefix='mps-'), 'sock'))
+    else:
+        raise ValueError('transport must be one of %s' % (', '.join(FAMILIES),))
+    sock.listen(backlog)
+    return sock, sock.getsockname()
+
+
+def connect(family, address, authkey):
+    if family == 'tcp':
+        sock = socket.create_connection(tuple(address))
+    else:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(address)
+    return authenticate(setup(sock, family), authkey, b'C')
+
+
+# Frames are written whole, small ones must not wait for more data
+def setup(sock, family):
+    if family == 'tcp':
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return sock
+
+
+# Removes the temporary directory of a default unix socket address
+def cleanup(family, address):
+    if family == 'unix' and os.path.basename(os.path.dirname(address)).startswith('mps-'):
+        shutil.rmtree(os.path.dirname(address), ignore_errors=True)
+
+
+def send_frame(sock, payload):
+    sock.sendall(LENGTH.pack(len(payload)) + payload)
+
+
+def recv_exact(sock, n):
+    buf = bytearray(n)
+    view = memoryview(buf)
+    pos = 0
+    while pos < n:
+        k = sock.recv_into(view[pos:])
+        if k == 0:
+            raise ConnectionError('Connection closed by peer')
+        pos += k
+    return buf
+
+
+# limit bounds the length accepted, e.g. from a peer not authenticated yet
+def recv_frame(sock, limit=None):
+    length = LENGTH.unpack(recv_exact(sock, LENGTH.size))[0]
+    if limit is not None and length > limit:
+        raise ConnectionError('Frame of %d bytes, at most %d expected' % (length, limit))
+    return bytes(recv_exact(sock, length))
+
+
+def answer(authkey, role, challenge):
+    return hmac.new(authkey, role + challenge, hashlib.sha256).digest()
+
+
+# Mutual challenge-response run on every new connection before anything is unpickled from it:
+# each side sends a random challenge and proves it holds authkey with the HMAC of the other's.
+# The role (b'A' accepting, b'C' connecting) is part of the HMAC, so a challenge sent back by
+# the peer cannot be answered with our own answer. Raises AuthenticationError otherwise.
+def authenticate(sock, authkey, role):
+    timeout = sock.gettimeout()
+    sock.settimeout(HANDSHAKE_TIMEOUT)
+    try:
+        challenge = os.urandom(CHALLENGE_BYTES)
+        send_frame(sock, challenge)
+        peer_challenge = recv_frame(sock, CHALLENGE_BYTES)
+        send_frame(sock, answer(authkey, role, peer_challenge))
+        peer_role = b'C' if role == b'A' else b'A'
+        if not hmac.compare_digest(recv_frame(sock, 64), answer(authkey, peer_role, challenge)):
+            raise AuthenticationError('Peer failed to authenticate')
+    except (OSError, ConnectionError) as e:
+        raise AuthenticationError('Handshake failed: %s' % (e,))
+    finally:
+        sock.settimeout(timeout)
+    return sock
+
+
+# Next connection of listener completing the handshake, the others are dropped
+def accept(listener, family, authkey):
+    while True:
+        sock, _ = listener.accept()
+        try:
+            return authenticate(setup(sock, family), authkey, b'A')
+        except AuthenticationError:
+            sock.close()
+
+
+def send_object(sock, obj):
+    send_frame(sock, pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def recv_object(sock):
+    return pickle.loads(recv_frame(sock))
+
+
+# Messages (item, src, target) of one round to one shard as a frame. With a congest.MsgSchema of
+# at most 64 bits the frame is binary: round and count, the src, target pairs as little endian
+# int32, then every message packed in schema.n_bytes bytes. Packing is done on all messages of
+# the frame at once with NumPy. Without a schema the messages are pickled.
+def encode_round(r, pkgs, schema):
+    if schema is None or schema.width > 64:
+        return b'P' + pickle.dumps((r, pkgs), protocol=pickle.HIGHEST_PROTOCOL)
+    encode = schema.encode
+    values = array('q')
+    for item, src, target in pkgs:
+        values.append(src)
+        values.append(target)
+        values.extend(encode(item))
+    rows = np.frombuffer(values, dtype=np.int64).reshape(len(pkgs), len(schema.field_widths) + 2)
+    fields = rows[:, 2:]
+    if ((fields < 0) | (fields >> np.array(schema.field_widths))).any():
+        raise CongestViolation('Messages of round %d do not fit the schema %s' % (r, str(schema.widths)))
+    packed = np.zeros(len(pkgs), dtype='<u8')
+    for j, shift in enumerate(schema.shifts):
+        packed |= fields[:, j].astype(np.uint64) << np.uint64(shift)
+    ends = rows[:, :2].astype('<i4')
+    data = packed.view(np.uint8).reshape(-1, 8)[:, :schema.n_bytes]
+    return b'S' + ROUND_HEADER.pack(r, len(pkgs)) + ends.tobytes() + data.tobytes()
+
+
+def decode_round(frame, schema):
+    if frame[:1] == b'P':
+        return pickle.loads(frame[1:])
+    r, count = ROUND_HEADER.unpack_from(frame, 1)
+    offset = 1 + ROUND_HEADER.size
+    ends = np.frombuffer(frame, dtype='<i4', count=2 * count, offset=offset).reshape(count, 2)
+    offset += 8 * count
+    raw = np.zeros((count, 8), dtype=np.uint8)
+    raw[:, :schema.n_bytes] = np.frombuffer(frame, dtype=np.uint8, count=count * schema.n_bytes,
+                                            offset=offset).reshape(count, schema.n_bytes)
+    packed = raw.view('<u8').ravel()
+    k = len(schema.field_widths)
+    fields = np.empty((count, k), dtype=np.uint64)
+    for j, (w, shift) in enumerate(zip(schema.field_widths, schema.shifts)):
+        fields[:, j] = (packed >> np.uint64(shift)) & np.uint64((1 << w) - 1)
+    values = fields.ravel().tolist()
+    decode = schema.decode
+    srcs, targets = ends[:, 0].tolist(), ends[:, 1].tolist()
+    return r, [(decode(values, i * k), srcs[i], targets[i]) for i in range(count)]
+
+
+# Replaces the pipe of shard_core in a shard process of the socket engine. Each round, the
+# messages for every other shard go in one frame on the connection kept open to it (empty frames
+# included, a frame tells the peer the round is complete), and the shard's report goes to the
+# coordinator, which answers whether to run another round. The frames of the peers are read by
+# one thread per connection, so sending never waits on a peer that is sending too.
+class ShardLink:
+    def __init__(self, control, peers, schema):
+        self.control = control
+        self.peers = peers
+        self.schema = schema
+        self.inbox = {shard: queue.Queue() for shard in peers}
+        self.round = 0
+        self.stopped = False
+        self.frames = 0
+        self.bytes_sent = 0
+        for shard, sock in peers.items():
+            threading.Thread(target=self.read, args=(sock, self.inbox[shard]), daemon=True).start()
+
+    @staticmethod
+    def read(sock, inbox):
+        try:
+            while True:
+                inbox.put(recv_frame(sock))
+        except (ConnectionError, OSError) as e:
+            inbox.put(e)
+
+    # Round reports (remote messages per shard, alive, all inactive, statistics) as in shard_core,
+    # the final results once stopped
+    def send(self, obj):
+        if self.stopped:
+            send_object(self.control, (obj, (self.frames, self.bytes_sent)))
+            return
+        remote, n_alive, inactive, report = obj
+        for shard, sock in self.peers.items():
+            frame = encode_round(self.round, remote.get(shard, ()), self.schema)
+            send_frame(sock, frame)
+            self.frames += 1
+            self.bytes_sent += LENGTH.size + len(frame)
+        send_object(self.control, (n_alive, inactive, report))
+
+    # Messages of the other shards for the round, None when the coordinator stops the run
+    def recv(self):
+        if recv_frame(self.control) == STOP:
+            self.stopped = True
+            return None
+        incoming = []
+        for shard, inbox in self.inbox.items():
+            frame = inbox.get()
+            if isinstance(frame, Exception):
+                raise ConnectionError('Lost connection to shard %d: %s' % (shard, frame))
+            r, pkgs = decode_round(frame, self.schema)
+            if r != self.round:
+                raise ConnectionError('Shard %d sent round %d during round %d' % (shard, r, self.round))
+            incoming.extend(pkgs)
+        self.round += 1
+        return incoming
+
+    def close(self):
+        for sock in self.peers.values():
+            sock.close()
+        self.control.close()
+
+
+# Body of a shard process of the socket engine, connecting to the coordinator at address.
+# Shards listen on the interface they reach the coordinator through, so they can run on other
+# machines: MPS_AUTHKEY=key python transport.py tcp HOST PORT
+# Every connection is authenticated with authkey, the key of the coordinator.
+def shard_main(family, address, authkey):
+    control = connect(family, address, authkey)
+    if family == 'tcp':
+        listener, own_address = listen(family, (control.getsockname()[0], 0))
+    else:
+        listener, own_address = listen(family)
+    send_object(control, own_address)
+    shard, proc_class, proc_args, neighbors, owner, addresses, collect_stats, edge_stats = recv_object(control)
+
+    # Full mesh, one connection per pair of shards reused for the whole run:
+    # a shard connects to the shards after it and accepts the ones before it
+    peers = {}
+    for other in range(shard + 1, len(addresses)):
+        sock = connect(family, addresses[other], authkey)
+        send_object(sock, shard)
+        peers[other] = sock
+    for _ in range(shard):
+        sock = accept(listener, family, authkey)
+        peers[recv_object(sock)] = sock
+    listener.close()
+    cleanup(family, own_address)
+
+    # Processors declaring a msg_schema get binary frames
+    pid = next(iter(proc_args))
+    schema = proc_class(pid=pid, is_async=False, **proc_args[pid]).msg_schema()
+    link = ShardLink(control, dict(sorted(peers.items())), schema)
+    shard_core(link, shard, proc_class, proc_args, neighbors, owner, collect_stats, edge_stats)
+
+
+if __name__ == '__main__':
+    key = os.environ.get(AUTHKEY_ENV)
+    if not key:
+        print('%s must hold the transport_authkey of the system' % (AUTHKEY_ENV,))
+        sys.exit(1)
+    if sys.argv[1:2] == ['tcp'] and len(sys.argv) == 4:
+        shard_main('tcp', (sys.argv[2], int(sys.argv[3])), key.encode())
+    elif sys.argv[1:2] == ['unix'] and len(sys.argv) == 3:
+        shard_main('unix', sys.argv[2], key.encode())
+    else:
+        print('usage: %s=key python transport.py tcp HOST PORT | python transport.py unix PATH' % (AUTHKEY_ENV,))
+        sys.exit(1)
@@ -0,0 +1,120 @@
+import multiprocessing
+import numpy as np
+
+# Directed CSR entries checked at once, bounds the memory of a chunk
+CHUNK_SIZE = 1 << 22
+
+# Arrays of the pool workers, installed by init_worker
+_indptr = _indices = _colors = None
+
+
+def init_worker(indptr, indices, colors):
+    global _indptr, _indices, _colors
+    _indptr, _indices, _colors = indptr, indices, colors
+
+
+# Edges (u, v), u < v, among the CSR entries lo..hi whose endpoints have equal colors.
+# colors is either one color per node or an (n, k) array, then edges equal in any column count.
+def chunk_conflicts(indptr, indices, colors, lo, hi):
+    owner = np.searchsorted(indptr, np.arange(lo, hi), side='right') - 1
+    nb = indices[lo:hi]
+    keep = owner < nb
+    owner, nb = owner[keep], nb[keep]
+    same = colors[owner] == colors[nb]
+    if same.ndim > 1:
+        same = same.any(axis=1)
+    return np.column_stack([owner[same], nb[same]])
+
+
+def pool_chunk_conflicts(bounds):
+    return chunk_conflicts(_indptr, _indices, _colors, *bounds)
+
+
+def chunk_bounds(total, chunk_size):
+    return [(lo, min(lo + chunk_size, total)) for lo in range(0, total, chunk_size)]
+
+
+# Conflicting edges of a coloring over CSR adjacency (see lib.to_csr), as an (k, 2) array.
+# Entries are checked in chunks of chunk_size / columns, in processes worker processes if given.
+def find_conflicts(indptr, indices, colors, chunk_size=CHUNK_SIZE, processes=None):
+    colors = np.asarray(colors)
+    columns = colors.shape[1] if colors.ndim > 1 else 1
+    bounds = chunk_bounds(len(indices), max(chunk_size // columns, 1))
+    if processes and processes > 1 and len(bounds) > 1:
+        with multiprocessing.Pool(processes, initializer=init_worker, initargs=(indptr, indices, colors)) as pool:
+            parts = pool.map(pool_chunk_conflicts, bounds)
+    else:
+        parts = [chunk_conflicts(indptr, indices, colors, lo, hi) for lo, hi in bounds]
+    return np.concatenate(parts) if parts else np.zeros((0, 2), dtype=np.int64)
+
+
+# Problems of the final colors: outside 0..delta, i.e. more than delta + 1 colors
+def check_palette(colors, delta):
+    colors = np.asarray(colors)
+    problems = []
+    outside = np.nonzero((colors < 0) | (colors > delta))[0]
+    if len(outside):
+        problems.append('%d nodes have colors outside 0..%d, e.g. node %d has %d'
+                        % (len(outside), delta, outside[0], colors[outside[0]]))
+    return problems
+
+
+# Problems of an AG coloring history, an (n, 1 + q + (q - delta), 2) array (ResultStore.history):
+#   AG stage, rounds 0..q-1: a node either moves (a, b) -> (a, a + b mod q) or becomes (0, b),
+#   and all nodes are finalized (a == 0) after it with a proper coloring.
+#   Reduction, one round per j = q..delta+1: only nodes with b == j change, all of them to a
+#   color at most delta, and the coloring stays proper.
+def check_history(indptr, indices, history, q, delta, chunk_size=CHUNK_SIZE, processes=None):
+    history = np.asarray(history)
+    n, length, _ = history.shape
+    problems = []
+    if length != 1 + q + (q - delta):
+        return ['History has %d rounds, expected %d' % (length, 1 + q + (q - delta))]
+    a, b = history[:, :, 0].astype(np.int64), history[:, :, 1].astype(np.int64)
+
+    prev_a, prev_b, next_a, next_b = a[:, :q], b[:, :q], a[:, 1:q + 1], b[:, 1:q + 1]
+    moved = (next_a == prev_a) & (next_b == (prev_a + prev_b) % q)
+    finalized = (next_a == 0) & (next_b == prev_b)
+    bad = ~(moved | finalized)
+    if bad.any():
+        pid, r = np.argwhere(bad)[0]
+        problems.append('%d invalid AG steps, e.g. node %d in round %d: %s -> %s'
+                        % (bad.sum(), pid, r, tuple(history[pid, r].tolist()),
+                           tuple(history[pid, r + 1].tolist())))
+    not_final = np.nonzero(a[:, q] != 0)[0]
+    if len(not_final):
+        problems.append('%d nodes not finalized after the AG stage, e.g. node %d' % (len(not_final), not_final[0]))
+
+    j = q - np.arange(q - delta)
+    prev_b, next_a, next_b = b[:, q:-1], a[:, q + 1:], b[:, q + 1:]
+    reduced = prev_b == j
+    bad = np.where(reduced, (next_b > delta) | (next_a != 0), (next_b != prev_b) | (next_a != a[:, q:-1]))
+    if bad.any():
+        pid, r = np.argwhere(bad)[0]
+        problems.append('%d invalid reduction steps, e.g. node %d at j = %d: %s -> %s'
+                        % (bad.sum(), pid, j[r], tuple(history[pid, q + r].tolist()),
+                           tuple(history[pid, q + r + 1].tolist())))
+
+    conflicts = find_conflicts(indptr, indices, b[:, q:], chunk_size, processes)
+    if len(conflicts):
+        u, v = conflicts[0]
+        rounds = np.nonzero(b[u, q:] == b[v, q:])[0]
+        problems.append('%d edges with equal colors after the AG stage, e.g. %d - %d from round %d'
+                        % (len(conflicts), u, v, q + rounds[0]))
+    return problems
+
+
+# All problems of a coloring (an int array of final colors, or a results.ResultStore whose history
+# is also checked when q is given), [] when it is a proper coloring with at most delta + 1 colors.
+def validate(indptr, indices, result, delta, q=None, chunk_size=CHUNK_SIZE, processes=None):
+    history = getattr(result, 'history', None)
+    colors = np.asarray(getattr(result, 'colors', result))
+    problems = check_palette(colors, delta)
+    conflicts = find_conflicts(indptr, indices, colors, chunk_size, processes)
+    if len(conflicts):
+        problems.append('%d edges with equal colors, e.g. %d - %d' % (len(conflicts), conflicts[0][0], conflicts[0][1]))
+    if history is not None and q is not None:
+        problems += check_history(indptr, indices, history, q, delta, chunk_size, processes)
+        if not (history[:, -1, 1] == colors).all():
+            problems.append('Final colors differ from the last round of the history')
+    return problems
@@ -1,5 +1,9 @@
+import colorsys
+import math
 import plotly
+import plotly.io
 import plotly.graph_objs as go
+import numpy as np
 import lib
 import random
 
@@ -7,8 +11,8 @@ import random
 def edge_trace(G):
     xs, ys = [], []
     for edge in G.edges():
-        x0, y0 = G.node[edge[0]]['pos']
-        x1, y1 = G.node[edge[1]]['pos']
+        x0, y0 = G.nodes[edge[0]]['pos']
+        x1, y1 = G.nodes[edge[1]]['pos']
         xs += (x0, x1, None)
         ys += (y0, y1, None)
     return go.Scatter(x=xs, y=ys, line=dict(width=0.5,color='#888'), hoverinfo='none', mode='lines')
@@ -32,7 +36,7 @@ def node_trace(G, color_mapping, i2c_mapping, node_text):
     else:
         integer2color = i2c_mapping
     for node, adjacencies in enumerate(G.adjacency()):
-        x, y = G.node[node]['pos']
+        x, y = G.nodes[node]['pos']
         xs.append(x)
         ys.append(y)
 
@@ -75,6 +79,196 @@ def plot(G, color_mapping=None, filename='gcoloring.html', i2c_mapping=None, aut
     plotly.offline.plot(fig(G, color_mapping, i2c_mapping, **kwargs), filename=filename, auto_open=auto_open)
 
 
+# Positions (n, 2) and edges (src, dst arrays) of a networkx graph with nodes 0..n-1 and a 'pos'
+# attribute, or of a graphgen.CSRGraph with positions
+def graph_arrays(graph):
+    if hasattr(graph, 'indptr'):
+        src, dst = zip(*graph.edge_chunks()) if graph.m else ((), ())
+        src = np.concatenate(src) if src else np.zeros(0, dtype=np.int64)
+        dst = np.concatenate(dst) if dst else np.zeros(0, dtype=np.int64)
+        return np.asarray(graph.pos, dtype=np.float32), src, dst
+    n = graph.number_of_nodes()
+    pos = np.array([graph.nodes[v]['pos'] for v in range(n)], dtype=np.float32).reshape(n, 2)
+    edges = np.array(list(graph.edges()), dtype=np.int64).reshape(-1, 2)
+    return pos, edges[:, 0], edges[:, 1]
+
+
+# k distinct colors spread around the hue circle, the same for every run
+def palette(k):
+    hues = (np.arange(k) * 0.618033988749895) % 1
+    return ['rgb(%d,%d,%d)' % tuple(int(255 * c) for c in colorsys.hsv_to_rgb(h, 0.75, 0.9)) for h in hues]
+
+
+# Line coordinates of edges, one NaN separated segment per edge
+def edge_segments(pos, src, dst):
+    xy = np.full((len(src), 3, 2), np.nan, dtype=np.float32)
+    xy[:, 0], xy[:, 1] = pos[src], pos[dst]
+    xy = xy.reshape(-1, 2)
+    return xy[:, 0], xy[:, 1]
+
+
+# Colorscale mapping the numbers 0..k-1 to the palette, with cmin=-0.5 and cmax=k-0.5
+def stepped_colorscale(k):
+    scale = []
+    for i, c in enumerate(palette(k)):
+        scale += [[i / k, c], [(i + 1) / k, c]]
+    return scale
+
+
+# Level of detail by sampling: at most max_nodes random nodes, the edges among them,
+# and at most max_edges of those. Returns the kept node ids and edges.
+def sample_graph(n, src, dst, max_nodes, max_edges, seed=0):
+    rng = np.random.RandomState(seed)
+    nodes = np.arange(n)
+    if n > max_nodes:
+        nodes = np.sort(rng.choice(n, max_nodes, replace=False))
+        kept = np.zeros(n, dtype=bool)
+        kept[nodes] = True
+        keep = kept[src] & kept[dst]
+        src, dst = src[keep], dst[keep]
+    if len(src) > max_edges:
+        keep = np.sort(rng.choice(len(src), max_edges, replace=False))
+        src, dst = src[keep], dst[keep]
+    return nodes, src, dst
+
+
+# Level of detail by aggregation on a grid of about max_nodes markers: the nodes of one color in a
+# cell become one marker at their mean position, sized by their count, and the edges between two
+# cells one segment between the cell centers (the max_edges busiest ones).
+# Returns marker positions, colors, counts, and the segments as (start, end) positions.
+def aggregate_graph(pos, colors, src, dst, max_nodes, max_edges):
+    n_colors = int(colors.max()) + 1 if len(colors) else 1
+    # Every cell can hold a marker per color
+    k = max(1, int(math.sqrt(max_nodes / n_colors)))
+    lo, hi = pos.min(axis=0), pos.max(axis=0)
+    cell_xy = np.minimum(((pos - lo) / np.maximum(hi - lo, 1e-12) * k).astype(np.int64), k - 1)
+    cell = cell_xy[:, 0] * k + cell_xy[:, 1]
+
+    groups, group = np.unique(cell * n_colors + colors, return_inverse=True)
+    counts = np.bincount(group)
+    centers = np.column_stack([np.bincount(group, pos[:, 0]), np.bincount(group, pos[:, 1])]) / counts[:, None]
+
+    cell_counts = np.bincount(cell, minlength=k * k)
+    cell_centers = np.column_stack([np.bincount(cell, pos[:, 0], k * k), np.bincount(cell, pos[:, 1], k * k)]) / \
+        np.maximum(cell_counts, 1)[:, None]
+    cu, cv = np.minimum(cell[src], cell[dst]), np.maximum(cell[src], cell[dst])
+    inter = cu != cv
+    pairs, weights = np.unique(cu[inter] * (k * k) + cv[inter], return_counts=True)
+    pairs = pairs[np.argsort(-weights, kind='stable')[:max_edges]]
+    return centers.astype(np.float32), groups % n_colors, counts, \
+        (cell_centers[pairs // (k * k)].astype(np.float32), cell_centers[pairs % (k * k)].astype(np.float32))
+
+
+# WebGL figure of a colored graph for large runs: coordinates are built as arrays in one pass and
+# drawn with Scattergl. Graphs with more than max_nodes nodes or max_edges edges are reduced with
+# lod 'sample' (random nodes and edges) or 'grid' (aggregated per grid cell and color).
+# colors is a mapping or array node -> color, graph as in graph_arrays.
+def webgl_fig(graph, colors, max_nodes=50000, max_edges=200000, lod='sample', node_size=None, text='', seed=0):
+    pos, src, dst = graph_arrays(graph)
+    n = len(pos)
+    if isinstance(colors, dict):
+        colors = np.array([colors[v] for v in range(n)], dtype=np.int64)
+    colors = np.asarray(colors, dtype=np.int64)
+    size = node_size or float(np.clip(400 / math.sqrt(max(min(n, max_nodes), 1)), 2, 20))
+
+    if lod == 'grid' and (n > max_nodes or len(src) > max_edges):
+        centers, marker_colors, counts, (start, end) = aggregate_graph(pos, colors, src, dst, max_nodes, max_edges)
+        seg = np.full((len(start), 3, 2), np.nan, dtype=np.float32)
+        seg[:, 0], seg[:, 1] = start, end
+        ex, ey = seg.reshape(-1, 2)[:, 0], seg.reshape(-1, 2)[:, 1]
+        x, y = centers[:, 0], centers[:, 1]
+        sizes = size * np.sqrt(counts / counts.mean())
+        customdata = np.column_stack([marker_colors, counts])
+        hover = 'color %{customdata[0]}<br>%{customdata[1]} nodes<extra></extra>'
+        summary = '%d nodes in %d markers, %d cell links' % (n, len(x), len(start))
+    elif lod in ('sample', 'grid'):
+        nodes, src, dst = sample_graph(n, src, dst, max_nodes, max_edges, seed)
+        ex, ey = edge_segments(pos, src, dst)
+        x, y = pos[nodes, 0], pos[nodes, 1]
+        marker_colors = colors[nodes]
+        sizes = size
+        customdata = np.column_stack([nodes, marker_colors])
+        hover = 'PID %{customdata[0]}<br>color %{customdata[1]}<extra></extra>'
+        summary = '%d of %d nodes, %d edges shown' % (len(nodes), n, len(src))
+    else:
+        raise ValueError("lod must be 'sample' or 'grid'")
+
+    # Numeric colors on a stepped colorscale, much cheaper to validate and embed than color strings
+    k = int(colors.max()) + 1 if n else 1
+    scale = stepped_colorscale(k)
+    edges = go.Scattergl(x=ex, y=ey, mode='lines', line=dict(width=0.5, color='#888'), hoverinfo='none')
+    nodes_trace = go.Scattergl(x=x, y=y, mode='markers', customdata=customdata, hovertemplate=hover,
+                               marker=dict(color=marker_colors, colorscale=scale, cmin=-0.5, cmax=k - 0.5,
+                                           size=sizes, line=dict(width=0)))
+    layout = go.Layout(title='Locally-iterative Graph Coloring', showlegend=False, hovermode='closest',
+                       margin=dict(b=20, l=5, r=5, t=40),
+                       annotations=[dict(text='%s<br>%s' % (text, summary) if text else summary, showarrow=False,
+                                         xref='paper', yref='paper', x=0.005, y=-0.002)],
+                       xaxis=dict(showgrid=False, zeroline=False, showticklabels=False),
+                       yaxis=dict(showgrid=False, zeroline=False, showticklabels=False))
+    return go.Figure(data=[edges, nodes_trace], layout=layout)
+
+
+# Writes fig without opening a browser: an image for .png/.svg/.pdf/.jpg/.webp (needs kaleido,
+# or orca with older plotly), otherwise an HTML file loading plotly.js from the CDN.
+# Coordinates are float32 arrays, which recent plotly versions embed as binary.
+def export(fig, filename):
+    if filename.rsplit('.', 1)[-1].lower() in ('png', 'svg', 'pdf', 'jpg', 'jpeg', 'webp'):
+        plotly.io.write_image(fig, filename)
+    else:
+        plotly.offline.plot(fig, filename=filename, auto_open=False, include_plotlyjs='cdn')
+
+
+def plot_large(graph, colors, filename='gcoloring.html', **kwargs):
+    export(webgl_fig(graph, colors, **kwargs), filename)
+
+
+# Animated round by round replay of a coloring from a history.ColorHistory (indexed), one frame
+# per round with the b component of the colors, which is the color of the AG stage and then the
+# final color. Large graphs are sampled as in webgl_fig, only the node colors change between frames.
+def replay_fig(graph, history, rounds=None, max_nodes=20000, max_edges=100000, node_size=None, seed=0,
+               duration=300):
+    pos, src, dst = graph_arrays(graph)
+    n = len(pos)
+    nodes, src, dst = sample_graph(n, src, dst, max_nodes, max_edges, seed)
+    rounds = list(range(history.n_rounds)) if rounds is None else list(rounds)
+    size = node_size or float(np.clip(400 / math.sqrt(max(len(nodes), 1)), 2, 20))
+    frame_colors = [history.snapshot(r)[1][nodes] for r in rounds]
+    k = max([int(c.max()) + 1 for c in frame_colors if len(c)], default=1)
+    scale = stepped_colorscale(k)
+
+    ex, ey = edge_segments(pos, src, dst)
+    edges = go.Scattergl(x=ex, y=ey, mode='lines', line=dict(width=0.5, color='#888'), hoverinfo='none')
+
+    def nodes_trace(colors):
+        return go.Scattergl(x=pos[nodes, 0], y=pos[nodes, 1], mode='markers', customdata=nodes,
+                            hovertemplate='PID %{customdata}<br>color %{marker.color}<extra></extra>',
+                            marker=dict(color=colors, colorscale=scale, cmin=-0.5, cmax=k - 0.5, size=size,
+                                        line=dict(width=0)))
+
+    # Frames only carry the colors, merged into the nodes trace when animating
+    frames = [go.Frame(data=[go.Scattergl(marker=dict(color=colors))], traces=[1], name=str(r))
+              for r, colors in zip(rounds, frame_colors)]
+    animation = dict(frame=dict(duration=duration, redraw=True), transition=dict(duration=0), mode='immediate')
+    layout = go.Layout(title='Locally-iterative Graph Coloring', showlegend=False, hovermode='closest',
+                       margin=dict(b=20, l=5, r=5, t=40),
+                       xaxis=dict(showgrid=False, zeroline=False, showticklabels=False),
+                       yaxis=dict(showgrid=False, zeroline=False, showticklabels=False),
+                       updatemenus=[dict(type='buttons', showactive=False, x=0, y=0, xanchor='right', yanchor='top',
+                                         buttons=[dict(label='Play', method='animate', args=[None, animation]),
+                                                  dict(label='Pause', method='animate',
+                                                       args=[[None], dict(animation, frame=dict(duration=0))])])],
+                       sliders=[dict(currentvalue=dict(prefix='Round '), pad=dict(t=30),
+                                     steps=[dict(label=str(r), method='animate', args=[[str(r)], animation])
+                                            for r in rounds])])
+    return go.Figure(data=[edges, nodes_trace(frame_colors[0] if frame_colors else [])], layout=layout,
+                     frames=frames)
+
+
+def replay(graph, history, filename='replay.html', **kwargs):
+    export(replay_fig(graph, history, **kwargs), filename)
+
+
 if __name__ == '__main__':
     G = lib.gen_random_graph()
     color_mapping = {i: i for i in range(len(G.nodes()))}